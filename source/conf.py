@@ -12,9 +12,9 @@
 # add these directories to sys.path here. If the directory is relative to the
 # documentation root, use os.path.abspath to make it absolute, like shown here.
 #
-# import os
-# import sys
-# sys.path.insert(0, os.path.abspath('.'))
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join('..', 'tools')))
 
 
 # -- Project information -----------------------------------------------------
@@ -41,6 +41,8 @@ release = u''
 extensions = [
     'sphinx.ext.todo',
     'sphinx.ext.mathjax',
+    'sphinx_bits',
+    'sphinx_protobuf',
 ]
 
 # Add any paths that contain templates here, relative to this directory.
@@ -0,0 +1,26 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The tools are scripts, not a package, and import each other by name
+sys.path.insert(0, os.path.join(ROOT, 'tools'))
+
+PROTODIR = os.path.join(ROOT, 'source', 'protobuf')
+
+
+@pytest.fixture
+def protodir(tmpdir):
+    # A scratch copy of the protobuf files, which tests may modify
+    dest = tmpdir.join('protobuf')
+    shutil.copytree(PROTODIR, str(dest))
+    return dest
+
+
+@pytest.fixture
+def protos(protodir):
+    return sorted(str(p) for p in protodir.listdir('*.proto'))
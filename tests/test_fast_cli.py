@@ -0,0 +1,101 @@
+import pytest
+
+import fast_cli
+
+
+def test_arguments_and_kwargs():
+    @fast_cli.argument('files', nargs='+')
+    @fast_cli.argument('--count', '-c', type=int, default=1)
+    @fast_cli.argument('--ignored', action='store_true')
+    def main(files, count=1):
+        return files, count
+
+    assert main.console(['a', 'b', '-c', '3']) == (['a', 'b'], 3)
+    # Options the function does not accept are not passed to it
+    assert main.console(['a', '--ignored']) == (['a'], 1)
+
+
+def test_argument_order():
+    @fast_cli.argument('first')
+    @fast_cli.argument('second')
+    def main(first, second):
+        return first, second
+
+    assert main.console(['1', '2']) == ('1', '2')
+
+
+def test_plain_function():
+    def main():
+        """Do nothing."""
+        return 'called'
+
+    assert fast_cli.console(main, []) == 'called'
+
+
+def test_errors():
+    @fast_cli.argument('--debug', '-d', action='store_true')
+    def main():
+        raise ValueError('failed')
+
+    assert main.console([]) == 'failed'
+    with pytest.raises(ValueError):
+        main.console(['--debug'])
+
+
+def test_usage_error(capsys):
+    @fast_cli.argument('--count', type=int)
+    def main(count=None):
+        pass
+
+    with pytest.raises(SystemExit) as exc:
+        main.console(['--count', 'x'])
+    assert exc.value.code == 2
+    assert 'invalid int value' in capsys.readouterr().err
+
+
+def _tool():
+    @fast_cli.argument('--verbose', '-v', action='store_true')
+    def main(verbose=False):
+        """
+        The tool.
+
+        More detail.
+        """
+        return 'A command must be selected'
+
+    @main.subcommand
+    @fast_cli.argument('names', nargs='*')
+    def show(names, verbose=False):
+        """Show the names."""
+        return 'show', names, verbose
+
+    @main.subcommand('two-words')
+    @fast_cli.argument('--count', type=int, default=0)
+    def two_words(count=0):
+        return 'two-words', count
+
+    return main
+
+
+def test_subcommands():
+    main = _tool()
+
+    assert main.console([]) == 'A command must be selected'
+    # The options of the command are passed to the subcommand too
+    assert main.console(['-v', 'show', 'a']) == ('show', ['a'], True)
+    assert main.console(['two-words', '--count', '2']) == ('two-words', 2)
+
+
+def test_help(capsys):
+    main = _tool()
+
+    with pytest.raises(SystemExit):
+        main.console(['--help'])
+    out = capsys.readouterr().out
+    assert 'The tool.' in out
+    assert 'More detail' not in out
+    assert 'two-words' in out
+
+    with pytest.raises(SystemExit):
+        main.console(['show', '--help'])
+    assert 'Show the names.' in capsys.readouterr().out
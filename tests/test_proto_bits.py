@@ -0,0 +1,83 @@
+import os
+import shutil
+
+import pytest
+
+import proto_bits
+from conftest import ROOT
+
+
+BITSDIR = os.path.join(ROOT, 'source', 'bits')
+
+
+@pytest.fixture
+def bits(tmpdir):
+    dest = tmpdir.join('bits')
+    shutil.copytree(BITSDIR, str(dest))
+    return sorted(str(p) for p in dest.listdir('*.bits'))
+
+
+def test_render_dir(bits, tmpdir, capsys):
+    outdir = tmpdir.join('out')
+
+    outputs = proto_bits.render_dir(bits, str(outdir), bare=True)
+    assert [fname for fname, _out in outputs] == bits
+    for fname, out in outputs:
+        with open(out) as f:
+            assert f.read() == proto_bits.render_file(fname, bare=True)
+    assert capsys.readouterr().out.count('Rendered') == len(bits)
+
+
+def test_render_dir_skips_unchanged(bits, tmpdir, capsys):
+    outdir = tmpdir.join('out')
+    proto_bits.render_dir(bits, str(outdir), bare=True)
+    capsys.readouterr()
+
+    hash_file = outdir.join(proto_bits.HASH_FILE)
+    for path in outdir.listdir():
+        path.setmtime(path.mtime() - 10)
+    mtimes = dict((p.basename, p.mtime()) for p in outdir.listdir())
+
+    # Nothing changed, so nothing is written, not even the hashes
+    proto_bits.render_dir(bits, str(outdir), bare=True)
+    assert capsys.readouterr().out == ''
+    assert dict((p.basename, p.mtime()) for p in outdir.listdir()) == mtimes
+
+    # Only the edited file is rendered again
+    with open(bits[0], 'a') as f:
+        f.write('\n')
+    proto_bits.render_dir(bits, str(outdir), bare=True)
+    assert capsys.readouterr().out.count('Rendered') == 1
+    assert hash_file.mtime() != mtimes[proto_bits.HASH_FILE]
+
+    # As is a file whose output is missing, or rendered differently
+    os.remove(str(outdir.join('carrier.txt')))
+    proto_bits.render_dir(bits, str(outdir), bare=True)
+    assert capsys.readouterr().out == 'Rendered %s\n' % outdir.join(
+        'carrier.txt',
+    )
+
+    proto_bits.render_dir(bits, str(outdir), indent='  ', bare=True)
+    assert capsys.readouterr().out.count('Rendered') == len(bits)
+
+
+def test_depfile(bits, tmpdir, capsys):
+    outdir = tmpdir.join('out')
+    depfile = outdir.join('bits.d')
+
+    assert proto_bits.main(
+        bits, output_dir=str(outdir), depfile=str(depfile),
+    ) is None
+
+    lines = depfile.read().splitlines()
+    for fname in bits:
+        out = outdir.join(os.path.basename(fname)[:-5] + '.txt')
+        assert '%s: %s' % (out, fname) in lines
+    assert lines[len(bits)].startswith('%s: ' % depfile)
+    assert lines[len(bits)].endswith('proto_bits.py \\')
+    assert [line.strip(' \\') for line in lines[len(bits) + 1:]] == bits
+
+
+def test_depfile_requires_output_dir(bits, tmpdir):
+    assert proto_bits.main(bits, depfile=str(tmpdir.join('bits.d'))) == \
+        '--depfile requires --output-dir'
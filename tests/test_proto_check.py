@@ -0,0 +1,293 @@
+import os
+
+import proto_check
+import proto_graph
+import protobuf_fmt
+
+
+def _parse(text, fname='test.proto'):
+    return protobuf_fmt.Protobuf(protobuf_fmt.Parser(fname).parse_text(text))
+
+
+def _number_errors(text):
+    return [
+        str(exc) for exc in
+        proto_check.check_numbers('test.proto', _parse(text))
+    ]
+
+
+def test_range_index():
+    index = proto_check.RangeIndex([
+        (1, 1, 'a'), (5, 10, 'b'), (7, 8, 'c'), (20, 30, 'd'),
+    ])
+
+    assert index.find(0) is None
+    assert index.find(1) == (1, 1, 'a')
+    assert index.find(2) is None
+    assert index.find(5) == (5, 10, 'b')
+    # Within a nested range, the outer range reaches further
+    assert index.find(8) == (5, 10, 'b')
+    assert index.find(9) == (5, 10, 'b')
+    assert index.find(11) is None
+    assert index.find(30) == (20, 30, 'd')
+    assert index.find(31) is None
+
+    assert index.overlaps == [((5, 10, 'b'), (7, 8, 'c'))]
+
+
+def test_numbers_valid():
+    assert _number_errors(
+        'message M {\n'
+        '    reserved 2, 5 to 10;\n'
+        '    reserved "old";\n'
+        '\n'
+        '    int32 a = 1;\n'
+        '    int32 b = 11;\n'
+        '\n'
+        '    oneof o {\n'
+        '        int32 c = 3;\n'
+        '    }\n'
+        '}\n'
+    ) == []
+
+
+def test_numbers_conflicts():
+    assert _number_errors(
+        'message M {\n'
+        '    reserved 2, 5 to 10, 8 to max;\n'
+        '    reserved "old";\n'
+        '\n'
+        '    int32 a   = 1;\n'
+        '    int32 b   = 2;\n'
+        '    int32 old = 3;\n'
+        '    int32 c   = 1;\n'
+        '    int32 d   = 12;\n'
+        '\n'
+        '    oneof o {\n'
+        '        int32 e = 3;\n'
+        '    }\n'
+        '}\n'
+    ) == [
+        'test.proto:2: Reserved range 8 to 536870911 overlaps another range',
+        'test.proto:6: Field number 2 of "b" is reserved on line 2',
+        'test.proto:7: Field name "old" is reserved on line 3',
+        'test.proto:8: Field number 1 of "c" is already used by "a" on '
+        'line 5',
+        'test.proto:9: Field number 12 of "d" is reserved on line 2',
+        'test.proto:12: Field number 3 of "e" is already used by "old" on '
+        'line 7',
+    ]
+
+
+def test_numbers_out_of_range():
+    assert _number_errors(
+        'message M {\n'
+        '    int32 a = 0;\n'
+        '    int32 b = 19000;\n'
+        '    int32 c = 536870912;\n'
+        '}\n'
+    ) == [
+        'test.proto:2: Field number 0 of "a" is out of range',
+        'test.proto:3: Field number 19000 of "b" is reserved for the '
+        'protobuf implementation',
+        'test.proto:4: Field number 536870912 of "c" is out of range',
+    ]
+
+
+def test_enum_values():
+    assert _number_errors(
+        'enum E {\n'
+        '    reserved 2 to max;\n'
+        '\n'
+        '    A = 0;\n'
+        '    B = 0;\n'
+        '    C = 3;\n'
+        '}\n'
+        '\n'
+        'enum F {\n'
+        '    option allow_alias = true;\n'
+        '\n'
+        '    X = 0;\n'
+        '    Y = 0;\n'
+        '}\n'
+    ) == [
+        'test.proto:5: Enum value 0 of "B" is already used by "A" on line 4',
+        'test.proto:6: Enum value 3 of "C" is reserved on line 2',
+    ]
+
+
+def test_nested_messages_checked():
+    assert _number_errors(
+        'message M {\n'
+        '    message N {\n'
+        '        int32 a = 1;\n'
+        '        int32 b = 1;\n'
+        '    }\n'
+        '\n'
+        '    N n = 1;\n'
+        '}\n'
+    ) == [
+        'test.proto:4: Field number 1 of "b" is already used by "a" on '
+        'line 3',
+    ]
+
+
+def _checker(tmpdir, files):
+    graph = proto_graph.ImportGraph()
+    for name, text in sorted(files.items()):
+        tmpdir.join(name).write(text)
+    for name in sorted(files):
+        graph.add(str(tmpdir.join(name)))
+    return proto_check.TypeChecker(graph)
+
+
+def _type_errors(tmpdir, files, name='a.proto'):
+    checker = _checker(tmpdir, files)
+    prefix = str(tmpdir) + os.sep
+    return [
+        str(exc)[len(prefix):]
+        for exc in checker.check(str(tmpdir.join(name)))
+    ]
+
+
+SCOPES = '''\
+syntax = "proto3";
+
+package pkg.sub;
+
+message Outer {
+    message Inner {
+        int32 x = 1;
+    }
+
+    message Node {
+        Inner inner = 1;
+    }
+
+    Inner inner = 1;
+}
+
+message Inner {
+    string y = 1;
+}
+'''
+
+
+def test_resolve_scopes(tmpdir):
+    checker = _checker(tmpdir, {'a.proto': SCOPES})
+
+    # The innermost definition wins, and names resolve outwards
+    # through the messages and then the packages
+    assert checker.resolve('Inner', 'pkg.sub.Outer.Node') == (
+        'pkg.sub.Outer.Inner', set(['message']),
+    )
+    assert checker.resolve('Inner', 'pkg.sub') == (
+        'pkg.sub.Inner', set(['message']),
+    )
+    assert checker.resolve('sub.Outer.Inner', 'pkg.sub.Outer') == (
+        'pkg.sub.Outer.Inner', set(['message']),
+    )
+    assert checker.resolve('.pkg.sub.Inner', 'pkg.sub.Outer') == (
+        'pkg.sub.Inner', set(['message']),
+    )
+    assert checker.resolve('Missing', 'pkg.sub.Outer') == (
+        'Missing', set(),
+    )
+
+
+def test_resolve_shadowed(tmpdir):
+    files = {'a.proto': SCOPES + '''
+message Other {
+    message Outer {
+    }
+
+    Outer.Inner shadowed = 1;
+}
+'''}
+
+    # The nearest "Outer" does not contain "Inner", so the name does
+    # not resolve, as with protoc
+    assert _checker(tmpdir, files).resolve('Outer.Inner', 'pkg.sub.Other') \
+        == ('pkg.sub.Other.Outer.Inner', set())
+    assert _type_errors(tmpdir, files) == [
+        'a.proto:25: "Outer.Inner" resolves to "pkg.sub.Other.Outer.Inner", '
+        'which is not defined',
+    ]
+
+
+def test_check_valid(tmpdir):
+    assert _type_errors(tmpdir, {'a.proto': SCOPES}) == []
+
+
+def test_check_errors(tmpdir):
+    assert _type_errors(tmpdir, {
+        'a.proto': '''\
+syntax = "proto3";
+
+package pkg;
+
+import "b.proto";
+
+enum Kind {
+    NONE = 0;
+}
+
+message M {
+    Unknown        unknown = 1;
+    B              b       = 2;
+    C              c       = 3;
+    map<float, B>  floats  = 4;
+    map<Kind, B>   kinds   = 5;
+    map<string, B> names   = 6;
+}
+
+extend Kind {
+    int32 ext = 100;
+}
+''',
+        'b.proto': '''\
+syntax = "proto3";
+
+package pkg;
+
+import "c.proto";
+
+message B {
+}
+''',
+        'c.proto': '''\
+syntax = "proto3";
+
+package pkg;
+
+message C {
+}
+''',
+    }) == [
+        'a.proto:12: "Unknown" is not defined',
+        'a.proto:14: "C" is defined in %s, which is not imported' % (
+            tmpdir.join('c.proto'),
+        ),
+        'a.proto:15: Invalid map key type "float"',
+        'a.proto:16: Invalid map key type "Kind"',
+        'a.proto:20: "pkg.Kind" is not a message type',
+    ]
+
+
+def test_public_imports(tmpdir):
+    files = {
+        'a.proto': 'import "b.proto";\n\nmessage A {\n    C c = 1;\n}\n',
+        'b.proto': 'import public "c.proto";\n',
+        'c.proto': 'message C {\n}\n',
+    }
+    assert _type_errors(tmpdir, files) == []
+
+
+def test_well_known_types(tmpdir):
+    assert _type_errors(tmpdir, {'a.proto': '''\
+import "google/protobuf/any.proto";
+
+message A {
+    google.protobuf.Any any = 1;
+}
+'''}) == []
@@ -0,0 +1,220 @@
+import binascii
+import contextlib
+import io
+
+import pytest
+
+import proto_codec
+import proto_graph
+import protobuf_fmt
+
+
+SCHEMA = '''\
+syntax = "proto3";
+
+package test;
+
+enum Color {
+    RED   = 0;
+    GREEN = 1;
+}
+
+message Inner {
+    int32 a = 1;
+}
+
+message Outer {
+    int32              a      = 1;
+    string             b      = 2;
+    Inner              c      = 3;
+    repeated int32     d      = 4;
+    sint32             e      = 5;
+    fixed32            f      = 6;
+    double             g      = 7;
+    bool               h      = 8;
+    bytes              i      = 9;
+    Color              j      = 10;
+    repeated string    k      = 11;
+    map<string, int32> counts = 12;
+
+    oneof choice {
+        int32  x = 13;
+        string y = 14;
+    }
+}
+'''
+
+
+def unhex(text):
+    return binascii.unhexlify(text.replace(' ', ''))
+
+
+@pytest.fixture
+def codec(tmpdir):
+    fname = tmpdir.join('test.proto')
+    fname.write(SCHEMA)
+
+    graph = proto_graph.ImportGraph()
+    graph.add(str(fname))
+    assert not graph.errors
+    return proto_codec.Codec(graph)
+
+
+@pytest.mark.parametrize('msg,encoded', [
+    # The examples from the protobuf encoding documentation
+    ({'a': 150}, '08 96 01'),
+    ({'b': u'testing'}, '12 07 74 65 73 74 69 6e 67'),
+    ({'c': {'a': 150}}, '1a 03 08 96 01'),
+    ({'d': [3, 270, 86942]}, '22 06 03 8e 02 9e a7 05'),
+    ({'a': -1}, '08 ff ff ff ff ff ff ff ff ff 01'),
+    ({'e': -1}, '28 01'),
+    ({'e': 1}, '28 02'),
+    ({'f': 1}, '35 01 00 00 00'),
+    ({'g': 1.0}, '39 00 00 00 00 00 00 f0 3f'),
+    ({'h': True}, '40 01'),
+    ({'i': b'\x00\xff'}, '4a 02 00 ff'),
+    ({'j': 1}, '50 01'),
+    ({'k': [u'a', u'b']}, '5a 01 61 5a 01 62'),
+    ({'counts': {u'a': 1}}, '62 05 0a 01 61 10 01'),
+    # Oneof members are encoded even when set to the default
+    ({'x': 0}, '68 00'),
+])
+def test_encoding(codec, msg, encoded):
+    assert codec.encode('test.Outer', msg) == unhex(encoded)
+    assert codec.decode('test.Outer', unhex(encoded)) == msg
+
+
+def test_defaults_omitted(codec):
+    msg = {'a': 0, 'b': u'', 'd': [], 'h': False, 'j': 0, 'counts': {}}
+
+    assert codec.encode('test.Outer', msg) == b''
+
+
+def test_round_trip(codec):
+    msg = {
+        'a': -5,
+        'b': u'caf\xe9',
+        'c': {'a': 1 << 30},
+        'd': [0, -1, (1 << 31) - 1],
+        'e': -(1 << 31),
+        'f': 0xffffffff,
+        'g': -2.5,
+        'h': True,
+        'i': b'\x01\x02',
+        'j': 1,
+        'k': [u'', u'x'],
+        'counts': {u'a': 1, u'b': -2},
+        'y': u'chosen',
+    }
+
+    assert codec.decode('test.Outer', codec.encode('test.Outer', msg)) == msg
+
+
+def test_oneof_last_member_wins(codec):
+    data = codec.encode('test.Outer', {'x': 1}) + \
+        codec.encode('test.Outer', {'y': u'z'})
+
+    assert codec.decode('test.Outer', data) == {'y': u'z'}
+
+
+def test_unknown_fields_skipped(codec):
+    data = unhex('08 96 01') + unhex('f8 01 05') + unhex('12 01 61')
+
+    assert codec.decode('test.Outer', data) == {'a': 150, 'b': u'a'}
+
+
+def test_invalid_encoding(codec):
+    with pytest.raises(protobuf_fmt.PBException):
+        codec.decode('test.Outer', unhex('12 07 74'))
+
+    with pytest.raises(protobuf_fmt.PBException):
+        codec.plan('test.Missing')
+
+
+@pytest.mark.parametrize('lazy', [False, True])
+def test_read_stream(codec, tmpdir, lazy):
+    msgs = [{'a': n, 'b': u'msg %d' % n} for n in range(1, 100)]
+
+    data = bytearray()
+    for msg in msgs:
+        encoded = codec.encode('test.Outer', msg)
+        proto_codec._encode_varint(data, len(encoded))
+        data += encoded
+
+    fname = tmpdir.join('stream.bin')
+    fname.write_binary(bytes(data))
+
+    # Both a mapped file and a pipe-like stream
+    with fname.open('rb') as f:
+        mapped = [dict(msg) for msg in codec.read('test.Outer', f, lazy=lazy)]
+    streamed = [
+        dict(msg)
+        for msg in codec.read('test.Outer', io.BytesIO(bytes(data)), lazy=lazy)
+    ]
+
+    assert mapped == msgs
+    assert streamed == msgs
+
+
+def test_corpus_compiles(protos):
+    graph = proto_graph.ImportGraph()
+    for fname in protos:
+        graph.add(fname)
+    codec = proto_codec.Codec(graph)
+
+    msg = {'timestamp': 1234567890, 'rumor': {}}
+    data = codec.encode('net.kevnet.humboldt.Ping', msg)
+    assert codec.decode('net.kevnet.humboldt.Ping', data) == msg
+
+
+def _stream(codec, tmpdir, msgs):
+    data = bytearray()
+    for msg in msgs:
+        encoded = codec.encode('test.Outer', msg)
+        proto_codec._encode_varint(data, len(encoded))
+        data += encoded
+
+    fname = tmpdir.join('stream.bin')
+    fname.write_binary(bytes(data))
+    return fname
+
+
+def test_lazy_mapping_closed(codec, tmpdir):
+    fname = _stream(codec, tmpdir, [{'a': 1, 'b': u'x'}, {'a': 2}])
+
+    with fname.open('rb') as f:
+        msgs = []
+        for msg in codec.read('test.Outer', f, lazy=True):
+            # Usable while reading
+            assert msg['a'] == len(msgs) + 1
+            msgs.append(msg)
+
+    # Fields already decoded remain available, but the mapping is gone
+    assert msgs[0]['a'] == 1
+    with pytest.raises(ValueError):
+        msgs[0]['b']
+
+
+def test_lazy_mapping_closed_early(codec, tmpdir):
+    fname = _stream(codec, tmpdir, [{'a': n} for n in range(1, 10)])
+
+    with fname.open('rb') as f:
+        with contextlib.closing(
+                codec.read('test.Outer', f, lazy=True)) as msgs:
+            kept = dict(next(msgs))
+            second = next(msgs)
+
+    assert kept == {'a': 1}
+    with pytest.raises(ValueError):
+        len(second)
+
+
+def test_truncated_stream(codec, tmpdir):
+    fname = _stream(codec, tmpdir, [{'a': 1}, {'b': u'abc'}])
+    fname.write_binary(fname.read_binary()[:-1])
+
+    for lazy in (False, True):
+        with fname.open('rb') as f:
+            with pytest.raises(protobuf_fmt.PBException) as exc:
+                list(codec.read('test.Outer', f, lazy=lazy))
+        assert str(exc.value) == 'Truncated message "test.Outer" at offset 3'
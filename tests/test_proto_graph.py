@@ -0,0 +1,180 @@
+import os
+import sys
+
+import pytest
+
+import proto_graph
+
+
+def _write(dirname, name, imports=(), text=''):
+    path = dirname.join(name)
+    path.write(
+        'syntax = "proto3";\n'
+        '\n' +
+        ''.join('import "%s";\n' % iname for iname in imports) +
+        '\n'
+        'message %s {\n'
+        '}\n' % os.path.splitext(os.path.basename(name))[0].title() +
+        text
+    )
+    return str(path)
+
+
+@pytest.fixture
+def graph(tmpdir):
+    def build(files, roots=None):
+        for name, imports in files.items():
+            _write(tmpdir, name, imports)
+
+        graph = proto_graph.ImportGraph()
+        for name in roots or sorted(files):
+            graph.add(str(tmpdir.join(name)))
+        return graph
+    return build
+
+
+def _names(groups):
+    return [[os.path.basename(fname) for fname in group] for group in groups]
+
+
+def test_levels(graph):
+    graph = graph({
+        'a.proto': [],
+        'b.proto': ['a.proto'],
+        'c.proto': ['a.proto'],
+        'd.proto': ['b.proto', 'c.proto', 'b.proto'],
+    })
+
+    assert _names(graph.levels()) == [
+        ['a.proto'], ['b.proto', 'c.proto'], ['d.proto'],
+    ]
+    assert graph.cycles() == []
+
+
+def test_imported_files_added(graph):
+    graph = graph({
+        'a.proto': [],
+        'b.proto': ['a.proto'],
+        'c.proto': ['b.proto'],
+    }, roots=['c.proto'])
+
+    assert sorted(_names([graph.files])[0]) == [
+        'a.proto', 'b.proto', 'c.proto',
+    ]
+
+
+def test_self_import(graph):
+    graph = graph({
+        'a.proto': [],
+        'b.proto': ['b.proto', 'a.proto'],
+    })
+
+    assert _names(graph.cycles()) == [['b.proto']]
+    assert _names(graph.levels()) == [['a.proto']]
+
+
+def test_cycles(graph):
+    graph = graph({
+        'a.proto': ['b.proto'],
+        'b.proto': ['c.proto'],
+        'c.proto': ['a.proto'],
+        'd.proto': ['a.proto', 'e.proto'],
+        'e.proto': [],
+        'f.proto': ['g.proto'],
+        'g.proto': ['f.proto'],
+    })
+
+    assert _names(graph.cycles()) == [
+        ['a.proto', 'b.proto', 'c.proto'], ['f.proto', 'g.proto'],
+    ]
+    # A file depending on a cycle is not part of it, but cannot be
+    # ordered either
+    assert _names(graph.levels()) == [['e.proto']]
+
+
+def test_deep_chain():
+    # Far deeper than the recursion limit
+    depth = sys.getrecursionlimit() * 2
+    graph = proto_graph.ImportGraph()
+    graph.imports = dict(
+        ('%d' % i, ['%d' % (i + 1)] if i < depth else [])
+        for i in range(depth + 1)
+    )
+    assert graph.cycles() == []
+    assert len(graph.levels()) == depth + 1
+
+    graph.imports['%d' % depth] = ['0']
+    assert len(graph.cycles()[0]) == depth + 1
+    assert graph.levels() == []
+
+
+def test_missing_imports(tmpdir):
+    fname = _write(tmpdir, 'a.proto', [
+        'missing.proto', 'google/protobuf/any.proto',
+    ])
+
+    graph = proto_graph.ImportGraph()
+    graph.add(fname)
+
+    # Well-known types are not reported unless found
+    assert graph.missing == {fname: [(3, 'missing.proto')]}
+    assert graph.imports == {fname: []}
+
+
+def test_well_known_on_path(tmpdir):
+    _write(tmpdir.mkdir('google').mkdir('protobuf'), 'any.proto')
+    fname = _write(tmpdir, 'a.proto', ['google/protobuf/any.proto'])
+
+    graph = proto_graph.ImportGraph()
+    graph.add(fname)
+
+    assert graph.imports[fname] == [
+        str(tmpdir.join('google', 'protobuf', 'any.proto')),
+    ]
+
+
+def test_search_path(tmpdir):
+    inc = tmpdir.mkdir('inc')
+    _write(inc, 'dep.proto')
+    fname = _write(tmpdir.mkdir('src'), 'a.proto', ['dep.proto'])
+
+    graph = proto_graph.ImportGraph()
+    graph.add(fname)
+    assert graph.missing
+
+    graph = proto_graph.ImportGraph([str(inc)])
+    graph.add(fname)
+    assert graph.imports[fname] == [str(inc.join('dep.proto'))]
+    assert not graph.missing
+
+
+def test_parse_errors(tmpdir):
+    fname = _write(tmpdir, 'a.proto', ['bad.proto'])
+    bad = tmpdir.join('bad.proto')
+    bad.write('message {\n')
+
+    graph = proto_graph.ImportGraph()
+    graph.add(fname)
+
+    assert [error[0] for error in graph.errors] == [str(bad)]
+    assert list(graph.files) == [fname]
+
+
+def _count(fname, pbfile, deps):
+    # Counts the paths through the imports ending at each file
+    return 1 + sum(deps.values())
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_process(graph, jobs):
+    graph = graph({
+        'a.proto': [],
+        'b.proto': ['a.proto'],
+        'c.proto': ['a.proto'],
+        'd.proto': ['b.proto', 'c.proto'],
+    })
+
+    results = graph.process(_count, jobs)
+    assert dict(
+        (os.path.basename(fname), value) for fname, value in results.items()
+    ) == {'a.proto': 1, 'b.proto': 2, 'c.proto': 2, 'd.proto': 5}
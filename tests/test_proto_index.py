@@ -0,0 +1,91 @@
+import sqlite3
+
+import pytest
+
+import proto_index
+import protobuf_fmt
+
+
+@pytest.fixture
+def index(tmpdir):
+    index = proto_index.SymbolIndex(str(tmpdir.join('index.db')))
+    yield index
+    index.close()
+
+
+def test_lookup_matches_location_index(index, protos):
+    for fname in protos:
+        assert index.update(fname)
+
+    ping = [fname for fname in protos if fname.endswith('/ping.proto')][0]
+    protobuf_fmt.main([ping])
+    loc = protobuf_fmt.read_index(ping)['message:Ping']
+
+    assert index.lookup('net.kevnet.humboldt.Ping') == [
+        proto_index.Symbol(
+            'net.kevnet.humboldt.Ping', 'message', ping,
+            loc['start'], loc['block_start'], loc['end'],
+        ),
+    ]
+    assert index.lookup('.net.kevnet.humboldt.Ping', 'message')
+    assert index.lookup('net.kevnet.humboldt.Ping', 'enum') == []
+    assert index.lookup('Ping') == []
+
+
+def test_extension_and_nested_names(index, protodir):
+    nested = protodir.join('nested.proto')
+    nested.write(
+        'syntax = "proto3";\n'
+        '\n'
+        'package test;\n'
+        '\n'
+        'message Outer {\n'
+        '    enum Kind {\n'
+        '        NONE = 0;\n'
+        '    }\n'
+        '\n'
+        '    Kind kind = 1;\n'
+        '}\n'
+    )
+    index.update(str(nested))
+    index.update(str(protodir.join('extensions.proto')))
+
+    assert [sym.type for sym in index.lookup('test.Outer.Kind')] == ['enum']
+    assert index.lookup('google.protobuf.MessageOptions', 'extend')
+
+
+def test_update_skips_unchanged(index, protos):
+    assert index.update(protos[0])
+    assert not index.update(protos[0])
+
+    with open(protos[0], 'a') as f:
+        f.write('\nmessage Added {\n}\n')
+
+    assert index.update(protos[0])
+    assert len(index.lookup('net.kevnet.humboldt.Added')) == 1
+
+
+def test_remove(index, protos):
+    for fname in protos:
+        index.update(fname)
+    index.remove(protos[0])
+
+    assert protos[0] not in index.files()
+    assert len(index.files()) == len(protos) - 1
+
+
+def test_rebuilt_on_version_change(tmpdir, protos):
+    database = str(tmpdir.join('index.db'))
+    index = proto_index.SymbolIndex(database)
+    index.update(protos[0])
+    index.close()
+
+    db = sqlite3.connect(database)
+    db.execute('PRAGMA user_version = 0')
+    db.close()
+
+    index = proto_index.SymbolIndex(database)
+    try:
+        assert index.files() == []
+    finally:
+        index.close()
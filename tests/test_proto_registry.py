@@ -0,0 +1,128 @@
+import json
+
+import pytest
+
+import proto_registry
+import protobuf_fmt
+
+
+MESSAGES = '''\
+syntax = "proto3";
+
+package test;
+
+message Request {
+    option (protocol) = 7;
+}
+
+message Reply {
+    option (protocol) = 7;
+    option (reply)    = true;
+
+    message Nested {
+        option (protocol) = 0x10;
+        option (error)    = true;
+    }
+}
+
+message Failure {
+    option (protocol) = 255;
+    option (reply)    = true;
+    option (error)    = true;
+}
+
+message Plain {
+}
+'''
+
+
+def _registry(text, fname='test.proto'):
+    registry = proto_registry.Registry()
+    registry.add_file(
+        protobuf_fmt.Protobuf(protobuf_fmt.Parser(fname).parse_text(text)),
+    )
+    return registry
+
+
+def test_dispatch_index():
+    assert proto_registry.dispatch_index(0) == 0
+    assert proto_registry.dispatch_index(7) == 28
+    assert proto_registry.dispatch_index(7, reply=True) == 30
+    assert proto_registry.dispatch_index(7, error=True) == 29
+    assert proto_registry.dispatch_index(255, True, True) == \
+        proto_registry.TABLE_SIZE - 1
+
+
+def test_table():
+    registry = _registry(MESSAGES)
+
+    assert registry.errors == []
+    assert len(registry.table) == 1024
+    assert [(reg.name, reg.protocol, reg.reply, reg.error)
+            for reg in registry.registrations()] == [
+        ('test.Request', 7, False, False),
+        ('test.Reply', 7, True, False),
+        ('test.Reply.Nested', 16, False, True),
+        ('test.Failure', 255, True, True),
+    ]
+
+
+def test_python_and_json():
+    registry = _registry(MESSAGES)
+
+    namespace = {}
+    exec(registry.python(), namespace)
+    assert len(namespace['DISPATCH']) == 1024
+    assert namespace['DISPATCH'][namespace['dispatch_index'](7, True)] == \
+        'test.Reply'
+    assert namespace['MESSAGES']['test.Failure'] == (255, True, True)
+
+    data = json.loads(registry.json())
+    assert data['table'] == list(namespace['DISPATCH'])
+    assert data['messages']['test.Reply.Nested'] == [16, False, True]
+
+
+@pytest.mark.parametrize('options,error', [
+    ('option (protocol) = 256;', 'Invalid protocol number "256"'),
+    ('option (protocol) = x;', 'Invalid protocol number "x"'),
+    ('option (protocol) = 1;\n    option (reply) = yes;',
+     'Invalid value "yes" for option (reply)'),
+    ('option (error) = true;', 'Option (error) requires option (protocol)'),
+])
+def test_invalid_options(options, error):
+    registry = _registry('message M {\n    %s\n}\n' % options)
+
+    assert [str(exc).split(': ', 1)[1] for exc in registry.errors] == [error]
+    assert registry.registrations() == []
+
+
+def test_collisions():
+    registry = _registry(
+        'message A {\n    option (protocol) = 1;\n}\n'
+        'message B {\n    option (protocol) = 1;\n}\n'
+        'message C {\n    option (protocol) = 1;\n}\n'
+    )
+
+    # The first definition keeps the entry, regardless of the order in
+    # which the blocks are visited
+    assert [reg.name for reg in registry.registrations()] == ['A']
+    assert [str(exc) for exc in registry.errors] == [
+        'test.proto:4: Protocol 1 is already used by A at test.proto:1',
+        'test.proto:7: Protocol 1 is already used by A at test.proto:1',
+    ]
+
+
+def test_collisions_across_files(tmpdir, capsys):
+    first = tmpdir.join('a.proto')
+    first.write('message A {\n    option (protocol) = 3;\n}\n')
+    second = tmpdir.join('b.proto')
+    second.write('\nmessage B {\n    option (protocol) = 3;\n}\n')
+
+    outputs = []
+    for files in ([first, second], [second, first]):
+        assert proto_registry.main([str(fname) for fname in files]) == 1
+        outputs.append(capsys.readouterr().err)
+
+    assert outputs[0] == outputs[1] == (
+        '%s:2: Protocol 3 is already used by A at %s:1\n' % (second, first)
+    )
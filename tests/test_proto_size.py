@@ -0,0 +1,112 @@
+import os
+
+import pytest
+
+import proto_codec
+import proto_graph
+import proto_size
+
+
+SCHEMA = '''\
+syntax = "proto3";
+
+package test;
+
+message Item {
+    uint32 id   = 1;
+    string name = 2;
+}
+
+message Batch {
+    repeated Item   items   = 1;
+    repeated uint32 numbers = 2;
+    bytes           payload = 3;
+
+    oneof choice {
+        fixed64 when = 4;
+        bool    flag = 5;
+    }
+}
+'''
+
+
+@pytest.fixture
+def schema(tmpdir):
+    fname = tmpdir.join('test.proto')
+    fname.write(SCHEMA)
+    return str(fname)
+
+
+@pytest.fixture
+def model(schema):
+    graph = proto_graph.ImportGraph()
+    graph.add(schema)
+    return proto_size.SizeModel(proto_codec.Codec(graph))
+
+
+def test_varint_size():
+    assert proto_size.varint_size(0) == 1
+    assert proto_size.varint_size(127) == 1
+    assert proto_size.varint_size(128) == 2
+    assert proto_size.varint_size((1 << 32) - 1) == 5
+    assert proto_size.varint_size(-1) == 10
+
+
+def test_frame_budget():
+    # The carrier header is 4 bytes, as is each extension header, and
+    # the Total Frame Length field is 16 bits
+    assert proto_size.header_bits(
+        os.path.join(proto_size.BITS_DIR, proto_size.CARRIER_BITS),
+    )[0] == 32
+    assert proto_size.frame_budget() == 65535 - 4 == 65531
+    assert proto_size.frame_budget(extensions=2) == 65531 - 2 * 4
+
+
+def test_sizes(model):
+    assert model.size('test.Item', 'min') == 0
+    # Tags, a 2-byte typical varint, and a 16-byte string
+    assert model.size('test.Item', 'typical') == 1 + 2 + 1 + 1 + 16
+    assert model.size('test.Item', 'max') == 1 + 5 + 1 + 1 + 64
+
+    # One item, one packed number, the payload, and the larger member
+    # of the oneof
+    item = model.size('test.Item', 'max')
+    assert model.size('test.Batch', 'max') == (
+        (1 + 1 + item) + (1 + 1 + 5) + (1 + 1 + 64) + (1 + 8)
+    )
+    assert model.size('test.Batch', 'min') == (1 + 1) + (1 + 1 + 1)
+
+
+def test_fit(model):
+    budget = 1000
+    count = model.fit('test.Batch', 'test.Batch.items', 'max', budget)
+
+    def size(count):
+        return model.size('test.Batch', 'max', ('test.Batch.items', count))
+    assert size(count) <= budget < size(count + 1)
+
+    assert model.fit('test.Batch', 'test.Batch.items', 'max', 10) is None
+
+
+def test_main(schema, capsys):
+    assert proto_size.main(['Batch'], files=[schema]) is None
+    out = capsys.readouterr().out
+    assert out.startswith('Frame budget: 65531 bytes\n')
+    assert 'exceeds frame' not in out
+
+
+def test_main_exceeds_frame(schema, capsys):
+    assert proto_size.main(
+        ['Batch'], files=[schema], fields=['Batch.payload=65530'],
+    ) is None
+    lines = capsys.readouterr().out.splitlines()
+
+    assert lines[2].startswith('test.Batch ')
+    assert lines[2].endswith(' exceeds frame')
+    assert lines[3] == '    items: at most none typical, none max'
+
+
+def test_main_invalid_field(schema):
+    assert proto_size.main(
+        ['Batch'], files=[schema], fields=['Batch.payload'],
+    ) == 'Invalid field setting "Batch.payload"'
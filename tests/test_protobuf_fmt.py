@@ -0,0 +1,226 @@
+import json
+import os
+import re
+import subprocess
+import sys
+
+import pytest
+
+import protobuf_fmt
+from conftest import ROOT
+
+
+def test_cache_skips_unchanged(protos, tmpdir, capsys):
+    cache = str(tmpdir.join('fmt.cache'))
+
+    assert protobuf_fmt.main(protos, cache=cache) is None
+    assert capsys.readouterr().out.count('Processing file') == len(protos)
+
+    assert protobuf_fmt.main(protos, cache=cache) is None
+    assert capsys.readouterr().out == ''
+
+
+def test_cache_detects_edit(protos, tmpdir, capsys):
+    cache = str(tmpdir.join('fmt.cache'))
+    protobuf_fmt.main(protos, cache=cache)
+    capsys.readouterr()
+
+    with open(protos[0], 'a') as f:
+        f.write('\n\n')
+
+    protobuf_fmt.main(protos, cache=cache)
+    assert capsys.readouterr().out == 'Processing file %s\n' % protos[0]
+
+
+def test_cache_needs_index(protos, tmpdir, capsys):
+    cache = str(tmpdir.join('fmt.cache'))
+    protobuf_fmt.main(protos, cache=cache)
+    capsys.readouterr()
+
+    tmpdir.join('protobuf', 'ping.idx').remove()
+
+    protobuf_fmt.main(protos, cache=cache)
+    assert capsys.readouterr().out.count('Processing file') == 1
+    assert tmpdir.join('protobuf', 'ping.idx').check()
+
+
+def test_cache_discarded_on_version(protos, tmpdir, capsys):
+    cache = tmpdir.join('fmt.cache')
+    protobuf_fmt.main(protos, cache=str(cache))
+    capsys.readouterr()
+
+    data = json.loads(cache.read())
+    data['version'] = protobuf_fmt.VERSION - 1
+    cache.write(json.dumps(data))
+
+    protobuf_fmt.main(protos, cache=str(cache))
+    assert capsys.readouterr().out.count('Processing file') == len(protos)
+    assert json.loads(cache.read())['version'] == protobuf_fmt.VERSION
+
+
+def _unformat(protodir):
+    # Collapses the alignment of every file, so there is work to do
+    for path in protodir.listdir('*.proto'):
+        path.write(re.sub(r'(\S) +', r'\1 ', path.read()))
+
+
+def _contents(protodir):
+    return dict((p.basename, p.read()) for p in protodir.listdir())
+
+
+def test_jobs_matches_serial(protodir, tmpdir, capsys):
+    _unformat(protodir)
+    other = tmpdir.join('parallel')
+    protodir.copy(other)
+
+    serial = sorted(str(p) for p in protodir.listdir('*.proto'))
+    parallel = sorted(str(p) for p in other.listdir('*.proto'))
+
+    assert protobuf_fmt.main(serial) is None
+    out = capsys.readouterr().out
+    assert protobuf_fmt.main(parallel, jobs=4) is None
+    assert capsys.readouterr().out == out.replace(str(protodir), str(other))
+
+    assert _contents(other) == _contents(protodir)
+
+
+def test_jobs_reports_errors(protos, capsys):
+    with open(protos[0], 'a') as f:
+        f.write('message {\n')
+
+    assert protobuf_fmt.main(protos, jobs=4) == 1
+    captured = capsys.readouterr()
+    assert captured.out.count('Processing file') == len(protos)
+    assert protos[0] in captured.err
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+@pytest.mark.parametrize('text,error', [
+    ('import;\n', ':1: Expected a string literal'),
+    ('message M {\n    map<string x = 1;\n}\n',
+     ':2: Invalid map field description "<string x"'),
+    ('message\n', ':1: Missing open brace'),
+])
+def test_malformed_statement_reported(protos, capsys, jobs, text, error):
+    with open(protos[0], 'w') as f:
+        f.write(text)
+
+    assert protobuf_fmt.main(protos, jobs=jobs) == 1
+    captured = capsys.readouterr()
+    assert captured.out.count('Processing file') == len(protos)
+    assert captured.err.startswith(protos[0] + error)
+
+
+def test_block_matches_full_format(protodir, capsys):
+    ping = protodir.join('ping.proto')
+    protobuf_fmt.main([str(ping)])
+
+    # Grow the first block, so the blocks after it move
+    ping.write(ping.read().replace(
+        '    NodeRumor rumor     = 2; // Optional rumor about other nodes\n',
+        '    NodeRumor rumor = 2; // Optional rumor about other nodes\n'
+        '    repeated uint32 extra_values=3;\n',
+        1,
+    ))
+    other = protodir.join('full.proto')
+    ping.copy(other)
+
+    assert protobuf_fmt.main([str(ping)], block='Ping') is None
+    assert protobuf_fmt.main([str(other)]) is None
+
+    assert ping.read() == other.read()
+    assert protobuf_fmt.read_index(str(ping)) == \
+        protobuf_fmt.read_index(str(other))
+
+
+def test_block_by_lines(protodir, capsys):
+    ping = protodir.join('ping.proto')
+    protobuf_fmt.main([str(ping)])
+    index = protobuf_fmt.read_index(str(ping))
+
+    start = index['message:Pong']['block_start']
+    ping.write(ping.read().replace('uint64    timestamp', 'uint64 timestamp'))
+
+    lines = '%d-%d' % (start + 1, start + 1)
+    assert protobuf_fmt.main([str(ping)], lines=lines, check=True) == 1
+    assert protobuf_fmt.main([str(ping)], lines=lines) is None
+
+    # Only the block containing the lines was reformatted
+    text = ping.read()
+    assert text.count('uint64 timestamp') == 1
+    assert text.count('uint64    timestamp') == 1
+
+
+def test_block_needs_index(protos):
+    assert 'No location index' in protobuf_fmt.main(
+        protos[:1], block='Command',
+    )
+
+
+def test_ast_cache_shared_with_script(protodir, tmpdir):
+    # Entries stored by the script can be loaded through the module
+    ping = str(protodir.join('ping.proto'))
+    with open(ping, 'rb') as f:
+        data = f.read()
+
+    cache_dir = str(tmpdir.join('ast'))
+    subprocess.check_call([
+        sys.executable, os.path.join(ROOT, 'tools', 'protobuf_fmt.py'),
+        '--ast-cache', cache_dir, ping,
+    ])
+
+    cache = protobuf_fmt.ASTCache(cache_dir)
+    pbfile = cache.load(cache.key(ping, data))
+    assert isinstance(pbfile, protobuf_fmt.Protobuf)
+    assert [block.name for block in pbfile.pbfile.blocks
+            if isinstance(block, protobuf_fmt.NamedBlock)] == ['Ping', 'Pong']
+
+
+def test_ast_cache_damaged_entry(protos, tmpdir):
+    cache = protobuf_fmt.ASTCache(str(tmpdir.join('ast')))
+    with open(protos[0], 'rb') as f:
+        key = cache.key(protos[0], f.read())
+
+    protobuf_fmt.Parser.parse(protos[0], cache)
+    with open(cache._path(key), 'wb') as f:
+        f.write(b'damaged')
+
+    assert cache.load(key) is None
+    assert protobuf_fmt.Parser.parse(protos[0], cache).pbfile.blocks
+    assert cache.load(key) is not None
+
+
+def test_reserved_rendering():
+    text, _locations = protobuf_fmt.format_text(
+        'message M {\n'
+        '  reserved 1,5   to 10 , 20 to max;\n'
+        ' reserved "a","b"; // names\n'
+        '  int32 x = 2;\n'
+        '}\n'
+    )
+
+    assert text == (
+        'message M {\n'
+        '    reserved 1, 5 to 10, 20 to max;\n'
+        '    reserved "a", "b";              // names\n'
+        '\n'
+        '    int32 x = 2;\n'
+        '}\n'
+    )
+
+
+@pytest.mark.parametrize('reserved,error', [
+    ('1, max', 'Invalid number'),
+    ('1,', 'Too many commas'),
+    ('1 to', 'Invalid reserved range "1 to"'),
+    ('5 until 10', 'Invalid reserved range "5 until 10"'),
+    ('"a" "b"', 'Missing comma'),
+    ('"a",', 'Too many commas'),
+    ('"a", 1', 'Invalid reserved name "1"'),
+])
+def test_reserved_errors(reserved, error):
+    with pytest.raises(protobuf_fmt.PBException) as exc:
+        protobuf_fmt.format_text('message M {\n    reserved %s;\n}\n' % (
+            reserved,
+        ))
+    assert str(exc.value) == '<buffer>:2: %s' % error
@@ -0,0 +1,113 @@
+import os
+import shutil
+
+import pytest
+
+pytest.importorskip('sphinx')
+
+import proto_bits  # noqa: E402
+from conftest import ROOT  # noqa: E402
+
+
+def _build(srcdir, outdir):
+    # Builds the project, returning the documents read, the warnings,
+    # and the build environment
+    from sphinx.application import Sphinx
+
+    warnings = []
+
+    class Warnings(object):
+        def write(self, text):
+            warnings.append(text)
+
+        def flush(self):
+            pass
+
+    app = Sphinx(
+        str(srcdir), str(srcdir), str(outdir.join('text')),
+        str(outdir.join('doctrees')), 'text', status=None,
+        warning=Warnings(),
+    )
+    read = []
+    app.connect('source-read', lambda app, docname, source: read.append(
+        docname,
+    ))
+    app.build()
+
+    return sorted(read), ''.join(warnings), app.env
+
+
+@pytest.fixture
+def srcdir(tmpdir):
+    srcdir = tmpdir.mkdir('src')
+    shutil.copytree(
+        os.path.join(ROOT, 'source', 'bits'), str(srcdir.join('bits')),
+    )
+
+    srcdir.join('conf.py').write("extensions = ['sphinx_bits']\n")
+    srcdir.join('index.rst').write(
+        'Test\n'
+        '====\n'
+        '\n'
+        '.. toctree::\n'
+        '\n'
+        '   carrier\n'
+        '   extension\n'
+    )
+    for name in ('carrier', 'extension'):
+        srcdir.join('%s.rst' % name).write(
+            '%s\n%s\n\n.. bits:: bits/%s.bits\n' % (
+                name.title(), '=' * len(name), name,
+            )
+        )
+
+    return srcdir
+
+
+def test_render(srcdir, tmpdir):
+    read, warnings, env = _build(srcdir, tmpdir.join('out'))
+
+    assert read == ['carrier', 'extension', 'index']
+    assert warnings == ''
+    for name in ('carrier', 'extension'):
+        rendered = proto_bits.render_file(
+            str(srcdir.join('bits', '%s.bits' % name)), bare=True,
+        )
+        text = tmpdir.join('out', 'text', '%s.txt' % name).read()
+        assert all(line.strip() in text for line in rendered.splitlines())
+    assert len(env.bits_cache) == 2
+
+
+def test_only_changed_descriptions_reread(srcdir, tmpdir):
+    outdir = tmpdir.join('out')
+    _build(srcdir, outdir)
+
+    assert _build(srcdir, outdir)[0] == []
+
+    extension = srcdir.join('bits', 'extension.bits')
+    extension.write(
+        extension.read().replace('Extension Length', 'Extension Size'),
+    )
+    read, _warnings, env = _build(srcdir, outdir)
+
+    assert read == ['extension']
+    assert 'Extension Size' in outdir.join('text', 'extension.txt').read()
+    # The old rendering is no longer used by any document
+    assert len(env.bits_cache) == 2
+
+
+def test_shared_render(srcdir, tmpdir):
+    srcdir.join('extension.rst').write(
+        'Extension\n=========\n\n.. bits:: bits/carrier.bits\n',
+    )
+    _read, _warnings, env = _build(srcdir, tmpdir.join('out'))
+
+    assert len(env.bits_cache) == 1
+    assert env.bits_docs['carrier'] == env.bits_docs['extension']
+
+
+def test_invalid_description(srcdir, tmpdir):
+    srcdir.join('bits', 'carrier.bits').write('- field: x\n')
+    _read, warnings, _env = _build(srcdir, tmpdir.join('out'))
+
+    assert 'Unable to render "bits/carrier.bits"' in warnings
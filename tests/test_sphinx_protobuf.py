@@ -0,0 +1,218 @@
+import collections
+
+import pytest
+
+pytest.importorskip('sphinx')
+
+import protobuf_fmt  # noqa: E402
+import sphinx_protobuf  # noqa: E402
+
+
+Config = collections.namedtuple('Config', ['proto_include_dirs'])
+
+
+class Env(object):
+    def __init__(self, srcdir):
+        self.srcdir = srcdir
+        self.config = Config(['protobuf'])
+        self.proto_include_docs = {}
+
+
+@pytest.fixture
+def env(protodir):
+    sphinx_protobuf._files.clear()
+    yield Env(str(protodir.dirpath()))
+    sphinx_protobuf._files.clear()
+
+
+def test_locate(env, protodir):
+    fname, first, last, text = sphinx_protobuf.locate(
+        env, ['net.kevnet.humboldt.Ping', 'net.kevnet.humboldt.Pong'],
+    )
+
+    lines = protodir.join('ping.proto').readlines()
+    assert fname == str(protodir.join('ping.proto'))
+    assert lines[first - 1].startswith('// The Ping message')
+    assert lines[last - 1] == '}\n'
+    assert text == ''.join(lines[first - 1:last])
+    assert 'message Pong {' in text
+
+
+def test_locate_errors(env):
+    with pytest.raises(protobuf_fmt.PBException) as exc:
+        sphinx_protobuf.locate(env, ['net.kevnet.humboldt.Missing'])
+    assert 'not defined' in str(exc.value)
+
+    with pytest.raises(protobuf_fmt.PBException) as exc:
+        sphinx_protobuf.locate(
+            env, ['net.kevnet.humboldt.Ping', 'net.kevnet.humboldt.Conduit'],
+        )
+    assert 'conduit.proto' in str(exc.value)
+
+
+def test_locate_without_index(env, protodir):
+    # The index is missing, so the file is parsed
+    assert not protodir.join('ping.idx').check()
+    fname, first, last, text = sphinx_protobuf.locate(
+        env, ['net.kevnet.humboldt.Ping'],
+    )
+    assert text.startswith('// The Ping message')
+
+
+def test_broken_file_tolerated(env, protodir):
+    protodir.join('ping.proto').write('message {\n')
+
+    # Blocks in other files are still found
+    fname = sphinx_protobuf.locate(env, ['net.kevnet.humboldt.NodeRumor'])[0]
+    assert fname == str(protodir.join('rumor.proto'))
+
+    # And the parse error is reported for blocks that are not
+    with pytest.raises(protobuf_fmt.PBException) as exc:
+        sphinx_protobuf.locate(env, ['net.kevnet.humboldt.Ping'])
+    assert 'ping.proto' in str(exc.value)
+
+
+def _include(env, names):
+    return (tuple(names), sphinx_protobuf._digest(
+        *sphinx_protobuf.locate(env, names)
+    ))
+
+
+def test_outdated(env, protodir):
+    ping, ping_digest = _include(env, ['net.kevnet.humboldt.Ping'])
+    rumor, rumor_digest = _include(env, ['net.kevnet.humboldt.NodeRumor'])
+    env.proto_include_docs = {
+        'ping': [(ping, 'ping.proto', ping_digest)],
+        'rumor': [(rumor, 'rumor.proto', rumor_digest)],
+        'missing': [(('net.kevnet.humboldt.Missing',), None, None)],
+    }
+
+    assert sphinx_protobuf.get_outdated(None, env, set(), set(), set()) == []
+
+    # Editing a block only outdates the documents including it
+    path = protodir.join('ping.proto')
+    path.write(path.read().replace('RTT to a', 'RTT to the'))
+    assert sphinx_protobuf.get_outdated(
+        None, env, set(), set(), set(),
+    ) == ['ping']
+
+    # A document being read anyway is not reported
+    assert sphinx_protobuf.get_outdated(
+        None, env, set(), set(['ping']), set(),
+    ) == []
+
+
+def test_outdated_moved(env, protodir):
+    rumor, digest = _include(env, ['net.kevnet.humboldt.NodeRumor'])
+    env.proto_include_docs = {'rumor': [(rumor, 'rumor.proto', digest)]}
+
+    # The text is unchanged, but the line numbers are not
+    path = protodir.join('rumor.proto')
+    text = path.read()
+    path.write(text.replace('\n\n', '\n\n\n', 1))
+    assert sphinx_protobuf.get_outdated(
+        None, env, set(), set(), set(),
+    ) == ['rumor']
+
+
+def test_outdated_failed_include(env, protodir):
+    path = protodir.join('ping.proto')
+    text = path.read()
+    path.write('message {\n')
+
+    names = ('net.kevnet.humboldt.Ping',)
+    env.proto_include_docs = {'ping': [(names, None, None)]}
+
+    # Still failing, so not read again
+    assert sphinx_protobuf.get_outdated(None, env, set(), set(), set()) == []
+
+    # Fixed, so read again
+    path.write(text)
+    assert sphinx_protobuf.get_outdated(
+        None, env, set(), set(), set(),
+    ) == ['ping']
+
+    # And a successful include that starts failing is read again too
+    digest = sphinx_protobuf._digest(*sphinx_protobuf.locate(env, names))
+    env.proto_include_docs = {'ping': [(names, str(path), digest)]}
+    path.write('message {\n')
+    assert sphinx_protobuf.get_outdated(
+        None, env, set(), set(), set(),
+    ) == ['ping']
+
+
+def test_build(protodir, tmpdir):
+    from sphinx.application import Sphinx
+
+    srcdir = protodir.dirpath()
+    srcdir.join('conf.py').write("extensions = ['sphinx_protobuf']\n")
+    srcdir.join('index.rst').write(
+        'Test\n'
+        '====\n'
+        '\n'
+        '.. proto-include:: net.kevnet.humboldt.Ping\n'
+        '\n'
+        '.. proto-include:: net.kevnet.humboldt.Missing\n'
+    )
+
+    outdir = tmpdir.join('out')
+    warnings = []
+
+    class Warnings(object):
+        def write(self, text):
+            warnings.append(text)
+
+        def flush(self):
+            pass
+
+    sphinx_protobuf._files.clear()
+    app = Sphinx(
+        str(srcdir), str(srcdir), str(outdir), str(tmpdir.join('doctrees')),
+        'text', status=None, warning=Warnings(),
+    )
+    app.build()
+
+    text = outdir.join('index.txt').read()
+    assert 'message Ping {' in text
+    assert 'message Pong {' not in text
+    assert any('Unable to include "net.kevnet.humboldt.Missing"' in warning
+               for warning in warnings)
+
+
+def test_index_used_after_unmoved_edit(env, protodir, protos, monkeypatch):
+    ping = protodir.join('ping.proto')
+    idx = protodir.join('ping.idx')
+    protobuf_fmt.main(protos)
+
+    # An edit that moves no blocks leaves the index unchanged, but the
+    # formatter still marks it as current
+    idx.setmtime(idx.mtime() - 10)
+    ping.write(ping.read().replace('RTT to a', 'RTT to the'))
+    ping.setmtime(idx.mtime() + 5)
+    protobuf_fmt.main([str(ping)])
+    assert idx.mtime() >= ping.mtime()
+
+    def parse(*args, **kwargs):
+        raise AssertionError('The index was not used')
+    monkeypatch.setattr(protobuf_fmt.Parser, 'parse', parse)
+
+    assert 'RTT to the' in sphinx_protobuf.locate(
+        env, ['net.kevnet.humboldt.Ping'],
+    )[3]
+
+
+def test_index_freshened_by_cache_hit(env, protodir, tmpdir):
+    ping = protodir.join('ping.proto')
+    idx = protodir.join('ping.idx')
+    cache = str(tmpdir.join('fmt.cache'))
+    protobuf_fmt.main([str(ping)], cache=cache)
+
+    # As after a checkout restoring the same content
+    ping.setmtime(idx.mtime() + 5)
+    protobuf_fmt.main([str(ping)], cache=cache)
+    assert idx.mtime() >= ping.mtime()
+
+    # But not when only checking
+    ping.setmtime(idx.mtime() + 5)
+    protobuf_fmt.main([str(ping)], cache=cache, check=True)
+    assert idx.mtime() < ping.mtime()
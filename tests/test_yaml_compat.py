@@ -0,0 +1,92 @@
+import io
+import os
+
+import pytest
+import yaml
+
+import proto_bits
+import yaml_compat
+from conftest import ROOT
+
+
+CARRIER = os.path.join(ROOT, 'source', 'bits', 'carrier.bits')
+
+
+@pytest.fixture(autouse=True)
+def impl(monkeypatch):
+    # Restore the selection after each test
+    monkeypatch.setattr(yaml_compat, '_impl', 'auto')
+
+
+@pytest.fixture
+def no_libyaml(monkeypatch):
+    monkeypatch.delattr(yaml, 'CSafeLoader', raising=False)
+    monkeypatch.delattr(yaml, 'CSafeDumper', raising=False)
+
+
+def test_auto():
+    if not hasattr(yaml, 'CSafeLoader'):
+        pytest.skip('PyYAML was built without libyaml')
+
+    assert yaml_compat.classes() == (yaml.CSafeLoader, yaml.CSafeDumper)
+
+
+def test_auto_without_libyaml(no_libyaml):
+    assert yaml_compat.classes() == (yaml.SafeLoader, yaml.SafeDumper)
+
+
+def test_python():
+    yaml_compat.select('python')
+    assert yaml_compat.classes() == (yaml.SafeLoader, yaml.SafeDumper)
+
+
+def test_c_without_libyaml(no_libyaml):
+    with pytest.raises(ValueError) as exc:
+        yaml_compat.select('c')
+    assert str(exc.value) == 'PyYAML was built without libyaml'
+
+
+def test_unknown():
+    with pytest.raises(ValueError) as exc:
+        yaml_compat.select('fast')
+    assert str(exc.value) == 'Unknown YAML implementation "fast"'
+    assert yaml_compat._impl == 'auto'
+
+
+@pytest.mark.parametrize('name', ['auto', 'python'])
+def test_round_trip(name):
+    yaml_compat.select(name)
+    data = {'a': [1, 2.5, None, True], 'b': {'c': u'd'}}
+
+    text = yaml_compat.dump(data)
+    assert yaml_compat.load(text) == data
+    assert list(yaml_compat.load_all(text + '---\n' + text)) == [data, data]
+
+    out = io.StringIO()
+    yaml_compat.dump(data, out)
+    assert out.getvalue() == text
+
+
+def test_safe():
+    with pytest.raises(yaml.YAMLError):
+        yaml_compat.load('!!python/object/apply:os.system ["true"]')
+
+
+def test_option(capsys):
+    assert proto_bits.main.console(['--yaml-impl', 'python', CARRIER]) \
+        is None
+    assert yaml_compat._impl == 'python'
+    python = capsys.readouterr().out
+
+    assert proto_bits.main.console([CARRIER]) is None
+    assert yaml_compat._impl == 'auto'
+    assert capsys.readouterr().out == python
+
+    with pytest.raises(SystemExit):
+        proto_bits.main.console(['--yaml-impl', 'fast', CARRIER])
+    assert 'invalid choice' in capsys.readouterr().err
+
+
+def test_option_without_libyaml(no_libyaml):
+    assert proto_bits.main.console(['--yaml-impl', 'c', CARRIER]) == \
+        'PyYAML was built without libyaml'
@@ -0,0 +1,786 @@
+#!/usr/bin/python
+
+from __future__ import print_function
+
+import gc
+import glob
+import multiprocessing
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+import six
+
+import fast_cli
+import proto_codec
+import proto_graph
+import protobuf_fmt
+import yaml_compat
+
+
+# The default protobuf files to benchmark against
+PROTO_FILES = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'source', 'protobuf', '*.proto',
+)
+
+
+# The directory containing the tools, and the bit diagrams rendered by
+# the startup and YAML benchmarks
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+BITS_FILES = os.path.join(
+    os.path.dirname(TOOLS_DIR), 'source', 'bits', '*.bits',
+)
+CARRIER_BITS = os.path.join(os.path.dirname(BITS_FILES), 'carrier.bits')
+
+
+def _proto_files(files):
+    return files or sorted(glob.glob(PROTO_FILES))
+
+
+def _report(label, seconds, count, unit):
+    print('%-10s %10.3f us/%s' % (label, seconds * 1e6 / count, unit))
+
+
+def _serve(path):
+    # Runs a format server until terminated
+    server = protobuf_fmt.FormatServer(path)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def _client(args):
+    # Sends format requests to a server, returning the number sent
+    path, texts, repeat = args
+    for _i in range(repeat):
+        for fname, text in texts:
+            protobuf_fmt.format_remote(path, text, fname)
+    return repeat * len(texts)
+
+
+def _load_module(fname):
+    # Loads an alternate implementation of a tool for comparison
+    try:
+        import importlib.util
+    except ImportError:
+        import imp
+        return imp.load_source('_baseline', fname)
+
+    spec = importlib.util.spec_from_file_location('_baseline', fname)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _import_times(argv):
+    # Runs a command under "python -X importtime", returning the wall
+    # time and a dictionary mapping each top-level import to its
+    # cumulative time, in seconds
+    start = time.time()
+    proc = subprocess.Popen(
+        [sys.executable, '-X', 'importtime'] + argv,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+    )
+    _out, err = proc.communicate()
+    seconds = time.time() - start
+
+    # Tools such as protobuf_fmt.py --check exit with 1 to report
+    # results, so only worse is a failure
+    if proc.returncode not in (0, 1):
+        raise RuntimeError('%s exited with status %d: %s' % (
+            ' '.join(argv), proc.returncode,
+            six.ensure_str(err).strip().splitlines()[-1:],
+        ))
+
+    imports = {}
+    for line in six.ensure_str(err).splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _self, cumulative, name = line[len('import time:'):].split('|')
+
+        # Nested imports are indented beneath the name
+        if name.startswith('  ') or not cumulative.strip().isdigit():
+            continue
+        imports[name.strip()] = int(cumulative) / 1e6
+
+    return seconds, imports
+
+
+def _count_fields(stmt, field_cls):
+    # Counts the fields in a parsed statement tree
+    if isinstance(stmt, field_cls):
+        return 1
+
+    count = 0
+    for lst in ('blocks', 'fields'):
+        for child in getattr(stmt, lst, None) or []:
+            count += _count_fields(child, field_cls)
+    return count
+
+
+class LegacyLexer(object):
+    """
+    The character-by-character parser helpers that preceded the
+    regular expression lexer, retained for comparison.
+    """
+
+    def tok(self, line):
+        for i in range(len(line)):
+            if not (line[i].isalnum() or line[i] == '_'):
+                return line[:i]
+        return line
+
+    def split_comment(self, line):
+        line, _sep, comment = line.partition('//')
+        comment = comment.rstrip()
+        if comment and comment[0].isspace():
+            comment = comment[1:]
+        return (line.strip(), comment or None)
+
+    def extract_digits(self, line, lno):
+        for i in range(len(line)):
+            if not line[i].isdigit():
+                break
+        else:
+            return len(line), int(line)
+
+        return i, int(line[:i])
+
+
+def _legacy_lex(texts):
+    # The lexing work the parser used to do for each line of a file
+    lexer = LegacyLexer()
+    for text in texts:
+        for line in text.splitlines(True):
+            line, _comment = lexer.split_comment(line.expandtabs())
+            lexer.tok(line)
+
+
+def _regex_lex(texts):
+    # The lexing work the parser does for each file
+    parser = protobuf_fmt.Parser('<bench>')
+    for text in texts:
+        parser.lex(text.expandtabs())
+
+
+# Representative messages for the codec benchmark
+_NODE_ID = b'\x5a' * 16
+CODEC_MESSAGES = {
+    'net.kevnet.humboldt.LinkState': {
+        'max_hops': 8,
+        'sequence': 1234,
+        'id': _NODE_ID,
+        'generation': 3,
+        'neighbors': [
+            {
+                'id': _NODE_ID,
+                'rtt': 250 + i,
+                'principal': u'node%d@example.com' % i,
+                'origin': u'tcp://10.0.0.1:7000',
+                'target': u'tcp://10.0.%d.2:7000' % i,
+            }
+            for i in range(8)
+        ],
+        'conduits': [
+            {'conduit': u'tcp://10.0.0.1:7000', 'network': u'lan'},
+            {'conduit': u'tcp://192.0.2.1:7000', 'network': u''},
+        ],
+        'implementation': u'humboldt-py/1.0',
+    },
+    'net.kevnet.humboldt.CommandRequest': {
+        'id': 42,
+        'command': 2,
+        'args': [
+            {'value_str': u'tcp://192.0.2.7:7000'},
+            {'value_int': 30000},
+            {'value_bool': True},
+            {'value_any': {
+                'type_url': u'type.googleapis.com/net.kevnet.humboldt.Conduit',
+                'value': b'\x0a\x13tcp://10.0.0.1:7000',
+            }},
+        ],
+    },
+    'net.kevnet.humboldt.ForwardTo': {
+        'target': _NODE_ID,
+        'best_hop': b'\xa5' * 16,
+        'second_hop': b'\x3c' * 16,
+    },
+}
+
+
+def _naive_varint(value):
+    data = b''
+    while value > 0x7f:
+        data += six.int2byte(value & 0x7f | 0x80)
+        value >>= 7
+    return data + six.int2byte(value)
+
+
+def _naive_encode(codec, name, msg):
+    # Encodes a message by consulting the field descriptions of the
+    # message for every value, as a reflective encoder would
+    data = b''
+    for info in codec.plan(name).fields:
+        value = msg.get(info.name)
+        if value is None:
+            continue
+        elif info.kind == 'map':
+            values = [{'key': k, 'value': v} for k, v in value.items()]
+        elif info.repeated:
+            values = value
+        elif not info.presence and not value:
+            continue
+        else:
+            values = [value]
+
+        encoded = []
+        for value in values:
+            if info.kind in ('message', 'map'):
+                wire_type = proto_codec.LENGTH_DELIMITED
+                body = _naive_encode(codec, info.type, value)
+                value = _naive_varint(len(body)) + body
+            else:
+                scalar = proto_codec.SCALARS.get(info.type, proto_codec.ENUM)
+                wire_type = scalar.wire_type
+                if scalar.fmt:
+                    value = struct.pack('<' + scalar.fmt, value)
+                elif info.type == 'string':
+                    body = value.encode('utf-8')
+                    value = _naive_varint(len(body)) + body
+                elif info.type == 'bytes':
+                    value = _naive_varint(len(value)) + value
+                elif info.type.startswith('sint'):
+                    value = _naive_varint(value << 1 ^ value >> 63)
+                else:
+                    value = _naive_varint(int(value) % (1 << 64))
+            encoded.append(value)
+
+        if info.packed:
+            body = b''.join(encoded)
+            data += _naive_varint(
+                info.number << 3 | proto_codec.LENGTH_DELIMITED,
+            ) + _naive_varint(len(body)) + body
+        else:
+            for value in encoded:
+                data += _naive_varint(info.number << 3 | wire_type) + value
+
+    return data
+
+
+@fast_cli.argument(
+    '--debug', '-d',
+    action='store_true',
+    help='Enable debugging output.',
+)
+def main():
+    """
+    Run performance benchmarks for the documentation tools.
+    """
+
+    return 'A benchmark must be selected; see --help'
+
+
+@main.subcommand
+@fast_cli.argument(
+    'files',
+    nargs='*',
+    help='The protobuf files to lex.  Defaults to the bundled protobuf '
+    'files.',
+)
+@fast_cli.argument(
+    '--repeat', '-r',
+    type=int,
+    default=200,
+    help='The number of passes to make over the lines.  '
+    'Default: %(default)s',
+)
+def lexer(files, repeat=200):
+    """
+    Compare the per-line cost of splitting protobuf files into
+    statements, comments and keywords using the regular expression
+    lexer with that of the legacy character-by-character helpers.
+    """
+
+    texts = []
+    for fname in _proto_files(files):
+        with open(fname) as f:
+            texts.append(f.read())
+    count = sum(len(text.splitlines()) for text in texts)
+
+    results = []
+    for label, func in [('legacy', _legacy_lex), ('regex', _regex_lex)]:
+        seconds = min(timeit.repeat(
+            lambda: func(texts), number=repeat, repeat=5,
+        ))
+        _report(label, seconds, repeat * count, 'line')
+        results.append(seconds)
+
+    print('speedup    %10.2fx (%d lines)' % (results[0] / results[1], count))
+
+
+@main.subcommand
+@fast_cli.argument(
+    'files',
+    nargs='*',
+    help='The protobuf files to parse.  Defaults to the bundled '
+    'protobuf files.',
+)
+@fast_cli.argument(
+    '--copies', '-c',
+    type=int,
+    default=100,
+    help='The number of parsed copies of the files to hold in memory.  '
+    'Default: %(default)s',
+)
+@fast_cli.argument(
+    '--baseline', '-b',
+    help='The path to another version of protobuf_fmt.py to compare '
+    'against, e.g., one extracted with "git show".',
+)
+def memory(files, copies=100, baseline=None):
+    """
+    Measure the memory consumed by parsed protobuf files, reported as
+    bytes per parsed field.
+    """
+
+    # tracemalloc only exists on Python 3, so it is only imported by
+    # the benchmark that needs it
+    import tracemalloc
+
+    files = _proto_files(files)
+
+    modules = [('current', protobuf_fmt)]
+    if baseline:
+        modules.insert(0, ('baseline', _load_module(baseline)))
+
+    for label, module in modules:
+        gc.collect()
+        tracemalloc.start()
+        parsed = [
+            module.Parser.parse(fname)
+            for _i in range(copies)
+            for fname in files
+        ]
+        size, _peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        fields = sum(
+            _count_fields(pbfile.pbfile, module.Field) for pbfile in parsed
+        )
+        print('%-10s %10.1f bytes/field (%d fields)' % (
+            label, float(size) / fields, fields,
+        ))
+        del parsed
+
+
+@main.subcommand('ast-cache')
+@fast_cli.argument(
+    'files',
+    nargs='*',
+    help='The protobuf files to parse.  Defaults to the bundled '
+    'protobuf files.',
+)
+@fast_cli.argument(
+    '--repeat', '-r',
+    type=int,
+    default=100,
+    help='The number of passes to make over the files.  '
+    'Default: %(default)s',
+)
+def ast_cache(files, repeat=100):
+    """
+    Compare the cost of parsing protobuf files with that of loading
+    them from the parsed AST cache.
+    """
+
+    files = _proto_files(files)
+    directory = tempfile.mkdtemp()
+    try:
+        cache = protobuf_fmt.ASTCache(directory)
+
+        def cold():
+            for fname in files:
+                protobuf_fmt.Parser.parse(fname)
+
+        def cached():
+            for fname in files:
+                protobuf_fmt.Parser.parse(fname, cache)
+
+        # Populate the cache
+        cached()
+
+        results = []
+        for label, func in [('parse', cold), ('cache-hit', cached)]:
+            seconds = min(timeit.repeat(func, number=repeat, repeat=5))
+            _report(label, seconds, repeat * len(files), 'file')
+            results.append(seconds)
+    finally:
+        shutil.rmtree(directory)
+
+    print('speedup    %10.2fx (%d files)' % (
+        results[0] / results[1], len(files),
+    ))
+
+
+@main.subcommand
+@fast_cli.argument(
+    'files',
+    nargs='*',
+    help='The protobuf files to index.  Defaults to the bundled protobuf '
+    'files.',
+)
+@fast_cli.argument(
+    '--repeat', '-r',
+    type=int,
+    default=20,
+    help='The number of passes to make over the files.  '
+    'Default: %(default)s',
+)
+def index(files, repeat=20):
+    """
+    Compare the cost of loading location indexes in the YAML and JSON
+    formats.
+    """
+
+    files = _proto_files(files)
+    directory = tempfile.mkdtemp()
+    try:
+        # Write both index formats for each file
+        names = []
+        for fname in files:
+            name = os.path.join(directory, os.path.basename(fname))
+            pbfile = protobuf_fmt.Parser.parse(fname)
+            pbfile.render()
+            for fmt in protobuf_fmt.INDEX_FORMATS:
+                with open(protobuf_fmt.idx_name(name, fmt), 'wb') as f:
+                    f.write(protobuf_fmt.index_data(pbfile.locations, fmt))
+            names.append(name)
+
+        results = []
+        for fmt in ('yaml', 'json'):
+            seconds = min(timeit.repeat(
+                lambda: [
+                    protobuf_fmt.LocationIndex.load(name, fmt)
+                    for name in names
+                ],
+                number=repeat, repeat=5,
+            ))
+            _report(fmt, seconds, repeat * len(names), 'file')
+            results.append(seconds)
+    finally:
+        shutil.rmtree(directory)
+
+    print('speedup    %10.2fx (%d files)' % (
+        results[0] / results[1], len(files),
+    ))
+
+
+@main.subcommand
+@fast_cli.argument(
+    'files',
+    nargs='*',
+    help='The protobuf files to format.  Defaults to the bundled protobuf '
+    'files.',
+)
+@fast_cli.argument(
+    '--repeat', '-r',
+    type=int,
+    default=20,
+    help='The number of passes each client makes over the files.  '
+    'Default: %(default)s',
+)
+@fast_cli.argument(
+    '--clients', '-c',
+    type=int,
+    default=1,
+    help='The number of client processes sending requests at once.  '
+    'Default: %(default)s',
+)
+def server(files, repeat=20, clients=1):
+    """
+    Measure the number of format requests per second that a single
+    format server sustains.
+    """
+
+    texts = []
+    for fname in _proto_files(files):
+        with open(fname) as f:
+            texts.append((fname, f.read()))
+
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'format.sock')
+    proc = multiprocessing.Process(target=_serve, args=(path,))
+    proc.start()
+    try:
+        # Wait for the server to start listening
+        while not os.path.exists(path):
+            time.sleep(0.01)
+
+        # Warm up the server
+        _client((path, texts, 1))
+
+        pool = multiprocessing.Pool(clients)
+        try:
+            start = time.time()
+            count = sum(pool.map(_client, [(path, texts, repeat)] * clients))
+            seconds = time.time() - start
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        proc.terminate()
+        proc.join()
+        shutil.rmtree(directory)
+
+    _report('request', seconds, count, 'request')
+    print('throughput %10.1f requests/s (%d requests, %d clients)' % (
+        count / seconds, count, clients,
+    ))
+
+
+@main.subcommand
+@fast_cli.argument(
+    'files',
+    nargs='*',
+    help='The protobuf files to check.  Defaults to the bundled protobuf '
+    'files.',
+)
+@fast_cli.argument(
+    '--repeat', '-r',
+    type=int,
+    default=10,
+    help='The number of times to start each tool; the fastest start is '
+    'reported.  Default: %(default)s',
+)
+@fast_cli.argument(
+    '--top', '-t',
+    type=int,
+    default=5,
+    help='The number of the slowest imports to list.  '
+    'Default: %(default)s',
+)
+@fast_cli.argument(
+    '--limit', '-l',
+    type=float,
+    metavar='MS',
+    help='Fail if any tool takes more than MS milliseconds longer to run '
+    'than the bare interpreter takes to start.',
+)
+def startup(files, repeat=10, top=5, limit=None):
+    """
+    Measure the cold-start time of the tools run by every Make rule
+    and editor hook, "proto_bits.py --bare" and "protobuf_fmt.py
+    --check", with the slowest imports reported by "python -X
+    importtime".  Requires Python 3.7 or later.
+    """
+
+    if sys.version_info < (3, 7):
+        return 'The startup benchmark requires Python 3.7 or later'
+
+    commands = [
+        ('proto_bits.py --bare %s' % os.path.basename(CARRIER_BITS), [
+            os.path.join(TOOLS_DIR, 'proto_bits.py'), '--bare', CARRIER_BITS,
+        ]),
+        ('protobuf_fmt.py --check', [
+            os.path.join(TOOLS_DIR, 'protobuf_fmt.py'), '--check',
+        ] + _proto_files(files)),
+    ]
+
+    def fastest(argv):
+        # Keeps the fastest wall time and import times over the runs
+        wall = None
+        imports = {}
+        for _i in range(repeat):
+            seconds, times = _import_times(argv)
+            wall = seconds if wall is None else min(wall, seconds)
+            for name, value in times.items():
+                imports[name] = min(imports.get(name, value), value)
+        return wall, imports
+
+    try:
+        base_wall, base_imports = fastest(['-c', 'pass'])
+        print('%-24s %8.1f ms' % ('interpreter', base_wall * 1e3))
+
+        slow = []
+        for label, argv in commands:
+            wall, imports = fastest(argv)
+
+            # Leave out the imports made by the interpreter itself
+            imports = dict(
+                (name, value) for name, value in imports.items()
+                if name not in base_imports
+            )
+
+            print(label)
+            print('    %-20s %8.1f ms (+%.1f ms)' % (
+                'wall', wall * 1e3, (wall - base_wall) * 1e3,
+            ))
+            print('    %-20s %8.1f ms' % (
+                'imports', sum(imports.values()) * 1e3,
+            ))
+            for name, value in sorted(
+                    imports.items(), key=lambda item: -item[1])[:top]:
+                print('        %-16s %8.1f ms' % (name, value * 1e3))
+
+            if limit is not None and (wall - base_wall) * 1e3 > limit:
+                slow.append(label)
+    except (RuntimeError, EnvironmentError) as exc:
+        return str(exc)
+
+    if slow:
+        return 'Over the %.1f ms limit: %s' % (limit, ', '.join(slow))
+
+    return None
+
+
+@main.subcommand('yaml')
+@fast_cli.argument(
+    '--documents', '-n',
+    type=int,
+    default=4000,
+    help='The number of documents in the synthetic bit diagram file.  '
+    'Default: %(default)s',
+)
+@fast_cli.argument(
+    '--entries', '-e',
+    type=int,
+    default=20000,
+    help='The number of blocks in the synthetic location index.  '
+    'Default: %(default)s',
+)
+@fast_cli.argument(
+    '--repeat', '-r',
+    type=int,
+    default=3,
+    help='The number of times to load and dump each file; the fastest '
+    'time is reported.  Default: %(default)s',
+)
+def yaml_impls(documents=4000, entries=20000, repeat=3):
+    """
+    Compare the time taken by the pure Python and libyaml
+    implementations of PyYAML to load a synthetic bit diagram file of
+    many documents, and to load and dump a synthetic location index
+    of many blocks.
+    """
+
+    # Build the bit diagram file from the bundled diagrams
+    texts = []
+    for fname in sorted(glob.glob(BITS_FILES)):
+        with open(fname) as f:
+            texts.append(f.read())
+    bits_text = ''.join(
+        texts[i % len(texts)] for i in range(documents)
+    )
+
+    # Lay the blocks out back to back, as in a formatted file
+    locations = {}
+    for i in range(entries):
+        locations['message:Message%d' % i] = {
+            'start': i * 10 + 1,
+            'block_start': i * 10 + 3,
+            'end': i * 10 + 11,
+        }
+
+    directory = tempfile.mkdtemp()
+    try:
+        bits_file = os.path.join(directory, 'synthetic.bits')
+        with open(bits_file, 'w') as f:
+            f.write(bits_text)
+        idx_file = protobuf_fmt.idx_name(
+            os.path.join(directory, 'synthetic.proto'),
+        )
+        with open(idx_file, 'wb') as f:
+            f.write(protobuf_fmt.index_data(locations))
+
+        def load_bits():
+            with open(bits_file) as f:
+                return list(yaml_compat.load_all(f))
+
+        def load_index():
+            with open(idx_file) as f:
+                return yaml_compat.load(f)
+
+        benchmarks = [
+            ('bits load', load_bits),
+            ('idx load', load_index),
+            ('idx dump', lambda: protobuf_fmt.index_data(locations)),
+        ]
+
+        results = {}
+        for impl in ('python', 'c'):
+            try:
+                yaml_compat.select(impl)
+            except ValueError as exc:
+                return str(exc)
+
+            for label, func in benchmarks:
+                results[impl, label] = min(timeit.repeat(
+                    func, number=1, repeat=repeat,
+                ))
+    finally:
+        yaml_compat.select('auto')
+        shutil.rmtree(directory)
+
+    print('%d documents, %d blocks' % (documents, entries))
+    print('%-10s %10s %10s %8s' % ('', 'python', 'libyaml', 'speedup'))
+    for label, _func in benchmarks:
+        python, libyaml = results['python', label], results['c', label]
+        print('%-10s %8.1f ms %7.1f ms %7.2fx' % (
+            label, python * 1e3, libyaml * 1e3, python / libyaml,
+        ))
+
+
+@main.subcommand
+@fast_cli.argument(
+    'files',
+    nargs='*',
+    help='The protobuf files defining the messages.  Defaults to the '
+    'bundled protobuf files.',
+)
+@fast_cli.argument(
+    '--repeat', '-r',
+    type=int,
+    default=10000,
+    help='The number of times to encode and decode each message.  '
+    'Default: %(default)s',
+)
+def codec(files, repeat=10000):
+    """
+    Compare the throughput of the compiled protobuf codec against a
+    naive reflective encoder, in messages per second.
+    """
+
+    graph = proto_graph.ImportGraph()
+    for fname in _proto_files(files):
+        graph.add(fname)
+    compiled = proto_codec.Codec(graph)
+
+    for name, msg in sorted(CODEC_MESSAGES.items()):
+        data = compiled.encode(name, msg)
+        if _naive_encode(compiled, name, msg) != data:
+            return 'Encodings of %s differ' % name
+        if compiled.encode(name, compiled.decode(name, data)) != data:
+            return 'Decoding of %s does not round-trip' % name
+
+        print('%s (%d bytes)' % (name.rpartition('.')[2], len(data)))
+        results = []
+        for label, func in [
+                ('naive', lambda: _naive_encode(compiled, name, msg)),
+                ('encode', lambda: compiled.encode(name, msg)),
+                ('decode', lambda: compiled.decode(name, data)),
+        ]:
+            seconds = min(timeit.repeat(func, number=repeat, repeat=5))
+            print('    %-8s %12.0f messages/s' % (label, repeat / seconds))
+            results.append(seconds)
+        print('    speedup  %12.2fx' % (results[0] / results[1]))
+
+
+if __name__ == '__main__':
+    sys.exit(main.console())
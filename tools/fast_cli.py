@@ -0,0 +1,122 @@
+"""
+A minimal implementation of the parts of cli_tools used by the tools.
+Importing cli_tools imports pkg_resources, which takes longer than
+most of the tools take to run on a single file; this module only
+needs argparse.
+
+The ``argument`` decorator and the ``console`` and ``subcommand``
+methods of the decorated function behave as in cli_tools:
+
+.. code-block:: python
+
+    @fast_cli.argument('--debug', '-d', action='store_true')
+    def main():
+        return 'A command must be selected; see --help'
+
+    @main.subcommand
+    @fast_cli.argument('files', nargs='+')
+    def check(files):
+        ...
+
+    if __name__ == '__main__':
+        sys.exit(main.console())
+"""
+
+import argparse
+
+
+def _clean_text(text):
+    # Extracts the first paragraph of a docstring, as a single line
+    desc = []
+    for line in (text or '').strip().split('\n'):
+        line = line.strip()
+        if not line:
+            break
+        desc.append(line)
+
+    return ' '.join(desc)
+
+
+def _setup(func, parser):
+    # Adds the arguments and subcommands of a function to a parser
+    for args, kwargs in getattr(func, '_fast_cli_arguments', []):
+        parser.add_argument(*args, **kwargs)
+
+    subcommands = getattr(func, '_fast_cli_subcommands', None)
+    if subcommands:
+        subparsers = parser.add_subparsers()
+        for name, sub in subcommands:
+            sub_parser = subparsers.add_parser(
+                name, description=_clean_text(sub.__doc__),
+            )
+            _setup(sub, sub_parser)
+            sub_parser.set_defaults(_fast_cli_func=sub)
+
+
+def console(func, argv=None):
+    """
+    Call a function, or the subcommand selected, as a console script.
+    The command line arguments are passed as keyword arguments.  If
+    the ``--debug`` option is given, an exception raised by the
+    function is re-raised; otherwise, its string value is returned.
+    """
+
+    parser = argparse.ArgumentParser(description=_clean_text(func.__doc__))
+    _setup(func, parser)
+    args = parser.parse_args(argv)
+    func = getattr(args, '_fast_cli_func', func)
+
+    # Only pass the arguments the function accepts, as cli_tools does
+    code = func.__code__
+    kwargs = dict(
+        (name, getattr(args, name))
+        for name in code.co_varnames[:code.co_argcount]
+        if hasattr(args, name)
+    )
+
+    try:
+        return func(**kwargs)
+    except Exception as exc:
+        if getattr(args, 'debug', False):
+            raise
+        return str(exc)
+
+
+def _prepare(func):
+    # Gives a function the console() and subcommand() methods
+    if hasattr(func, '_fast_cli_subcommands'):
+        return
+
+    func._fast_cli_subcommands = []
+    func.console = lambda argv=None: console(func, argv)
+
+    def subcommand(name=None):
+        # Usable bare, or called with the name of the subcommand
+        def decorator(sub, name=name):
+            _prepare(sub)
+            func._fast_cli_subcommands.append((name or sub.__name__, sub))
+            return sub
+
+        if callable(name):
+            return decorator(name, None)
+        return decorator
+    func.subcommand = subcommand
+
+
+def argument(*args, **kwargs):
+    """
+    Decorator used to specify an argument taken by the console script.
+    Positional and keyword arguments have the same meaning as those
+    given to ``argparse.ArgumentParser.add_argument()``.
+    """
+
+    def decorator(func):
+        _prepare(func)
+        if not hasattr(func, '_fast_cli_arguments'):
+            func._fast_cli_arguments = []
+
+        # Decorators are applied from the bottom up, so insert each
+        # argument ahead of those already added
+        func._fast_cli_arguments.insert(0, (args, kwargs))
+        return func
+    return decorator
@@ -3,13 +3,25 @@
 from __future__ import print_function
 
 import abc
+import hashlib
+import json
 import math
+import os
 import sys
 import textwrap
 
-import cli_tools
 import six
-import yaml
+
+import fast_cli
+import yaml_compat
+
+# Bump this whenever the rendering changes, so that batch mode renders
+# every file again
+VERSION = 1
+
+# The name of the file, in the output directory, recording the hashes
+# of the files last rendered there
+HASH_FILE = '.proto_bits.json'
 
 leader = [
     "                     1                   2                   3",
@@ -450,7 +462,7 @@ class Packet(object):
     @classmethod
     def from_yaml(cls, fname):
         with open(fname) as f:
-            all_data = list(yaml.safe_load_all(f))
+            all_data = list(yaml_compat.load_all(f))
 
         for data in all_data:
             # Interpret the YAML
@@ -650,42 +662,179 @@ class Packet(object):
         return self._data
 
 
-@cli_tools.argument(
+def render_file(fname, indent='', bare=False):
+    """
+    Render all the protocol packets described by a YAML file.
+
+    :param str fname: The name of the YAML file.
+    :param str indent: The indent to add to the beginning of each line.
+    :param bool bare: If ``True``, the filename and index header is
+                      omitted.
+
+    :returns: The rendered text.
+    """
+
+    text = []
+    for i, packet in enumerate(Packet.from_yaml(fname)):
+        if i > 0:
+            text.append('\n')
+        if not bare:
+            text.append('%s%s:\n\n' % (
+                fname, (' (idx %d)' % i) if i > 0 else '',
+            ))
+        text.append(packet.render(indent) + '\n')
+
+    return ''.join(text)
+
+
+def render_dir(files, output_dir, indent='', bare=False):
+    """
+    Render YAML files into a directory, as a ``.txt`` file for each.
+    Files whose content and rendering options match those of the last
+    render into the directory are skipped.
+
+    :param list files: The names of the YAML files.
+    :param str output_dir: The output directory.
+    :param str indent: The indent to add to the beginning of each line.
+    :param bool bare: If ``True``, the filename and index header is
+                      omitted.
+
+    :returns: A list of tuples of the name of each YAML file and the
+              name of the file it was rendered to.
+    """
+
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    hash_file = os.path.join(output_dir, HASH_FILE)
+    try:
+        with open(hash_file) as f:
+            hashes = json.load(f)
+    except (IOError, OSError, ValueError):
+        hashes = {}
+
+    outputs = []
+    updated = False
+    for fname in files:
+        out = os.path.join(
+            output_dir,
+            os.path.splitext(os.path.basename(fname))[0] + '.txt',
+        )
+        outputs.append((fname, out))
+
+        with open(fname, 'rb') as f:
+            digest = hashlib.sha256(
+                ('%d:%r:%r:' % (VERSION, indent, bare)).encode('utf-8') +
+                f.read()
+            ).hexdigest()
+
+        key = os.path.abspath(fname)
+        if hashes.get(key) == digest and os.path.exists(out):
+            continue
+
+        text = render_file(fname, indent, bare)
+        with open(out, 'w') as f:
+            f.write(text)
+        hashes[key] = digest
+        updated = True
+
+        print('Rendered %s' % out)
+
+    # Leave the hash file alone when nothing was rendered
+    if updated:
+        with open(hash_file, 'w') as f:
+            json.dump(hashes, f, indent=2, sort_keys=True)
+
+    return outputs
+
+
+def write_depfile(depfile, outputs):
+    """
+    Write a Make-compatible dependency file for a batch render.  Each
+    output depends on its YAML file, and the dependency file itself
+    depends on all the YAML files and on this tool.
+
+    :param str depfile: The name of the dependency file.
+    :param list outputs: The list returned by ``render_dir()``.
+    """
+
+    tool = os.path.relpath(os.path.splitext(__file__)[0] + '.py')
+    lines = ['%s: %s' % (out, fname) for fname, out in outputs]
+    lines.append(' \\\n    '.join(
+        ['%s: %s' % (depfile, tool)] + [fname for fname, _out in outputs]
+    ))
+
+    with open(depfile, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+@fast_cli.argument(
     'files',
     nargs='+',
     help='The YAML files to render.',
 )
-@cli_tools.argument(
+@fast_cli.argument(
     '--indent', '-i',
     default='',
     help='The indent to add to the beginning of each line.',
 )
-@cli_tools.argument(
+@fast_cli.argument(
     '--bare', '-b',
     action='store_true',
     help='Suppress the filename and index header.',
 )
-@cli_tools.argument(
+@fast_cli.argument(
+    '--output-dir', '-o',
+    metavar='DIR',
+    help='Render each file to a ".txt" file of the same name in DIR, '
+    'rather than to standard output.  Files unchanged since they were '
+    'last rendered to DIR are skipped.  Implies --bare.',
+)
+@fast_cli.argument(
+    '--depfile', '-M',
+    metavar='FILE',
+    help='With --output-dir, write a Make-compatible dependency file to '
+    'FILE.',
+)
+@fast_cli.argument(
+    '--yaml-impl', '-Y',
+    choices=yaml_compat.IMPLS,
+    default='auto',
+    help='The PyYAML implementation to use: "c" for libyaml, "python" for '
+    'pure Python, or "auto" for libyaml if available.  '
+    'Default: %(default)s',
+)
+@fast_cli.argument(
     '--debug', '-d',
     action='store_true',
     help='Enable debugging output.',
 )
-def main(files, indent='', bare=False):
+def main(files, indent='', bare=False, output_dir=None, depfile=None,
+         yaml_impl='auto'):
     """
     Render a YAML file describing a protocol packet into a textual
     representation of that protocol packet.
     """
 
+    yaml_compat.select(yaml_impl)
+
+    if output_dir:
+        outputs = render_dir(files, output_dir, indent, True)
+        if depfile:
+            write_depfile(depfile, outputs)
+        return None
+    elif depfile:
+        return '--depfile requires --output-dir'
+
     sep = False
     for fname in files:
-        for i, packet in enumerate(Packet.from_yaml(fname)):
-            if sep:
-                print()
-            if not bare:
-                print('%s%s:\n' % (fname, (' (idx %d)' % i) if i > 0 else ''))
-            print(packet.render(indent))
+        text = render_file(fname, indent, bare)
+        if text:
+            sys.stdout.write(('\n' if sep else '') + text)
             sep = True
 
+    return None
+
 
 if __name__ == '__main__':
     sys.exit(main.console())
@@ -0,0 +1,500 @@
+#!/usr/bin/python
+
+from __future__ import print_function
+
+import bisect
+import os
+import sys
+
+import six
+
+import fast_cli
+import proto_graph
+import protobuf_fmt
+
+
+# The scalar value types, which need no resolution
+SCALAR_TYPES = frozenset([
+    'double', 'float', 'int32', 'int64', 'uint32', 'uint64', 'sint32',
+    'sint64', 'fixed32', 'fixed64', 'sfixed32', 'sfixed64', 'bool',
+    'string', 'bytes',
+])
+
+# The types permitted for map keys
+MAP_KEY_TYPES = SCALAR_TYPES - frozenset(['double', 'float', 'bytes'])
+
+# The kinds of symbols that may contain other symbols
+AGGREGATES = frozenset(['package', 'message'])
+
+# The kinds of symbols that may be named by each kind of type
+# reference, other than map keys, which must be scalars
+REFERENCES = {
+    'field': ('message', 'enum'),
+    'extend': ('message',),
+}
+
+# The largest field number, and the range of field numbers reserved
+# for the protobuf implementation
+FIELD_MAX = 536870911
+IMPLEMENTATION_RESERVED = (19000, 19999)
+
+# The largest enum value
+ENUM_MAX = 2147483647
+
+
+def _join(scope, name):
+    return '%s.%s' % (scope, name) if scope else name
+
+
+class TypeChecker(object):
+    """
+    Resolves the types referenced by fields, and the messages extended
+    by extension blocks, following the protobuf scoping rules: a name
+    is looked up in the enclosing message, then each message enclosing
+    that, then the package and each of its parents, considering only
+    the symbols defined by the file itself or by the files it imports.
+    The symbols of all files are kept in a single hash table, and each
+    file's imports are reduced to a set of visible files, so checking
+    takes time linear in the size of the corpus.
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+
+        # Maps each fully qualified name to a dictionary mapping the
+        # name of each file defining the symbol to the kind of symbol
+        self.symbols = {}
+
+        # Maps the name of each file to a list of tuples describing the
+        # type references it contains; see _collect()
+        self.refs = {}
+
+        # Maps the name of each file to the set of files whose symbols
+        # are visible to files importing it
+        self._exports = {}
+
+        # Maps the name of each file to the list of the names of the
+        # files it imports publicly
+        self._public = {}
+
+        # The names of the files importing well-known types that are
+        # not on the search path; see proto_graph.WELL_KNOWN
+        self._well_known = set()
+
+        for fname, pbfile in graph.files.items():
+            self._collect(fname, pbfile)
+
+    def _define(self, name, kind, fname):
+        self.symbols.setdefault(name, {}).setdefault(fname, kind)
+
+    def _collect(self, fname, pbfile):
+        # Records the symbols defined by a file, and the type references
+        # it contains as tuples of the line number, the scope, the
+        # referenced name, and the kind of reference
+        package = ''
+        for stmt in pbfile.pbfile.statements:
+            if isinstance(stmt, protobuf_fmt.Package):
+                package = stmt.name
+
+        parts = package.split('.') if package else []
+        for i in range(len(parts)):
+            self._define('.'.join(parts[:i + 1]), 'package', fname)
+
+        public = [
+            self.graph.resolve(imp.iname[1:-1], fname)
+            for imp in pbfile.pbfile.imports
+            if isinstance(imp, protobuf_fmt.Import) and imp.type_ == 'public'
+        ]
+        self._public[fname] = [dep for dep in public if dep is not None]
+
+        for imp in pbfile.pbfile.imports:
+            if (isinstance(imp, protobuf_fmt.Import) and
+                    imp.iname[1:-1].startswith(proto_graph.WELL_KNOWN) and
+                    self.graph.resolve(imp.iname[1:-1], fname) is None):
+                self._well_known.add(fname)
+
+        refs = []
+        todo = [(block, package) for block in pbfile.pbfile.blocks]
+        while todo:
+            block, scope = todo.pop()
+            if isinstance(block, protobuf_fmt.ExtendBlock):
+                refs.append((block.lno, scope, block.name, 'extend'))
+                inner = scope
+            elif isinstance(block, protobuf_fmt.OneofBlock):
+                inner = scope
+            elif isinstance(block, (protobuf_fmt.MessageBlock,
+                                    protobuf_fmt.EnumBlock)):
+                inner = _join(scope, block.name)
+                self._define(inner, block.TYPE, fname)
+            else:
+                # A comment
+                continue
+
+            for item in getattr(block, 'fields', ()):
+                if isinstance(item, protobuf_fmt.Block):
+                    todo.append((item, inner))
+                elif isinstance(item, protobuf_fmt.MapField):
+                    refs.append((item.lno, inner, item.type_, 'key'))
+                    refs.append((item.lno, inner, item.value_type, 'field'))
+                elif isinstance(item, protobuf_fmt.Field):
+                    refs.append((item.lno, inner, item.type_, 'field'))
+
+        self.refs[fname] = refs
+
+    def exports(self, fname):
+        """
+        Compute the files whose symbols a file makes visible to the
+        files importing it: the file itself, and the files it imports
+        publicly, along with their exports in turn.
+        """
+
+        if fname not in self._exports:
+            # Mark the file first, so public import cycles terminate
+            exports = self._exports[fname] = set([fname])
+            for dep in self._public.get(fname, []):
+                exports |= self.exports(dep)
+
+        return self._exports[fname]
+
+    def visible(self, fname):
+        """
+        Compute the files whose symbols are visible to a file.
+        """
+
+        visible = set([fname])
+        for dep in self.graph.imports.get(fname, []):
+            visible |= self.exports(dep)
+
+        return visible
+
+    def _kinds(self, name, visible):
+        # Finds the kinds of a symbol defined by the visible files
+        defs = self.symbols.get(name)
+        if not defs:
+            return set()
+        elif visible is None:
+            return set(defs.values())
+        return set(kind for fname, kind in defs.items() if fname in visible)
+
+    def resolve(self, name, scope, visible=None):
+        """
+        Resolve a type name, as written in a scope, returning its fully
+        qualified name and the set of the kinds of symbol it names,
+        which is empty if the name does not resolve.
+        """
+
+        if name.startswith('.'):
+            return name[1:], self._kinds(name[1:], visible)
+
+        # Find the innermost scope defining the first component of the
+        # name; if there are more components, the symbol found must be
+        # able to contain them
+        first, _sep, rest = name.partition('.')
+        parts = scope.split('.') if scope else []
+        for i in range(len(parts), -1, -1):
+            prefix = '.'.join(parts[:i])
+            kinds = self._kinds(_join(prefix, first), visible)
+            if kinds and (not rest or kinds & AGGREGATES):
+                full = _join(prefix, name)
+                return full, self._kinds(full, visible) if rest else kinds
+
+        return name, set()
+
+    def check(self, fname):
+        """
+        Check the type references in a file, returning a list of
+        ``PBException`` objects for those that do not resolve.
+        """
+
+        errors = []
+        visible = self.visible(fname)
+        for lno, scope, name, ref in sorted(self.refs.get(fname, [])):
+            if ref == 'key':
+                if name not in MAP_KEY_TYPES:
+                    errors.append(protobuf_fmt.PBException(
+                        'Invalid map key type "%s"' % name,
+                        fname=fname,
+                        lno=lno,
+                    ))
+                continue
+
+            kinds = REFERENCES[ref]
+            if name in SCALAR_TYPES:
+                if ref == 'field':
+                    continue
+                full, found = name, set(['scalar'])
+            else:
+                full, found = self.resolve(name, scope, visible)
+                if found.intersection(kinds):
+                    continue
+
+                # Assume the well-known types exist, if they are imported
+                if (not found and fname in self._well_known and
+                        name.lstrip('.').startswith('google.protobuf.')):
+                    continue
+
+            if found:
+                msg = '"%s" is not a %s type' % (full, ' or '.join(kinds))
+            else:
+                defs = self.symbols.get(
+                    self.resolve(name, scope)[0], {},
+                )
+                if defs:
+                    msg = '"%s" is defined in %s, which is not imported' % (
+                        name, ', '.join(sorted(defs)),
+                    )
+                elif full != name:
+                    msg = '"%s" resolves to "%s", which is not defined' % (
+                        name, full,
+                    )
+                else:
+                    msg = '"%s" is not defined' % name
+
+            errors.append(protobuf_fmt.PBException(
+                msg, fname=fname, lno=lno,
+            ))
+
+        return errors
+
+
+def _range_text(low, high):
+    return '%d' % low if low == high else '%d to %d' % (low, high)
+
+
+class RangeIndex(object):
+    """
+    An index of reserved number ranges, which checks a number against
+    all the ranges in logarithmic time.  The ranges are sorted by their
+    low ends; alongside each is kept whichever range, of it and those
+    before it, reaches highest, so overlapping ranges need no special
+    handling.
+    """
+
+    def __init__(self, ranges):
+        self._lows = []
+        self._reach = []
+
+        # A list of tuples of pairs of overlapping ranges
+        self.overlaps = []
+
+        reach = None
+        for rng in sorted(ranges, key=lambda rng: rng[:2]):
+            if reach is not None and rng[0] <= reach[1]:
+                self.overlaps.append((reach, rng))
+            if reach is None or rng[1] > reach[1]:
+                reach = rng
+
+            self._lows.append(rng[0])
+            self._reach.append(reach)
+
+    def find(self, number):
+        """
+        Find a range containing a number, or ``None`` if no range
+        contains it.
+        """
+
+        i = bisect.bisect_right(self._lows, number)
+        if i and self._reach[i - 1][1] >= number:
+            return self._reach[i - 1]
+
+        return None
+
+
+def _reserved(block, maximum):
+    # Collects the reserved ranges and names of a message or enum
+    ranges = []
+    names = {}
+    for resv in block.reserved:
+        if not isinstance(resv, protobuf_fmt.Reserved):
+            # A comment
+            continue
+
+        for rng in resv.ranges:
+            if isinstance(rng, six.string_types):
+                names.setdefault(rng[1:-1], resv)
+            elif isinstance(rng, six.integer_types):
+                ranges.append((rng, rng, resv))
+            else:
+                high = maximum if rng.high is None else rng.high
+                ranges.append((rng.low, high, resv))
+
+    return RangeIndex(ranges), names
+
+
+def _check_numbers(fname, kind, number, items, index, names, unique=True):
+    # Checks the numbers of the fields of a message or the values of an
+    # enum against each other and against the reserved ranges and names
+    errors = []
+    for low, high, resv in (pair[1] for pair in index.overlaps):
+        errors.append(protobuf_fmt.PBException(
+            'Reserved range %s overlaps another range' % (
+                _range_text(low, high),
+            ),
+            fname=fname,
+            lno=resv.lno,
+        ))
+
+    used = {}
+    for item in items:
+        rng = index.find(item.value)
+        if rng is not None:
+            errors.append(protobuf_fmt.PBException(
+                '%s %s %d of "%s" is reserved on line %d' % (
+                    kind, number, item.value, item.name, rng[2].lno,
+                ),
+                fname=fname,
+                lno=item.lno,
+            ))
+
+        if item.name in names:
+            errors.append(protobuf_fmt.PBException(
+                '%s name "%s" is reserved on line %d' % (
+                    kind, item.name, names[item.name].lno,
+                ),
+                fname=fname,
+                lno=item.lno,
+            ))
+
+        other = used.setdefault(item.value, item)
+        if unique and other is not item:
+            errors.append(protobuf_fmt.PBException(
+                '%s %s %d of "%s" is already used by "%s" on line %d' % (
+                    kind, number, item.value, item.name, other.name,
+                    other.lno,
+                ),
+                fname=fname,
+                lno=item.lno,
+            ))
+
+    return errors
+
+
+def check_numbers(fname, pbfile):
+    """
+    Check the field numbers of each message, and the values of each
+    enum, for duplicates and for conflicts with the reserved numbers
+    and names.  The fields of a oneof share the number space of the
+    enclosing message, and duplicate enum values are permitted if the
+    enum sets the ``allow_alias`` option.  Returns a list of
+    ``PBException`` objects.
+    """
+
+    errors = []
+    todo = list(pbfile.pbfile.blocks)
+    while todo:
+        block = todo.pop()
+        if isinstance(block, protobuf_fmt.EnumBlock):
+            index, names = _reserved(block, ENUM_MAX)
+            alias = any(
+                opt.name == 'allow_alias' and opt.value == 'true'
+                for opt in block.options
+                if isinstance(opt, protobuf_fmt.Option)
+            )
+            errors.extend(_check_numbers(
+                fname, 'Enum', 'value',
+                [item for item in block.enum
+                 if isinstance(item, protobuf_fmt.Enum)],
+                index, names, not alias,
+            ))
+            continue
+        elif not isinstance(block, (protobuf_fmt.MessageBlock,
+                                    protobuf_fmt.ExtendBlock)):
+            # A comment
+            continue
+
+        # Collect the fields, including those of any oneofs
+        fields = []
+        items = list(block.fields)
+        while items:
+            item = items.pop(0)
+            if isinstance(item, protobuf_fmt.OneofBlock):
+                items[:0] = item.fields
+            elif isinstance(item, protobuf_fmt.Block):
+                todo.append(item)
+            elif isinstance(item, protobuf_fmt.Field):
+                fields.append(item)
+
+        for fld in fields:
+            if not 1 <= fld.value <= FIELD_MAX:
+                msg = 'Field number %d of "%s" is out of range'
+            elif (IMPLEMENTATION_RESERVED[0] <= fld.value <=
+                  IMPLEMENTATION_RESERVED[1]):
+                msg = ('Field number %d of "%s" is reserved for the protobuf '
+                       'implementation')
+            else:
+                continue
+            errors.append(protobuf_fmt.PBException(
+                msg % (fld.value, fld.name), fname=fname, lno=fld.lno,
+            ))
+
+        if isinstance(block, protobuf_fmt.MessageBlock):
+            index, names = _reserved(block, FIELD_MAX)
+        else:
+            # Extension numbers are checked only against each other
+            index, names = RangeIndex([]), {}
+        errors.extend(_check_numbers(
+            fname, 'Field', 'number', fields, index, names,
+        ))
+
+    return sorted(errors, key=lambda exc: exc.lno)
+
+
+@fast_cli.argument(
+    'files',
+    nargs='+',
+    help='The protobuf files to check.  Files they import are read, but '
+    'not checked.',
+)
+@fast_cli.argument(
+    '--include', '-I',
+    dest='path',
+    action='append',
+    metavar='DIR',
+    help='Add DIR to the directories searched for imported files.  If '
+    'not given, imports are resolved relative to the importing file.',
+)
+@fast_cli.argument(
+    '--ast-cache', '-a',
+    metavar='DIR',
+    help='Cache parsed protobuf files in DIR.',
+)
+@fast_cli.argument(
+    '--debug', '-d',
+    action='store_true',
+    help='Enable debugging output.',
+)
+def main(files, path=None, ast_cache=None):
+    """
+    Check that the types used by the fields of protobuf files, and the
+    messages they extend, are defined, and that the field numbers and
+    enum values do not conflict.
+    """
+
+    graph = proto_graph.ImportGraph(
+        path, protobuf_fmt.ASTCache(ast_cache) if ast_cache else None,
+    )
+    for fname in files:
+        graph.add(fname)
+
+    errors = 0
+    for fname, error in graph.errors:
+        print(error, file=sys.stderr)
+        errors += 1
+
+    checker = TypeChecker(graph)
+    for fname in files:
+        fname = os.path.normpath(fname)
+        if fname not in graph.files:
+            continue
+
+        problems = checker.check(fname)
+        problems.extend(check_numbers(fname, graph.files[fname]))
+        for exc in sorted(problems, key=lambda exc: exc.lno):
+            print(exc, file=sys.stderr)
+            errors += 1
+
+    return 1 if errors else None
+
+
+if __name__ == '__main__':
+    sys.exit(main.console())
@@ -0,0 +1,1036 @@
+#!/usr/bin/python
+
+from __future__ import print_function
+
+import collections
+import mmap
+import pprint
+import struct
+import sys
+
+import six
+from six.moves import collections_abc
+
+import fast_cli
+import proto_check
+import proto_graph
+import protobuf_fmt
+
+
+# The wire types
+VARINT = 0
+FIXED64 = 1
+LENGTH_DELIMITED = 2
+FIXED32 = 5
+
+# Definitions of the well-known types used by the Humboldt protocol,
+# used when the real definitions are not on the search path
+WELL_KNOWN_TYPES = {
+    'google/protobuf/any.proto': '\n'.join([
+        'syntax = "proto3";',
+        '',
+        'package google.protobuf;',
+        '',
+        'message Any {',
+        '    string type_url = 1;',
+        '    bytes  value    = 2;',
+        '}',
+        '',
+    ]),
+}
+
+
+def _encode_varint(out, value):
+    if value < 0x80:
+        out.append(value)
+        return
+
+    while value > 0x7f:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _decode_varint(buf, pos):
+    byte = buf[pos]
+    if byte < 0x80:
+        return byte, pos + 1
+
+    value = byte & 0x7f
+    shift = 7
+    while True:
+        pos += 1
+        byte = buf[pos]
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos + 1
+        shift += 7
+
+
+def _encode_int(out, value):
+    # Negative values are always sent as 10-byte varints
+    if 0 <= value < 0x80:
+        out.append(value)
+    else:
+        _encode_varint(out, value + (1 << 64) if value < 0 else value)
+
+
+def _decode_int32(buf, pos):
+    value, pos = _decode_varint(buf, pos)
+    value &= 0xffffffff
+    return value - (1 << 32) if value & 0x80000000 else value, pos
+
+
+def _decode_int64(buf, pos):
+    value, pos = _decode_varint(buf, pos)
+    value &= 0xffffffffffffffff
+    return value - (1 << 64) if value & 0x8000000000000000 else value, pos
+
+
+def _decode_uint32(buf, pos):
+    value, pos = _decode_varint(buf, pos)
+    return value & 0xffffffff, pos
+
+
+def _decode_uint64(buf, pos):
+    value, pos = _decode_varint(buf, pos)
+    return value & 0xffffffffffffffff, pos
+
+
+def _encode_sint(out, value):
+    _encode_varint(out, value << 1 ^ value >> 63)
+
+
+def _decode_sint(buf, pos):
+    value, pos = _decode_varint(buf, pos)
+    return value >> 1 ^ -(value & 1), pos
+
+
+def _encode_bool(out, value):
+    out.append(1 if value else 0)
+
+
+def _decode_bool(buf, pos):
+    value, pos = _decode_varint(buf, pos)
+    return bool(value), pos
+
+
+def _encode_string(out, value):
+    data = value.encode('utf-8')
+    _encode_varint(out, len(data))
+    out += data
+
+
+def _decode_string(buf, pos):
+    length, pos = _decode_varint(buf, pos)
+    return six.text_type(buf[pos:pos + length], 'utf-8'), pos + length
+
+
+def _encode_bytes(out, value):
+    _encode_varint(out, len(value))
+    out += value
+
+
+def _decode_bytes(buf, pos):
+    length, pos = _decode_varint(buf, pos)
+    return bytes(buf[pos:pos + length]), pos + length
+
+
+def _fixed(fmt):
+    # Builds the encoder and decoder for a fixed-width type
+    packer = struct.Struct('<' + fmt)
+    pack = packer.pack
+    unpack_from = packer.unpack_from
+    size = packer.size
+
+    def encode(out, value):
+        out += pack(value)
+
+    def decode(buf, pos):
+        return unpack_from(buf, pos)[0], pos + size
+
+    return encode, decode
+
+
+# The encoding of a scalar type: the wire type, the encoder and decoder
+# functions, the default value, and, for fixed-width types, the struct
+# format character
+Scalar = collections.namedtuple(
+    'Scalar', ['wire_type', 'encode', 'decode', 'default', 'fmt'],
+)
+
+
+def _fixed_scalar(wire_type, fmt, default):
+    encode, decode = _fixed(fmt)
+    return Scalar(wire_type, encode, decode, default, fmt)
+
+
+SCALARS = {
+    'double': _fixed_scalar(FIXED64, 'd', 0.0),
+    'float': _fixed_scalar(FIXED32, 'f', 0.0),
+    'int32': Scalar(VARINT, _encode_int, _decode_int32, 0, None),
+    'int64': Scalar(VARINT, _encode_int, _decode_int64, 0, None),
+    'uint32': Scalar(VARINT, _encode_varint, _decode_uint32, 0, None),
+    'uint64': Scalar(VARINT, _encode_varint, _decode_uint64, 0, None),
+    'sint32': Scalar(VARINT, _encode_sint, _decode_sint, 0, None),
+    'sint64': Scalar(VARINT, _encode_sint, _decode_sint, 0, None),
+    'fixed32': _fixed_scalar(FIXED32, 'I', 0),
+    'fixed64': _fixed_scalar(FIXED64, 'Q', 0),
+    'sfixed32': _fixed_scalar(FIXED32, 'i', 0),
+    'sfixed64': _fixed_scalar(FIXED64, 'q', 0),
+    'bool': Scalar(VARINT, _encode_bool, _decode_bool, False, None),
+    'string': Scalar(LENGTH_DELIMITED, _encode_string, _decode_string,
+                     u'', None),
+    'bytes': Scalar(LENGTH_DELIMITED, _encode_bytes, _decode_bytes,
+                    b'', None),
+}
+
+# Enumerations are encoded as int32
+ENUM = SCALARS['int32']
+
+
+def tag_bytes(number, wire_type):
+    """
+    Compute the encoded tag of a field.
+    """
+
+    out = bytearray()
+    _encode_varint(out, number << 3 | wire_type)
+    return bytes(out)
+
+
+def _skip(buf, pos, wire_type):
+    # Skips the value of an unknown field
+    if wire_type == VARINT:
+        return _decode_varint(buf, pos)[1]
+    elif wire_type == FIXED64:
+        return pos + 8
+    elif wire_type == LENGTH_DELIMITED:
+        length, pos = _decode_varint(buf, pos)
+        return pos + length
+    elif wire_type == FIXED32:
+        return pos + 4
+
+    raise protobuf_fmt.PBException('Unsupported wire type %d' % wire_type)
+
+
+_U32 = struct.Struct('>I')
+
+
+def _decode_u32(buf, pos):
+    return _U32.unpack_from(buf, pos)[0], pos + 4
+
+# The length prefixes of the messages in a message stream: a varint,
+# as written by the protobuf writeDelimitedTo() methods, or a 32-bit
+# integer in network byte order
+PREFIXES = {
+    'varint': _decode_varint,
+    'u32': _decode_u32,
+}
+
+# The amount to read at a time from streams that cannot be mapped
+CHUNK_SIZE = 1 << 20
+
+
+def _join(scope, name):
+    return '%s.%s' % (scope, name) if scope else name
+
+
+def _entry_name(name):
+    # Computes the name of the entry message of a map field, as protoc
+    # does
+    return ''.join(part[:1].upper() + part[1:] for part in name.split('_')) \
+        + 'Entry'
+
+
+# A field of a message.  The kind is one of "scalar", "enum",
+# "message", or "map"; the type is the scalar type, or the fully
+# qualified name of the enumeration, message, or map entry message.
+FieldInfo = collections.namedtuple(
+    'FieldInfo', [
+        'name', 'number', 'type', 'kind', 'repeated', 'packed', 'presence',
+        'oneof',
+    ],
+)
+
+
+class MessagePlan(object):
+    """
+    The precompiled encoding of a message.  Messages are represented as
+    dictionaries mapping field names to values; a repeated field is a
+    list, a map field a dictionary, an enumeration an integer, and a
+    nested message another dictionary.  Missing fields, and fields set
+    to ``None``, are not encoded.
+    """
+
+    __slots__ = (
+        'name', 'syntax', 'fields', '_numbers', '_encoders', '_decoders',
+        '_oneofs',
+    )
+
+    def __init__(self, name, syntax='proto3'):
+        self.name = name
+        self.syntax = syntax
+
+        # A list of FieldInfo objects, in field number order
+        self.fields = []
+
+        # Maps each field number to its FieldInfo
+        self._numbers = {}
+
+        # A list of tuples of the number, name, and encoder function of
+        # each field, in field number order
+        self._encoders = []
+
+        # Maps each tag to the decoder function for the field
+        self._decoders = {}
+
+        # Maps the name of each oneof to a list of the names of its
+        # members
+        self._oneofs = {}
+
+    def add_field(self, info, scalar=None, plan=None):
+        """
+        Compile the encoding of a field.
+        """
+
+        self.fields.append(info)
+        self.fields.sort(key=lambda x: x.number)
+        self._numbers[info.number] = info
+
+        if plan is not None:
+            tag = tag_bytes(info.number, LENGTH_DELIMITED)
+            encode = self._message_encoder(info, tag, plan)
+            decoders = [(LENGTH_DELIMITED, self._message_decoder(info, plan))]
+        elif info.repeated:
+            tag = tag_bytes(info.number, scalar.wire_type)
+            encode = self._repeated_encoder(tag, scalar)
+            decoders = [
+                (scalar.wire_type, self._repeated_decoder(info, scalar)),
+            ]
+
+            # Parsers must accept both packed and unpacked encodings
+            if scalar.wire_type != LENGTH_DELIMITED:
+                if info.packed:
+                    encode = self._packed_encoder(
+                        tag_bytes(info.number, LENGTH_DELIMITED), scalar,
+                    )
+                decoders.append(
+                    (LENGTH_DELIMITED, self._packed_decoder(info, scalar)),
+                )
+        else:
+            tag = tag_bytes(info.number, scalar.wire_type)
+            encode = self._scalar_encoder(info, tag, scalar)
+            decoders = [(scalar.wire_type, self._scalar_decoder(info, scalar))]
+
+        self._encoders.append((info.number, info.name, encode))
+        self._encoders.sort(key=lambda x: x[0])
+
+        for wire_type, decode in decoders:
+            if info.oneof:
+                decode = self._oneof_decoder(info, decode)
+            self._decoders[info.number << 3 | wire_type] = decode
+
+    @staticmethod
+    def _scalar_encoder(info, tag, scalar):
+        encode = scalar.encode
+
+        if info.presence:
+            def encoder(out, value):
+                out += tag
+                encode(out, value)
+        else:
+            # Fields without presence are omitted when set to the
+            # default
+            def encoder(out, value):
+                if value:
+                    out += tag
+                    encode(out, value)
+
+        return encoder
+
+    @staticmethod
+    def _repeated_encoder(tag, scalar):
+        encode = scalar.encode
+
+        def encoder(out, values):
+            for value in values:
+                out += tag
+                encode(out, value)
+
+        return encoder
+
+    @staticmethod
+    def _packed_encoder(tag, scalar):
+        if scalar.fmt:
+            # Fixed-width values are packed with a single struct call
+            fmt = '<%d' + scalar.fmt
+            size = struct.calcsize(scalar.fmt)
+
+            def encoder(out, values):
+                if values:
+                    out += tag
+                    _encode_varint(out, len(values) * size)
+                    out += struct.pack(fmt % len(values), *values)
+        else:
+            encode = scalar.encode
+
+            def encoder(out, values):
+                if values:
+                    body = bytearray()
+                    for value in values:
+                        encode(body, value)
+                    out += tag
+                    _encode_varint(out, len(body))
+                    out += body
+
+        return encoder
+
+    @staticmethod
+    def _message_encoder(info, tag, plan):
+        encode = plan.encode_into
+
+        def encode_one(out, value):
+            body = bytearray()
+            encode(body, value)
+            out += tag
+            _encode_varint(out, len(body))
+            out += body
+
+        if info.kind == 'map':
+            def encoder(out, values):
+                for key, value in values.items():
+                    encode_one(out, {'key': key, 'value': value})
+        elif info.repeated:
+            def encoder(out, values):
+                for value in values:
+                    encode_one(out, value)
+        else:
+            encoder = encode_one
+
+        return encoder
+
+    @staticmethod
+    def _scalar_decoder(info, scalar):
+        name = info.name
+        decode = scalar.decode
+
+        def decoder(buf, pos, msg):
+            msg[name], pos = decode(buf, pos)
+            return pos
+
+        return decoder
+
+    @staticmethod
+    def _repeated_decoder(info, scalar):
+        name = info.name
+        decode = scalar.decode
+
+        def decoder(buf, pos, msg):
+            value, pos = decode(buf, pos)
+            msg.setdefault(name, []).append(value)
+            return pos
+
+        return decoder
+
+    @staticmethod
+    def _packed_decoder(info, scalar):
+        name = info.name
+
+        if scalar.fmt:
+            fmt = '<%d' + scalar.fmt
+            size = struct.calcsize(scalar.fmt)
+
+            def decoder(buf, pos, msg):
+                length, pos = _decode_varint(buf, pos)
+                if length % size:
+                    raise protobuf_fmt.PBException(
+                        'Invalid packed field "%s"' % name,
+                    )
+                msg.setdefault(name, []).extend(
+                    struct.unpack_from(fmt % (length // size), buf, pos),
+                )
+                return pos + length
+        else:
+            decode = scalar.decode
+
+            def decoder(buf, pos, msg):
+                length, pos = _decode_varint(buf, pos)
+                end = pos + length
+                values = msg.setdefault(name, [])
+                while pos < end:
+                    value, pos = decode(buf, pos)
+                    values.append(value)
+                return pos
+
+        return decoder
+
+    @staticmethod
+    def _message_decoder(info, plan):
+        name = info.name
+        decode = plan.decode
+
+        if info.kind == 'map':
+            # Missing keys and values take their default values
+            key_default = SCALARS[plan.fields[0].type].default
+            value_info = plan.fields[1]
+            if value_info.kind == 'scalar':
+                value_default = SCALARS[value_info.type].default
+            else:
+                value_default = ENUM.default
+
+            def decoder(buf, pos, msg):
+                length, pos = _decode_varint(buf, pos)
+                entry = decode(buf, pos, pos + length)
+                value = entry.get('value')
+                if value is None:
+                    value = {} if value_info.kind == 'message' else \
+                        value_default
+                msg.setdefault(name, {})[entry.get('key', key_default)] = value
+                return pos + length
+        elif info.repeated:
+            def decoder(buf, pos, msg):
+                length, pos = _decode_varint(buf, pos)
+                msg.setdefault(name, []).append(
+                    decode(buf, pos, pos + length),
+                )
+                return pos + length
+        else:
+            def decoder(buf, pos, msg):
+                length, pos = _decode_varint(buf, pos)
+                msg[name] = decode(buf, pos, pos + length)
+                return pos + length
+
+        return decoder
+
+    def _oneof_decoder(self, info, decode):
+        # Setting a member of a oneof clears the other members; the
+        # list of members is shared, so members added later are seen
+        members = self._oneofs.setdefault(info.oneof, [])
+        if info.name not in members:
+            members.append(info.name)
+
+        def decoder(buf, pos, msg):
+            for name in members:
+                msg.pop(name, None)
+            return decode(buf, pos, msg)
+
+        return decoder
+
+    def encode_into(self, out, msg):
+        """
+        Encode a message.
+        """
+
+        for _number, name, encode in self._encoders:
+            value = msg.get(name)
+            if value is not None:
+                encode(out, value)
+
+    def decode(self, buf, pos=0, end=None):
+        """
+        Decode a message from ``buf[pos:end]``.  Only the fields present
+        in the encoded message are set.
+        """
+
+        if end is None:
+            end = len(buf)
+
+        msg = {}
+        decoders = self._decoders
+        while pos < end:
+            tag = buf[pos]
+            if tag < 0x80:
+                pos += 1
+            else:
+                tag, pos = _decode_varint(buf, pos)
+
+            decode = decoders.get(tag)
+            if decode is None:
+                pos = _skip(buf, pos, tag & 7)
+            else:
+                pos = decode(buf, pos, msg)
+
+        if pos != end:
+            raise protobuf_fmt.PBException(
+                'Truncated message "%s"' % self.name,
+            )
+
+        return msg
+
+    def index(self, buf, pos=0, end=None):
+        """
+        Locate the fields of an encoded message, without decoding them.
+        The result maps the name of each field present to a list of its
+        tags and value offsets; unknown fields are omitted, as are
+        oneof members superseded by a later member.
+        """
+
+        if end is None:
+            end = len(buf)
+
+        offsets = {}
+        numbers = self._numbers
+        while pos < end:
+            tag, pos = _decode_varint(buf, pos)
+            info = numbers.get(tag >> 3)
+            if info is not None:
+                if info.oneof:
+                    for name in self._oneofs[info.oneof]:
+                        if name != info.name:
+                            offsets.pop(name, None)
+                offsets.setdefault(info.name, []).append((tag, pos))
+            pos = _skip(buf, pos, tag & 7)
+
+        if pos != end:
+            raise protobuf_fmt.PBException(
+                'Truncated message "%s"' % self.name,
+            )
+
+        return offsets
+
+    def decode_field(self, buf, offsets, name):
+        """
+        Decode a single field of an encoded message, given the result
+        of ``index()``.
+        """
+
+        msg = {}
+        for tag, pos in offsets[name]:
+            decode = self._decoders.get(tag)
+            if decode is not None:
+                decode(buf, pos, msg)
+
+        return msg[name]
+
+
+class LazyMessage(collections_abc.Mapping):
+    """
+    A read-only message whose fields are decoded when first accessed.
+    The encoded message is scanned once to locate its fields; the
+    values of nested messages are decoded in full when the field
+    containing them is accessed.  The message keeps a reference to the
+    buffer containing it; see ``Codec.read()`` for how long that
+    buffer remains valid.
+    """
+
+    __slots__ = ('_plan', '_buf', '_start', '_end', '_offsets', '_values')
+
+    def __init__(self, plan, buf, start, end):
+        self._plan = plan
+        self._buf = buf
+        self._start = start
+        self._end = end
+        self._offsets = None
+        self._values = {}
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__, self._plan.name)
+
+    def _index(self):
+        if self._offsets is None:
+            self._offsets = self._plan.index(self._buf, self._start, self._end)
+        return self._offsets
+
+    def __getitem__(self, name):
+        if name not in self._values:
+            self._values[name] = self._plan.decode_field(
+                self._buf, self._index(), name,
+            )
+        return self._values[name]
+
+    def __iter__(self):
+        return iter(self._index())
+
+    def __len__(self):
+        return len(self._index())
+
+    def __contains__(self, name):
+        return name in self._index()
+
+
+class Codec(object):
+    """
+    A protobuf wire format codec for the messages defined by a set of
+    protobuf files.  The encoding of each message is compiled once, so
+    that encoding and decoding a message does not consult the parsed
+    files: each field has its tag bytes computed in advance, and
+    encoder and decoder functions chosen for its type and label.
+    Definitions of the well-known types missing from the import graph
+    are added to it.
+    """
+
+    def __init__(self, graph):
+        for iname, text in WELL_KNOWN_TYPES.items():
+            if not any(fname.endswith(iname) for fname in graph.files):
+                graph.files[iname] = protobuf_fmt.Protobuf(
+                    protobuf_fmt.Parser(iname).parse_text(text),
+                )
+                graph.imports[iname] = []
+
+        self._checker = proto_check.TypeChecker(graph)
+
+        # Maps the fully qualified name of each message to its plan
+        self.messages = {}
+
+        # Maps the fully qualified name of each enumeration to a sorted
+        # list of its values
+        self.enums = {}
+
+        # Create all the plans first, since the fields of a message
+        # may refer to any message, including itself
+        blocks = []
+        for fname, pbfile in sorted(graph.files.items()):
+            package = ''
+            syntax = 'proto2'
+            for stmt in pbfile.pbfile.statements:
+                if isinstance(stmt, protobuf_fmt.Package):
+                    package = stmt.name
+                elif isinstance(stmt, protobuf_fmt.Syntax):
+                    syntax = stmt.syntax[1:-1]
+
+            todo = [(block, package) for block in pbfile.pbfile.blocks]
+            while todo:
+                block, scope = todo.pop()
+                if isinstance(block, protobuf_fmt.EnumBlock):
+                    name = _join(scope, block.name)
+                    self.enums[name] = sorted(
+                        enum.value for enum in block.enum
+                        if isinstance(enum, protobuf_fmt.Enum)
+                    )
+                    continue
+                elif not isinstance(block, protobuf_fmt.MessageBlock):
+                    continue
+
+                name = _join(scope, block.name)
+                self.messages[name] = MessagePlan(name, syntax)
+                blocks.append((block, name))
+                todo.extend((item, name) for item in block.fields)
+
+        for block, name in blocks:
+            self._compile(block, self.messages[name])
+
+    def _resolve(self, item, type_, scope):
+        # Resolves a field type to a kind and a type name
+        if type_ in SCALARS:
+            return 'scalar', type_
+
+        full, kinds = self._checker.resolve(type_, scope)
+        if 'message' in kinds:
+            return 'message', full
+        elif 'enum' in kinds:
+            return 'enum', full
+
+        raise protobuf_fmt.PBException(
+            'Cannot resolve type "%s"' % type_,
+            fname=item.fname,
+            lno=item.lno,
+        )
+
+    def _add_field(self, plan, info):
+        if info.kind == 'scalar':
+            plan.add_field(info, scalar=SCALARS[info.type])
+        elif info.kind == 'enum':
+            plan.add_field(info, scalar=ENUM)
+        else:
+            plan.add_field(info, plan=self.messages[info.type])
+
+    def _compile(self, block, plan):
+        # Compiles the fields of a message, including oneof members
+        todo = [(item, None) for item in block.fields]
+        while todo:
+            item, oneof = todo.pop(0)
+            if isinstance(item, protobuf_fmt.OneofBlock):
+                todo.extend((field, item.name) for field in item.fields)
+                continue
+            elif not isinstance(item, protobuf_fmt.Field):
+                # A comment or nested type
+                continue
+
+            if isinstance(item, protobuf_fmt.MapField):
+                entry = MessagePlan(
+                    '%s.%s' % (plan.name, _entry_name(item.name)),
+                    plan.syntax,
+                )
+                for name, number, type_ in (('key', 1, item.type_),
+                                            ('value', 2, item.value_type)):
+                    kind, full = self._resolve(item, type_, plan.name)
+                    self._add_field(entry, FieldInfo(
+                        name, number, full, kind, False, False, True, None,
+                    ))
+                self.messages[entry.name] = entry
+
+                plan.add_field(FieldInfo(
+                    item.name, item.value, entry.name, 'map', True, False,
+                    False, None,
+                ), plan=entry)
+                continue
+
+            kind, full = self._resolve(item, item.type_, plan.name)
+            repeated = item.label == 'repeated'
+
+            # Only repeated fields of numeric types may be packed; in
+            # proto3, they are packed unless stated otherwise
+            packed = repeated and (kind == 'enum' or kind == 'scalar' and
+                                   SCALARS[full].wire_type != LENGTH_DELIMITED)
+            for opt in item.options:
+                if isinstance(opt, protobuf_fmt.InlineOption) and \
+                        opt.name == 'packed':
+                    packed = packed and opt.value == 'true'
+                    break
+            else:
+                packed = packed and plan.syntax == 'proto3'
+
+            self._add_field(plan, FieldInfo(
+                item.name, item.value, full, kind, repeated,
+                packed, not repeated and (
+                    plan.syntax == 'proto2' or oneof is not None or
+                    kind == 'message'
+                ),
+                oneof,
+            ))
+
+    def plan(self, name):
+        """
+        Look up the plan for a message by its fully qualified name.
+        """
+
+        try:
+            return self.messages[name.lstrip('.')]
+        except KeyError:
+            raise protobuf_fmt.PBException('Unknown message "%s"' % name)
+
+    def encode(self, name, msg):
+        """
+        Encode a message.
+        """
+
+        out = bytearray()
+        self.plan(name).encode_into(out, msg)
+        return bytes(out)
+
+    def decode(self, name, data):
+        """
+        Decode a message.
+        """
+
+        if six.PY2:
+            data = bytearray(data)
+
+        try:
+            return self.plan(name).decode(data)
+        except (IndexError, struct.error, UnicodeDecodeError):
+            raise protobuf_fmt.PBException(
+                'Invalid encoding of message "%s"' % name,
+            )
+
+    def read(self, name, stream, prefix='varint', lazy=False):
+        """
+        Decode a stream of concatenated length-prefixed messages.  A
+        file is mapped into memory and decoded in place, so that only
+        the pages being decoded need be resident; other streams, such
+        as pipes, are read a chunk at a time.  With ``lazy``, each field
+        is only decoded when it is accessed.
+
+        The mapping is closed when the iteration finishes or the
+        generator is closed, so lazy messages read from a mapped file
+        may only be used until then; accessing a field not yet decoded
+        afterwards raises ``ValueError``.  Copy the messages to be kept
+        with ``dict()``, and close the generator, for instance with
+        ``contextlib.closing()``, if the iteration may stop early.
+        """
+
+        plan = self.plan(name)
+        read_prefix = PREFIXES[prefix]
+
+        mapped = None
+        if not six.PY2:
+            # Python 2 memoryviews yield strings rather than integers
+            try:
+                mapped = mmap.mmap(
+                    stream.fileno(), 0, access=mmap.ACCESS_READ,
+                )
+            except (AttributeError, EnvironmentError, ValueError):
+                # Not a regular file, or an empty one
+                pass
+
+        release = None
+        if mapped is None:
+            chunks = iter(lambda: stream.read(CHUNK_SIZE), b'')
+        else:
+            chunks = [memoryview(mapped)]
+            if hasattr(mapped, 'madvise'):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+                if not lazy:
+                    def release(pos):
+                        # Drops the pages already decoded from the
+                        # mapping, so they do not count against the
+                        # process
+                        mapped.madvise(
+                            mmap.MADV_DONTNEED, 0, pos - pos % mmap.PAGESIZE,
+                        )
+
+        try:
+            for msg in _read_messages(
+                    plan, chunks, read_prefix, lazy, release):
+                yield msg
+        finally:
+            if mapped is not None:
+                # Lazy messages hold the view, so releasing it also
+                # ends their access to the mapping
+                chunks[0].release()
+                mapped.close()
+
+
+def _read_messages(plan, chunks, read_prefix, lazy, release=None):
+    # Decodes the length-prefixed messages in a sequence of chunks; a
+    # memoryview chunk holds the whole stream, and the release function
+    # is called as each CHUNK_SIZE bytes of it have been decoded
+    buf = bytearray()
+    pos = 0
+    offset = 0
+    released = 0
+    for chunk in chunks:
+        if isinstance(chunk, memoryview):
+            buf = chunk
+        else:
+            # Discard the messages already decoded
+            del buf[:pos]
+            offset += pos
+            pos = 0
+            buf += chunk
+
+        size = len(buf)
+        while pos < size:
+            try:
+                length, start = read_prefix(buf, pos)
+            except (IndexError, struct.error):
+                # The prefix is incomplete
+                break
+
+            end = start + length
+            if end > size:
+                break
+
+            if not lazy:
+                try:
+                    msg = plan.decode(buf, start, end)
+                except (IndexError, struct.error, UnicodeDecodeError):
+                    raise protobuf_fmt.PBException(
+                        'Invalid encoding of message "%s" at offset %d' % (
+                            plan.name, offset + pos,
+                        ),
+                    )
+            elif isinstance(buf, memoryview):
+                msg = LazyMessage(plan, buf, start, end)
+            else:
+                # The buffer will be reused
+                msg = LazyMessage(plan, bytes(buf[start:end]), 0, length)
+
+            yield msg
+            pos = end
+
+            if release and pos - released >= CHUNK_SIZE:
+                release(pos)
+                released = pos
+
+    if pos < len(buf):
+        raise protobuf_fmt.PBException(
+            'Truncated message "%s" at offset %d' % (plan.name, offset + pos),
+        )
+
+
+@fast_cli.argument(
+    'files',
+    nargs='+',
+    help='The protobuf files defining the messages.',
+)
+@fast_cli.argument(
+    '--include', '-I',
+    dest='path',
+    action='append',
+    metavar='DIR',
+    help='Add DIR to the directories searched for imported files.  If '
+    'not given, imports are resolved relative to the importing file.',
+)
+@fast_cli.argument(
+    '--decode', '-D',
+    metavar='MESSAGE',
+    help='Decode a MESSAGE read from standard input, rather than listing '
+    'the messages.',
+)
+@fast_cli.argument(
+    '--input', '-i',
+    dest='input_file',
+    metavar='FILE',
+    help='Read the message to decode from FILE, rather than standard '
+    'input.',
+)
+@fast_cli.argument(
+    '--stream', '-S',
+    choices=sorted(PREFIXES),
+    help='Decode a stream of messages, each preceded by a length of the '
+    'given type.',
+)
+@fast_cli.argument(
+    '--ast-cache', '-a',
+    metavar='DIR',
+    help='Cache parsed protobuf files in DIR.',
+)
+@fast_cli.argument(
+    '--debug', '-d',
+    action='store_true',
+    help='Enable debugging output.',
+)
+def main(files, path=None, decode=None, input_file=None, stream=None,
+         ast_cache=None):
+    """
+    Compile the wire encoding of the messages defined by protobuf
+    files, and list the messages and their fields or decode messages.
+    """
+
+    graph = proto_graph.ImportGraph(
+        path, protobuf_fmt.ASTCache(ast_cache) if ast_cache else None,
+    )
+    for fname in files:
+        graph.add(fname)
+
+    if graph.errors:
+        for fname, error in graph.errors:
+            print(error, file=sys.stderr)
+        return 1
+
+    try:
+        codec = Codec(graph)
+        if decode:
+            if input_file:
+                f = open(input_file, 'rb')
+            else:
+                f = getattr(sys.stdin, 'buffer', sys.stdin)
+
+            with f:
+                if stream:
+                    for msg in codec.read(decode, f, stream):
+                        pprint.pprint(msg)
+                else:
+                    pprint.pprint(codec.decode(decode, f.read()))
+            return None
+    except (protobuf_fmt.PBException, EnvironmentError) as exc:
+        print(exc, file=sys.stderr)
+        return 1
+
+    for name, plan in sorted(codec.messages.items()):
+        print(name)
+        for info in plan.fields:
+            print('    %3d %-8s %s%s %s' % (
+                info.number, info.kind,
+                'packed ' if info.packed else
+                'repeated ' if info.repeated else '',
+                info.type, info.name,
+            ))
+
+    return None
+
+
+if __name__ == '__main__':
+    sys.exit(main.console())
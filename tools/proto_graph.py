@@ -0,0 +1,285 @@
+#!/usr/bin/python
+
+from __future__ import print_function
+
+import multiprocessing
+import os
+import sys
+
+import fast_cli
+import protobuf_fmt
+
+
+# Imports of the well-known types are satisfied by the protobuf
+# compiler itself, so they are not reported as missing unless they
+# are found on the search path
+WELL_KNOWN = 'google/protobuf/'
+
+
+def _call(args):
+    # Calls a processing function in a worker process
+    func, fname, pbfile, deps = args
+    return func(fname, pbfile, deps)
+
+
+class ImportGraph(object):
+    """
+    The graph of the imports among a set of protobuf files.  Import
+    statements are resolved against a search path, and each file
+    reached is parsed exactly once, so that tools needing information
+    from several files can share the parsed files.
+    """
+
+    def __init__(self, path=None, ast_cache=None):
+        self.path = path or []
+        self.ast_cache = ast_cache
+
+        # Maps the name of each file to its Protobuf object
+        self.files = {}
+
+        # Maps the name of each file to a list of the names of the
+        # files it imports
+        self.imports = {}
+
+        # Maps the name of each file to a list of tuples of the line
+        # number and name of each import that could not be resolved
+        self.missing = {}
+
+        # A list of tuples of the name and error message of each file
+        # that could not be parsed
+        self.errors = []
+
+    def resolve(self, iname, importer):
+        """
+        Resolve the name in an import statement to a file name, or
+        ``None`` if the file cannot be found.
+        """
+
+        for dirname in self.path or [os.path.dirname(importer)]:
+            fname = os.path.normpath(os.path.join(dirname, iname))
+            if os.path.isfile(fname):
+                return fname
+
+        return None
+
+    def add(self, fname):
+        """
+        Add a protobuf file and all the files it imports, directly or
+        indirectly, to the graph.  Files already in the graph are not
+        parsed again.
+        """
+
+        todo = [os.path.normpath(fname)]
+        while todo:
+            fname = todo.pop()
+            if fname in self.imports:
+                continue
+
+            self.imports[fname] = []
+            try:
+                pbfile = protobuf_fmt.Parser.parse(fname, self.ast_cache)
+            except (protobuf_fmt.PBException, EnvironmentError) as exc:
+                self.errors.append((fname, str(exc)))
+                continue
+            self.files[fname] = pbfile
+
+            for imp in pbfile.pbfile.imports:
+                if not isinstance(imp, protobuf_fmt.Import):
+                    # A comment
+                    continue
+
+                iname = imp.iname[1:-1]
+                dep = self.resolve(iname, fname)
+                if dep is None:
+                    if not iname.startswith(WELL_KNOWN):
+                        self.missing.setdefault(fname, []).append(
+                            (imp.lno, iname),
+                        )
+                    continue
+
+                self.imports[fname].append(dep)
+                todo.append(dep)
+
+    def cycles(self):
+        """
+        Find the import cycles, each as a sorted list of the files
+        that import each other.
+        """
+
+        # Tarjan's algorithm, using an explicit stack so that deep
+        # import chains cannot exhaust the recursion limit
+        index = {}
+        low = {}
+        stack = []
+        on_stack = set()
+        cycles = []
+
+        for root in sorted(self.imports):
+            if root in index:
+                continue
+
+            work = [(root, iter(self.imports[root]))]
+            index[root] = low[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+
+            while work:
+                fname, deps = work[-1]
+                for dep in deps:
+                    if dep not in index:
+                        index[dep] = low[dep] = len(index)
+                        stack.append(dep)
+                        on_stack.add(dep)
+                        work.append((dep, iter(self.imports[dep])))
+                        break
+                    elif dep in on_stack:
+                        low[fname] = min(low[fname], index[dep])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        low[parent] = min(low[parent], low[fname])
+
+                    if low[fname] == index[fname]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            component.append(member)
+                            if member == fname:
+                                break
+
+                        if (len(component) > 1 or
+                                fname in self.imports[fname]):
+                            cycles.append(sorted(component))
+
+        return sorted(cycles)
+
+    def levels(self):
+        """
+        Arrange the files in dependency order.  Files within a level
+        depend only on files in earlier levels, so the files of a
+        level may be processed in parallel.  Files that are part of,
+        or depend on, an import cycle are omitted.
+        """
+
+        # Kahn's algorithm, taking a whole level at a time
+        pending = dict(
+            (fname, len(set(deps))) for fname, deps in self.imports.items()
+        )
+        dependents = {}
+        for fname, deps in self.imports.items():
+            for dep in set(deps):
+                dependents.setdefault(dep, []).append(fname)
+
+        levels = []
+        level = sorted(fname for fname, count in pending.items() if not count)
+        while level:
+            levels.append(level)
+            following = []
+            for fname in level:
+                for dependent in dependents.get(fname, []):
+                    pending[dependent] -= 1
+                    if not pending[dependent]:
+                        following.append(dependent)
+            level = sorted(following)
+
+        return levels
+
+    def process(self, func, jobs=1):
+        """
+        Process the parsed files in dependency order, returning a
+        dictionary mapping each file name to the value ``func`` returned
+        for it.
+        """
+
+        results = {}
+        pool = multiprocessing.Pool(jobs) if jobs > 1 else None
+        try:
+            for level in self.levels():
+                work = [
+                    (func, fname, self.files[fname], dict(
+                        (dep, results[dep]) for dep in self.imports[fname]
+                        if dep in results
+                    ))
+                    for fname in level if fname in self.files
+                ]
+
+                if pool and len(work) > 1:
+                    values = pool.map(_call, work)
+                else:
+                    values = [_call(args) for args in work]
+
+                for args, value in zip(work, values):
+                    results[args[1]] = value
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+        return results
+
+
+@fast_cli.argument(
+    'files',
+    nargs='+',
+    help='The protobuf files to examine.  Files they import are also '
+    'examined.',
+)
+@fast_cli.argument(
+    '--include', '-I',
+    dest='path',
+    action='append',
+    metavar='DIR',
+    help='Add DIR to the directories searched for imported files.  If '
+    'not given, imports are resolved relative to the importing file.',
+)
+@fast_cli.argument(
+    '--ast-cache', '-a',
+    metavar='DIR',
+    help='Cache parsed protobuf files in DIR.',
+)
+@fast_cli.argument(
+    '--debug', '-d',
+    action='store_true',
+    help='Enable debugging output.',
+)
+def main(files, path=None, ast_cache=None):
+    """
+    Report the order in which protobuf files must be processed to
+    respect their imports, along with any import cycles and imports
+    that cannot be found.
+    """
+
+    graph = ImportGraph(
+        path, protobuf_fmt.ASTCache(ast_cache) if ast_cache else None,
+    )
+    for fname in files:
+        graph.add(fname)
+
+    for i, level in enumerate(graph.levels()):
+        print('Level %d:' % i)
+        for fname in level:
+            print('    %s' % fname)
+
+    problems = 0
+    for fname, error in graph.errors:
+        print(error, file=sys.stderr)
+        problems += 1
+
+    for fname, missing in sorted(graph.missing.items()):
+        for lno, iname in missing:
+            print('%s:%d: Cannot find imported file "%s"' % (
+                fname, lno, iname,
+            ), file=sys.stderr)
+            problems += 1
+
+    for cycle in graph.cycles():
+        print('Import cycle: %s' % ', '.join(cycle), file=sys.stderr)
+        problems += 1
+
+    return 1 if problems else None
+
+
+if __name__ == '__main__':
+    sys.exit(main.console())
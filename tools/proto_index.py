@@ -0,0 +1,279 @@
+#!/usr/bin/python
+
+from __future__ import print_function
+
+import collections
+import os
+import sqlite3
+import sys
+
+import fast_cli
+import protobuf_fmt
+
+
+# The default location of the symbol table
+DEFAULT_DATABASE = os.path.join('build', 'proto_index.db')
+
+
+# A symbol defined in a protobuf file.  The name is the fully qualified
+# name, and the line numbers are as for the location index.
+Symbol = collections.namedtuple(
+    'Symbol', ['name', 'type', 'fname', 'start', 'block_start', 'end'],
+)
+
+
+def qualify(package, key):
+    """
+    Compute the type and fully qualified name of a block from its
+    location index key.  An extension block is named for the message
+    it extends, as written, without the package.
+    """
+
+    type_, name = key.split(':', 1)
+    if package and type_ != 'extend':
+        name = '%s.%s' % (package, name)
+
+    return type_, name.lstrip('.')
+
+
+class SymbolIndex(object):
+    """
+    A persistent table of the messages, enums, and extension blocks
+    defined across a corpus of protobuf files, including nested types,
+    keyed by their fully qualified names.  The table is kept in an
+    SQLite database, so a lookup consults an index rather than loading
+    the whole table, and each file's symbols are replaced only when
+    the file's content changes.  A database written by a different
+    version is rebuilt.
+    """
+
+    # Bump this whenever the schema or the recorded symbols change;
+    # the formatter version is included since it determines the line
+    # numbers
+    VERSION = 1
+
+    SCHEMA = [
+        'CREATE TABLE files ('
+        'fname TEXT PRIMARY KEY, digest TEXT NOT NULL, package TEXT)',
+        'CREATE TABLE symbols ('
+        'name TEXT NOT NULL, type TEXT NOT NULL, fname TEXT NOT NULL, '
+        'start INTEGER, block_start INTEGER, "end" INTEGER)',
+        'CREATE INDEX symbols_name ON symbols (name)',
+        'CREATE INDEX symbols_fname ON symbols (fname)',
+    ]
+
+    def __init__(self, fname, ast_cache=None):
+        self.fname = fname
+        self.ast_cache = ast_cache
+
+        dirname = os.path.dirname(fname)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+
+        self._db = sqlite3.connect(fname)
+
+        version = self.VERSION << 16 | protobuf_fmt.VERSION
+        if self._db.execute('PRAGMA user_version').fetchone()[0] != version:
+            with self._db:
+                self._db.execute('DROP TABLE IF EXISTS files')
+                self._db.execute('DROP TABLE IF EXISTS symbols')
+                for stmt in self.SCHEMA:
+                    self._db.execute(stmt)
+                self._db.execute('PRAGMA user_version = %d' % version)
+
+    def close(self):
+        """
+        Close the database.
+        """
+
+        self._db.close()
+
+    def update(self, fname):
+        """
+        Update the symbols defined by a protobuf file, if the file has
+        changed since it was last indexed.  The line numbers recorded
+        are those of the formatted file.  Returns a ``True`` value if
+        the file was indexed.
+        """
+
+        fname = os.path.abspath(fname)
+        digest = protobuf_fmt.FormatCache.digest(fname)
+
+        row = self._db.execute(
+            'SELECT digest FROM files WHERE fname = ?', (fname,),
+        ).fetchone()
+        if row and row[0] == digest:
+            return False
+
+        pbfile = protobuf_fmt.Parser.parse(fname, self.ast_cache)
+        pbfile.render()
+
+        package = None
+        for stmt in pbfile.pbfile.statements:
+            if isinstance(stmt, protobuf_fmt.Package):
+                package = stmt.name
+
+        symbols = []
+        for key, data in pbfile.locations.items():
+            type_, name = qualify(package, key)
+            symbols.append((
+                name, type_, fname,
+                data['start'], data['block_start'], data['end'],
+            ))
+
+        with self._db:
+            self._db.execute('DELETE FROM symbols WHERE fname = ?', (fname,))
+            self._db.execute(
+                'INSERT OR REPLACE INTO files VALUES (?, ?, ?)',
+                (fname, digest, package),
+            )
+            self._db.executemany(
+                'INSERT INTO symbols VALUES (?, ?, ?, ?, ?, ?)', symbols,
+            )
+
+        return True
+
+    def remove(self, fname):
+        """
+        Remove the symbols defined by a protobuf file.
+        """
+
+        fname = os.path.abspath(fname)
+        with self._db:
+            self._db.execute('DELETE FROM symbols WHERE fname = ?', (fname,))
+            self._db.execute('DELETE FROM files WHERE fname = ?', (fname,))
+
+    def files(self):
+        """
+        List the indexed files.
+        """
+
+        return [
+            row[0] for row in
+            self._db.execute('SELECT fname FROM files ORDER BY fname')
+        ]
+
+    def lookup(self, name, type_=None):
+        """
+        Look up the definitions of a symbol, optionally only those of
+        one block type.
+        """
+
+        query = 'SELECT * FROM symbols WHERE name = ?'
+        params = [name.lstrip('.')]
+        if type_:
+            query += ' AND type = ?'
+            params.append(type_)
+
+        return [
+            Symbol(*row)
+            for row in self._db.execute(query + ' ORDER BY fname', params)
+        ]
+
+
+@fast_cli.argument(
+    '--database', '-D',
+    default=DEFAULT_DATABASE,
+    help='The symbol table database.  Default: %(default)s',
+)
+@fast_cli.argument(
+    '--debug', '-d',
+    action='store_true',
+    help='Enable debugging output.',
+)
+def main(database=DEFAULT_DATABASE):
+    """
+    Maintain and query a table of the symbols defined across a corpus
+    of protobuf files.
+    """
+
+    return 'A command must be selected; see --help'
+
+
+@main.subcommand
+@fast_cli.argument(
+    'files',
+    nargs='+',
+    help='The protobuf files to index.',
+)
+@fast_cli.argument(
+    '--prune', '-p',
+    action='store_true',
+    help='Remove the symbols of indexed files not listed.',
+)
+@fast_cli.argument(
+    '--ast-cache', '-a',
+    metavar='DIR',
+    help='Cache parsed protobuf files in DIR.',
+)
+def update(files, database=DEFAULT_DATABASE, prune=False, ast_cache=None):
+    """
+    Update the symbol table from the given protobuf files.  Only files
+    that have changed since they were last indexed are parsed.
+    """
+
+    index = SymbolIndex(
+        database, protobuf_fmt.ASTCache(ast_cache) if ast_cache else None,
+    )
+
+    errors = 0
+    try:
+        for fname in files:
+            try:
+                if index.update(fname):
+                    print('Indexed file %s' % fname)
+            except (protobuf_fmt.PBException, EnvironmentError) as exc:
+                print(exc, file=sys.stderr)
+                errors += 1
+
+        if prune:
+            keep = set(os.path.abspath(fname) for fname in files)
+            for fname in index.files():
+                if fname not in keep:
+                    print('Removed file %s' % fname)
+                    index.remove(fname)
+    finally:
+        index.close()
+
+    return 1 if errors else None
+
+
+@main.subcommand
+@fast_cli.argument(
+    'names',
+    nargs='+',
+    help='The fully qualified names of the symbols to look up.',
+)
+@fast_cli.argument(
+    '--type', '-t',
+    dest='type_',
+    choices=['message', 'enum', 'extend'],
+    help='Only find blocks of this type.',
+)
+def lookup(names, database=DEFAULT_DATABASE, type_=None):
+    """
+    Look up the files and lines defining symbols.
+    """
+
+    index = SymbolIndex(database)
+
+    missing = 0
+    try:
+        for name in names:
+            symbols = index.lookup(name, type_)
+            if not symbols:
+                print('%s: not found' % name, file=sys.stderr)
+                missing += 1
+
+            for sym in symbols:
+                print('%s %s %s:%d-%d' % (
+                    sym.type, sym.name, sym.fname, sym.start, sym.end - 1,
+                ))
+    finally:
+        index.close()
+
+    return 1 if missing else None
+
+
+if __name__ == '__main__':
+    sys.exit(main.console())
@@ -0,0 +1,282 @@
+#!/usr/bin/python
+
+from __future__ import print_function
+
+import collections
+import json
+import sys
+
+import fast_cli
+import protobuf_fmt
+
+
+# The number of protocol numbers, fixed by the 8-bit Protocol field of
+# the carrier header; each has four entries in the dispatch table, one
+# for each combination of the REP and ERR flags
+PROTOCOLS = 256
+TABLE_SIZE = PROTOCOLS * 4
+
+# The message options naming the protocol number and flags; see
+# extensions.proto
+PROTOCOL_OPTION = '(protocol)'
+REPLY_OPTION = '(reply)'
+ERROR_OPTION = '(error)'
+
+
+# A message registered for a protocol number and flags
+Registration = collections.namedtuple(
+    'Registration', ['name', 'protocol', 'reply', 'error', 'fname', 'lno'],
+)
+
+
+def dispatch_index(protocol, reply=False, error=False):
+    """
+    Compute the index of the dispatch table entry for a frame.
+    """
+
+    return protocol << 2 | bool(reply) << 1 | bool(error)
+
+
+def _bool_option(opt):
+    if opt.value not in ('true', 'false'):
+        raise protobuf_fmt.PBException(
+            'Invalid value "%s" for option %s' % (opt.value, opt.name),
+            fname=opt.fname,
+            lno=opt.lno,
+        )
+    return opt.value == 'true'
+
+
+class Registry(object):
+    """
+    The registry of the message types carried by Humboldt frames,
+    keyed by protocol number and the REP and ERR flags.
+    """
+
+    def __init__(self):
+        # The dispatch table, indexed by dispatch_index()
+        self.table = [None] * TABLE_SIZE
+
+        # A list of PBException objects describing the problems found
+        self.errors = []
+
+    def add_file(self, pbfile):
+        """
+        Register the messages in a protobuf file which declare a
+        protocol number.
+        """
+
+        package = ''
+        for stmt in pbfile.pbfile.statements:
+            if isinstance(stmt, protobuf_fmt.Package):
+                package = stmt.name + '.'
+
+        blocks = []
+        todo = list(pbfile.pbfile.blocks)
+        while todo:
+            block = todo.pop()
+            if isinstance(block, protobuf_fmt.MessageBlock):
+                blocks.append(block)
+                todo.extend(block.fields)
+
+        # Register the messages in the order they are defined, so the
+        # collisions reported do not depend on the traversal
+        for block in sorted(blocks, key=lambda block: block.lno):
+            try:
+                self._add_message(package + block.full_name, block)
+            except protobuf_fmt.PBException as exc:
+                self.errors.append(exc)
+
+    def _add_message(self, name, block):
+        # Registers a message, if it declares a protocol number
+        options = dict(
+            (opt.name, opt) for opt in block.options
+            if isinstance(opt, protobuf_fmt.Option)
+        )
+        if PROTOCOL_OPTION not in options:
+            for option in (REPLY_OPTION, ERROR_OPTION):
+                if option in options:
+                    raise protobuf_fmt.PBException(
+                        'Option %s requires option %s' % (
+                            option, PROTOCOL_OPTION,
+                        ),
+                        fname=block.fname,
+                        lno=options[option].lno,
+                    )
+            return
+
+        opt = options[PROTOCOL_OPTION]
+        try:
+            protocol = int(opt.value, 0)
+        except ValueError:
+            protocol = -1
+        if not 0 <= protocol < PROTOCOLS:
+            raise protobuf_fmt.PBException(
+                'Invalid protocol number "%s"' % opt.value,
+                fname=opt.fname,
+                lno=opt.lno,
+            )
+
+        reg = Registration(
+            name, protocol,
+            _bool_option(options[REPLY_OPTION])
+            if REPLY_OPTION in options else False,
+            _bool_option(options[ERROR_OPTION])
+            if ERROR_OPTION in options else False,
+            block.fname, block.lno,
+        )
+
+        idx = dispatch_index(reg.protocol, reg.reply, reg.error)
+        other = self.table[idx]
+        if other is not None:
+            # The earlier definition keeps the entry and the later one
+            # is reported, whatever order the messages were found in
+            first, second = sorted(
+                [other, reg], key=lambda reg: (reg.fname, reg.lno),
+            )
+            self.table[idx] = first
+            raise protobuf_fmt.PBException(
+                'Protocol %d%s%s is already used by %s at %s:%d' % (
+                    reg.protocol, ' REP' if reg.reply else '',
+                    ' ERR' if reg.error else '',
+                    first.name, first.fname, first.lno,
+                ),
+                fname=second.fname,
+                lno=second.lno,
+            )
+
+        self.table[idx] = reg
+
+    def registrations(self):
+        """
+        List the registered messages, in dispatch table order.
+        """
+
+        return [reg for reg in self.table if reg is not None]
+
+    def python(self):
+        """
+        Generate a Python module containing the dispatch table.
+        """
+
+        lines = [
+            '# Generated by proto_registry.py; do not edit.',
+            '',
+            '# The message types of Humboldt frames, indexed by',
+            '# PROTOCOL << 2 | REP << 1 | ERR',
+            'DISPATCH = (',
+        ]
+        for protocol in range(PROTOCOLS):
+            entries = self.table[protocol * 4:protocol * 4 + 4]
+            if any(entries):
+                lines.append('    # Protocol %d' % protocol)
+                lines.extend(
+                    '    %r,' % (reg and reg.name) for reg in entries
+                )
+            else:
+                lines.append('    None, None, None, None,')
+        lines.extend([
+            ')',
+            '',
+            '# Maps each message type to its protocol number and its REP and',
+            '# ERR flags',
+            'MESSAGES = {',
+        ])
+        lines.extend(
+            '    %r: (%d, %r, %r),' % (
+                reg.name, reg.protocol, reg.reply, reg.error,
+            )
+            for reg in sorted(self.registrations())
+        )
+        lines.extend([
+            '}',
+            '',
+            '',
+            'def dispatch_index(protocol, reply=False, error=False):',
+            '    return protocol << 2 | bool(reply) << 1 | bool(error)',
+            '',
+        ])
+
+        return '\n'.join(lines)
+
+    def json(self):
+        """
+        Generate a JSON document containing the dispatch table.
+        """
+
+        return json.dumps({
+            'index': 'protocol << 2 | reply << 1 | error',
+            'table': [reg and reg.name for reg in self.table],
+            'messages': dict(
+                (reg.name, [reg.protocol, reg.reply, reg.error])
+                for reg in self.registrations()
+            ),
+        }, indent=2, sort_keys=True) + '\n'
+
+
+@fast_cli.argument(
+    'files',
+    nargs='+',
+    help='The protobuf files defining the messages.',
+)
+@fast_cli.argument(
+    '--python', '-p',
+    metavar='FILE',
+    help='Write the dispatch table as a Python module to FILE.',
+)
+@fast_cli.argument(
+    '--json', '-j',
+    dest='json_file',
+    metavar='FILE',
+    help='Write the dispatch table as JSON to FILE.',
+)
+@fast_cli.argument(
+    '--ast-cache', '-a',
+    metavar='DIR',
+    help='Cache parsed protobuf files in DIR.',
+)
+@fast_cli.argument(
+    '--debug', '-d',
+    action='store_true',
+    help='Enable debugging output.',
+)
+def main(files, python=None, json_file=None, ast_cache=None):
+    """
+    Generate the table mapping the protocol number and the REP and ERR
+    flags of a Humboldt frame to the message type it carries, from the
+    "protocol", "reply", and "error" options of the messages.  Without
+    --python or --json, the registered messages are listed.
+    """
+
+    ast_cache = protobuf_fmt.ASTCache(ast_cache) if ast_cache else None
+
+    registry = Registry()
+    for fname in files:
+        try:
+            registry.add_file(protobuf_fmt.Parser.parse(fname, ast_cache))
+        except (protobuf_fmt.PBException, EnvironmentError) as exc:
+            registry.errors.append(exc)
+
+    if registry.errors:
+        for exc in sorted(registry.errors,
+                          key=lambda exc: (exc.fname or '', exc.lno or 0)):
+            print(exc, file=sys.stderr)
+        return 1
+
+    if python:
+        protobuf_fmt.update_file(python, registry.python().encode('utf-8'))
+    if json_file:
+        protobuf_fmt.update_file(json_file, registry.json().encode('utf-8'))
+
+    if not (python or json_file):
+        for reg in registry.registrations():
+            print('%3d %-3s %-3s %s' % (
+                reg.protocol, 'REP' if reg.reply else '',
+                'ERR' if reg.error else '', reg.name,
+            ))
+
+    return None
+
+
+if __name__ == '__main__':
+    sys.exit(main.console())
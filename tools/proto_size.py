@@ -0,0 +1,403 @@
+#!/usr/bin/python
+
+from __future__ import print_function
+
+import os
+import sys
+
+import fast_cli
+import proto_codec
+import proto_graph
+import protobuf_fmt
+import yaml_compat
+
+
+# The default locations of the protobuf files and the bit diagrams of
+# the frame headers
+SOURCE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'source',
+)
+PROTO_DIR = os.path.join(SOURCE_DIR, 'protobuf')
+BITS_DIR = os.path.join(SOURCE_DIR, 'bits')
+
+# The bit diagrams of the carrier header, the field giving the total
+# length of the frame, and the extension header
+CARRIER_BITS = 'carrier.bits'
+LENGTH_FIELD = 'Total Frame Length'
+EXTENSION_BITS = 'extension.bits'
+
+# The bounds computed for each message
+BOUNDS = ('min', 'typical', 'max')
+
+# The largest encoded size of a value of each varint type; negative
+# int32 and int64 values are always encoded in 10 bytes
+VARINT_MAX = {
+    'int32': 10,
+    'int64': 10,
+    'uint32': 5,
+    'uint64': 10,
+    'sint32': 5,
+    'sint64': 10,
+    'bool': 1,
+}
+
+# The size of each fixed-width type
+FIXED_SIZE = {
+    'fixed32': 4,
+    'sfixed32': 4,
+    'float': 4,
+    'fixed64': 8,
+    'sfixed64': 8,
+    'double': 8,
+}
+
+
+def varint_size(value):
+    """
+    Compute the encoded size of a varint.  Negative values take 10
+    bytes, as they are encoded as 64-bit two's complement.
+    """
+
+    if value < 0:
+        return 10
+
+    size = 1
+    while value > 0x7f:
+        value >>= 7
+        size += 1
+    return size
+
+
+def header_bits(fname):
+    """
+    Read the bit diagram of a header, returning the total number of
+    bits and a dictionary of the widths of its multi-bit fields.
+    """
+
+    with open(fname) as f:
+        elems = yaml_compat.load(f)
+
+    total = 0
+    fields = {}
+    for elem in elems:
+        if 'bit' in elem:
+            total += 1
+        elif 'reserved' in elem:
+            total += elem['reserved']
+        elif 'field' in elem:
+            total += elem['bits']
+            fields[elem['field']] = elem['bits']
+
+    return total, fields
+
+
+def frame_budget(bits_dir=BITS_DIR, extensions=0):
+    """
+    Compute the number of bytes available for a message in a single
+    frame, allowing for a number of carrier extension headers.
+    """
+
+    carrier, fields = header_bits(os.path.join(bits_dir, CARRIER_BITS))
+    extension, _fields = header_bits(os.path.join(bits_dir, EXTENSION_BITS))
+
+    return ((1 << fields[LENGTH_FIELD]) - 1 - carrier // 8 -
+            extensions * (extension // 8))
+
+
+class SizeModel(object):
+    """
+    Computes bounds on the encoded sizes of messages, given the number
+    of elements in each repeated field and the length of each string
+    and bytes field.  The "min" bound has every singular field absent;
+    the "typical" bound has every field present, with integers of a
+    typical size and strings and bytes of a typical length; and the
+    "max" bound has every integer at its largest encoding and strings
+    and bytes at a maximum length.  A oneof contributes its largest
+    member to the "typical" and "max" bounds.  Messages that contain
+    themselves are counted as empty where they recur.
+
+    The ``fields`` dictionary overrides the number of elements or the
+    length of particular fields, named ``Message.field``.
+    """
+
+    def __init__(self, codec, count=1, length=16, max_length=64, varint=2,
+                 fields=None):
+        self.codec = codec
+        self.count = count
+        self.length = length
+        self.max_length = max_length
+        self.varint = varint
+
+        # Maps the fully qualified name of each field to its value
+        self.fields = {}
+        for spec, value in (fields or {}).items():
+            self.fields[self.find_field(spec)] = value
+
+    def find_field(self, spec):
+        """
+        Find the fully qualified name of a field named
+        ``Message.field``, where the message name may omit any leading
+        part of its fully qualified name.
+        """
+
+        found = [
+            '%s.%s' % (name, info.name)
+            for name, plan in self.codec.messages.items()
+            for info in plan.fields
+            if ('.%s.%s' % (name, info.name)).endswith('.' + spec)
+        ]
+        if len(found) != 1:
+            raise protobuf_fmt.PBException(
+                'Field "%s" %s' % (
+                    spec, 'is ambiguous' if found else 'is not defined',
+                ),
+            )
+
+        return found[0]
+
+    def size(self, name, bound, override=None, _active=None):
+        """
+        Compute a bound on the encoded size of a message.  The
+        ``override`` tuple, of a fully qualified field name and a
+        value, takes precedence over ``fields``.
+        """
+
+        active = set() if _active is None else _active
+        if name in active:
+            return 0
+        active.add(name)
+
+        plan = self.codec.plan(name)
+        size = 0
+        oneofs = {}
+        for info in plan.fields:
+            key = '%s.%s' % (name, info.name)
+            if override and override[0] == key:
+                value = override[1]
+            else:
+                value = self.fields.get(key)
+
+            tag = varint_size(info.number << 3)
+            if info.repeated:
+                count = self.count if value is None else value
+                if not count:
+                    continue
+
+                elem = self._element(info, bound, None, override, active)
+                if info.packed:
+                    body = count * elem
+                    field = tag + varint_size(body) + body
+                else:
+                    field = count * (tag + elem)
+            elif bound == 'min':
+                # Every singular field may be absent
+                continue
+            else:
+                field = tag + self._element(
+                    info, bound, value, override, active,
+                )
+
+            if info.oneof:
+                oneofs[info.oneof] = max(oneofs.get(info.oneof, 0), field)
+            else:
+                size += field
+
+        active.discard(name)
+        return size + sum(oneofs.values())
+
+    def _element(self, info, bound, value, override, active):
+        # Computes the size of a single value of a field, excluding the
+        # tag
+        if info.kind in ('message', 'map'):
+            body = self.size(info.type, bound, override, active)
+            return varint_size(body) + body
+        elif info.kind == 'enum':
+            values = self.codec.enums.get(info.type) or [0]
+            if bound == 'min':
+                return min(varint_size(x) for x in values)
+            return max(varint_size(x) for x in values)
+        elif info.type in FIXED_SIZE:
+            return FIXED_SIZE[info.type]
+        elif info.type in ('string', 'bytes'):
+            if value is None:
+                value = {
+                    'min': 0,
+                    'typical': self.length,
+                    'max': self.max_length,
+                }[bound]
+            return varint_size(value) + value
+        elif bound == 'min':
+            return 1
+        elif bound == 'typical':
+            return min(self.varint, VARINT_MAX[info.type])
+        return VARINT_MAX[info.type]
+
+    def fit(self, name, field, bound, budget):
+        """
+        Find the largest number of elements of a repeated field for
+        which a message fits in a budget, or ``None`` if it does not
+        fit even with none.
+        """
+
+        def fits(count):
+            return self.size(name, bound, (field, count)) <= budget
+
+        if not fits(0):
+            return None
+
+        # Each element takes at least one byte, bounding the search
+        low, high = 0, budget + 1
+        while high - low > 1:
+            mid = (low + high) // 2
+            if fits(mid):
+                low = mid
+            else:
+                high = mid
+
+        return low
+
+
+@fast_cli.argument(
+    'messages',
+    nargs='*',
+    help='The messages to analyze, as fully qualified names or with any '
+    'leading part of the name omitted.  Defaults to all messages.',
+)
+@fast_cli.argument(
+    '--proto', '-p',
+    dest='files',
+    action='append',
+    metavar='FILE',
+    help='A protobuf file defining the messages.  May be given more than '
+    'once.  Defaults to the bundled protobuf files.',
+)
+@fast_cli.argument(
+    '--count', '-n',
+    type=int,
+    default=1,
+    help='The number of elements of repeated and map fields.  '
+    'Default: %(default)s',
+)
+@fast_cli.argument(
+    '--length', '-l',
+    type=int,
+    default=16,
+    help='The typical length of string and bytes fields.  '
+    'Default: %(default)s',
+)
+@fast_cli.argument(
+    '--max-length', '-L',
+    type=int,
+    default=64,
+    help='The maximum length of string and bytes fields.  '
+    'Default: %(default)s',
+)
+@fast_cli.argument(
+    '--varint', '-v',
+    type=int,
+    default=2,
+    help='The typical size of an encoded integer.  Default: %(default)s',
+)
+@fast_cli.argument(
+    '--field', '-F',
+    dest='fields',
+    action='append',
+    default=[],
+    metavar='MESSAGE.FIELD=N',
+    help='Set the number of elements of a repeated or map field, or the '
+    'length of a string or bytes field.  May be given more than once.',
+)
+@fast_cli.argument(
+    '--extensions', '-e',
+    type=int,
+    default=0,
+    help='The number of carrier extensions to allow room for.  '
+    'Default: %(default)s',
+)
+@fast_cli.argument(
+    '--bits-dir', '-b',
+    default=BITS_DIR,
+    metavar='DIR',
+    help='The directory containing the bit diagrams of the carrier and '
+    'extension headers.  Default: %(default)s',
+)
+@fast_cli.argument(
+    '--debug', '-d',
+    action='store_true',
+    help='Enable debugging output.',
+)
+def main(messages, files=None, count=1, length=16, max_length=64, varint=2,
+         fields=None, extensions=0, bits_dir=BITS_DIR):
+    """
+    Compute the minimum, typical, and maximum encoded sizes of
+    messages, and the largest number of elements of each repeated
+    field for which a message still fits in a single frame.
+    """
+
+    graph = proto_graph.ImportGraph()
+    for fname in files or sorted(
+            os.path.join(PROTO_DIR, fname) for fname in os.listdir(PROTO_DIR)
+            if fname.endswith('.proto')):
+        graph.add(fname)
+
+    if graph.errors:
+        for fname, error in graph.errors:
+            print(error, file=sys.stderr)
+        return 1
+
+    try:
+        overrides = {}
+        for spec in fields or []:
+            field, sep, value = spec.partition('=')
+            if not sep or not value.isdigit():
+                return 'Invalid field setting "%s"' % spec
+            overrides[field] = int(value)
+
+        model = SizeModel(
+            proto_codec.Codec(graph), count, length, max_length, varint,
+            overrides,
+        )
+        names = [
+            name for name in sorted(model.codec.messages)
+            if not messages or any(
+                ('.' + name).endswith('.' + msg.lstrip('.'))
+                for msg in messages
+            )
+        ]
+        budget = frame_budget(bits_dir, extensions)
+    except (protobuf_fmt.PBException, EnvironmentError) as exc:
+        print(exc, file=sys.stderr)
+        return 1
+
+    if not names:
+        return 'No messages selected'
+
+    print('Frame budget: %d bytes' % budget)
+    print('%-40s %8s %8s %8s' % (('Message',) + BOUNDS))
+    for name in names:
+        low, typical, high = [model.size(name, bound) for bound in BOUNDS]
+        print('%-40s %8d %8d %8d%s' % (
+            name, low, typical, high,
+            ' exceeds frame' if high > budget else '',
+        ))
+
+        for info in model.codec.plan(name).fields:
+            if not info.repeated:
+                continue
+
+            field = '%s.%s' % (name, info.name)
+            typical, high = [
+                model.fit(name, field, bound, budget)
+                for bound in ('typical', 'max')
+            ]
+            print('    %s: at most %s typical, %s max' % (
+                info.name,
+                'none' if typical is None else typical,
+                'none' if high is None else high,
+            ))
+
+    return None
+
+
+if __name__ == '__main__':
+    sys.exit(main.console())
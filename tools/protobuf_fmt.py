@@ -3,20 +3,74 @@
 from __future__ import print_function
 
 import abc
+import bisect
+import collections
+import functools
+import hashlib
+import itertools
+import json
 import os
+import re
+import select
 import shutil
+import socket
+import struct
 import sys
+import tempfile
+import time
 
-import cli_tools
 import six
-import yaml
+from six.moves import socketserver
+
+import fast_cli
+import yaml_compat
+
+
+# The formatter version.  This must be incremented whenever a change
+# to the parser or the renderer would alter the formatted output, so
+# that any cached knowledge about previously formatted files is
+# discarded.
+VERSION = 3
+
+# Lexical patterns used by the parser.  Each of these is applied with
+# a single call, so that scanning happens in the regular expression
+# engine rather than character by character in Python.
+
+# A line of a file, split into the statement text, the keyword at the
+# beginning of the statement, and the comment text.  String literals
+# are skipped over, so a "//" within one does not begin a comment; an
+# unclosed string literal extends to the end of the line.  This is
+# applied to the whole file with findall().
+LINE_RE = re.compile(
+    r'[ \t]*((\w*)(?:[^"/\n]+|"(?:[^"\\\n]|\\.)*"?|/(?!/))*)'
+    r'(?://[ \t]?([^\n]*))?\n'
+)
+
+# A keyword or identifier; matches the empty string if the text does
+# not begin with one
+TOKEN_RE = re.compile(r'\w*')
+
+# A decimal number
+DIGITS_RE = re.compile(r'\d+')
+
+# A string literal, including its quotes
+STRLIT_RE = re.compile(r'"(?:[^"\\]|\\.)*"', re.DOTALL)
+
+# A single inline option, followed by the comma separating it from the
+# next option or by the end of the text
+INLINE_OPTION_RE = re.compile(
+    r'([^=]*)=((?:[^",]|"(?:[^"\\]|\\.)*")*)(,|$)',
+    re.DOTALL,
+)
 
 
 class PBException(Exception):
     def __init__(self, message, fname=None, lno=None):
-        super(PBException, self).__init__(
-            '%s:%d: %s' % (fname, lno, message),
-        )
+        if lno is not None:
+            message = '%s:%d: %s' % (fname, lno, message)
+        elif fname is not None:
+            message = '%s: %s' % (fname, message)
+        super(PBException, self).__init__(message)
 
         self.fname = fname
         self.lno = lno
@@ -24,6 +78,8 @@ class PBException(Exception):
 
 @six.add_metaclass(abc.ABCMeta)
 class Statement(object):
+    __slots__ = ('fname', 'lno')
+
     @abc.abstractmethod
     def match(cls, parser, lno, line, comment):
         pass
@@ -33,23 +89,49 @@ class Statement(object):
         self.lno = lno
 
     @abc.abstractmethod
-    def render(self, lno, store, pfx=''):
+    def render(self, out, store, pfx=''):
+        pass
+
+
+class KeywordStatement(Statement):
+    __slots__ = ()
+
+    # The keyword introducing the statement
+    KEYWORD = None
+
+    @classmethod
+    def match(cls, parser, lno, line, comment, *args):
+        if parser.tok(line) == cls.KEYWORD:
+            return cls.build(
+                parser, lno, line[len(cls.KEYWORD):], comment, *args
+            )
+
+        return None
+
+    @abc.abstractmethod
+    def build(cls, parser, lno, text, comment):
+        """
+        Construct the statement from a line already known to begin
+        with the statement keyword.
+        """
+
         pass
 
 
 class Container(object):
+    # A class may combine several container mixins, so they cannot
+    # declare slots of their own.  Instead, each lists the attributes
+    # it needs in SLOTS, and the concrete classes include those in
+    # their __slots__ and call the mixin's initializer.
+    __slots__ = ()
+    SLOTS = ()
+
     def _list(self, lst_name):
-        lst = getattr(self, lst_name, None)
-        if lst is None:
-            lst = []
-            setattr(self, lst_name, lst)
-        return lst
-
-    def _cont_render(self, lst_name, lno, store, pfx=''):
-        lines = []
+        return getattr(self, lst_name)
+
+    def _cont_render(self, lst_name, out, store, pfx=''):
         for item in self._list(lst_name):
-            lines.extend(item.render(lno + len(lines), store, pfx))
-        return lines
+            item.render(out, store, pfx)
 
     def _len(self, lst_name, fld, cache, reducer, type_=None):
         max_len = getattr(self, cache, None)
@@ -65,27 +147,24 @@ class Container(object):
 
     def _append(self, lst_name, item, resetter=None):
         assert item is not None
-        self._list(lst_name).append(item)
+        getattr(self, lst_name).append(item)
         if resetter:
             resetter()
 
 
-class Option(Statement):
-    @classmethod
-    def match(cls, parser, lno, line, comment):
-        if parser.tok(line) == 'option':
-            name, value = parser.split_eq(
-                parser.strip_semi(
-                    line[len('option'):], lno,
-                )
-            )
-            return cls(
-                parser.fname, lno, parser.stack,
-                name, value,
-                comment=comment,
-            )
+class Option(KeywordStatement):
+    __slots__ = ('container', 'name', 'value', 'comment')
 
-        return None
+    KEYWORD = 'option'
+
+    @classmethod
+    def build(cls, parser, lno, text, comment):
+        name, value = parser.split_eq(parser.strip_semi(text, lno))
+        return cls(
+            parser.fname, lno, parser.stack,
+            name, value,
+            comment=comment,
+        )
 
     def __init__(self, fname, lno, container, name, value, comment=None):
         super(Option, self).__init__(fname, lno)
@@ -95,7 +174,7 @@ class Option(Statement):
         self.value = value
         self.comment = comment
 
-    def render(self, lno, store, pfx=''):
+    def render(self, out, store, pfx=''):
         line = '%soption %-*s = %s;' % (
             pfx, self.container.opt_name_len(), self.name, self.value,
         )
@@ -105,15 +184,28 @@ class Option(Statement):
                 self.container.opt_value_len(self.value), '', self.comment,
             )
 
-        return [line]
+        out.write(line)
 
 
 class InlineOption(Option):
-    def render(self, lno, store, pfx=''):
-        return ['%s=%s' % (self.name, self.value)]
+    __slots__ = ()
+
+    def render(self, out, store, pfx=''):
+        out.write(self.text)
+
+    @property
+    def text(self):
+        return '%s=%s' % (self.name, self.value)
 
 
 class OptionContainer(Container):
+    __slots__ = ()
+    SLOTS = ('options', '_opt_name_len', '_opt_value_len')
+
+    def _init_options(self):
+        self.options = []
+        self._reset_options()
+
     def _reset_options(self):
         self._opt_name_len = None
         self._opt_value_len = None
@@ -121,8 +213,8 @@ class OptionContainer(Container):
     def opt_add(self, opt):
         self._append('options', opt, self._reset_options)
 
-    def opt_render(self, lno, store, pfx=''):
-        return self._cont_render('options', lno, store, pfx)
+    def opt_render(self, out, store, pfx=''):
+        self._cont_render('options', out, store, pfx)
 
     def opt_name_len(self, reducer=''):
         return self._len('options', 'name', '_opt_name_len', reducer, Option)
@@ -132,11 +224,22 @@ class OptionContainer(Container):
 
 
 class InlineOptionContainer(OptionContainer):
-    def opt_render(self, lno, store, pfx=''):
-        opts = self._cont_render('options', lno, store, pfx)
-        if opts:
-            return [' [%s]' % ','.join(opts)]
-        return []
+    __slots__ = ()
+    SLOTS = ('options', '_opts')
+
+    def _init_options(self):
+        # Most fields have no inline options, so the list is only
+        # allocated once one is added
+        self.options = ()
+        self._opts = None
+
+    def _reset_options(self):
+        self._opts = None
+
+    def opt_add(self, opt):
+        if not self.options:
+            self.options = []
+        super(InlineOptionContainer, self).opt_add(opt)
 
     def opt_parse(self, parser, lno, line):
         if line[0] != '[' or line[-1] != ']':
@@ -145,75 +248,28 @@ class InlineOptionContainer(OptionContainer):
                 fname=parser.fname,
                 lno=lno,
             )
-        line = line[1:-1]
-
-        name = None
-        start = 0
-        escape = False
-        quoted = False
-        for i in range(len(line)):
-            if start is None:
-                start = i
-
-            if escape:
-                escape = False
-                continue
-
-            if quoted:
-                if line[i] == '\\':
-                    escape = True
-                if line[i] == '"':
-                    quoted = False
-                continue
-
-            if name is None and line[i] == '=':
-                name = line[start:i].strip()
-                if not name:
-                    raise PBException(
-                        'Invalid option with empty name',
-                        fname=parser.fname,
-                        lno=lno,
-                    )
-                start = None
-            elif name is not None:
-                if line[i] == '"':
-                    quoted = True
-                elif line[i] == ',':
-                    value = line[start:i].strip()
-                    if not value:
-                        raise PBException(
-                            'Invalid option with empty value',
-                            fname=parser.fname,
-                            lno=lno,
-                        )
-                    self.opt_add(InlineOption(
-                        parser.fname, lno, self,
-                        name, line[start:i + 1],
-                    ))
-                    name = None
-                    start = None
-
-        if name is None or start is None:
-            raise PBException(
-                'Invalid inline option',
-                fname=parser.fname,
-                lno=lno,
-            )
 
-        self.opt_add(InlineOption(
-            parser.fname, lno, self,
-            name, line[start:],
-        ))
+        for name, value in parser.split_options(line[1:-1], lno):
+            self.opt_add(InlineOption(
+                parser.fname, lno, self,
+                name, value,
+            ))
 
     @property
     def opts(self):
-        if getattr(self, '_opts', None) is None:
-            opts = self.opt_render(0, None, '')
-            self._opts = opts[0] if opts else ''
+        if self._opts is None:
+            opts = self.options
+            self._opts = (
+                ' [%s]' % ','.join(opt.text for opt in opts) if opts else ''
+            )
         return self._opts
 
 
 class Field(Statement, InlineOptionContainer):
+    __slots__ = (
+        'container', 'type_', 'name', 'value', 'comment', 'label',
+    ) + InlineOptionContainer.SLOTS
+
     @classmethod
     def match(cls, parser, lno, line, comment, labeled=False):
         desc, remainder = parser.split_eq(parser.strip_semi(line, lno))
@@ -258,13 +314,15 @@ class Field(Statement, InlineOptionContainer):
         super(Field, self).__init__(fname, lno)
 
         self.container = container
-        self.type_ = type_
-        self.name = name
+        self.type_ = six.moves.intern(type_)
+        self.name = six.moves.intern(name)
         self.value = value
         self.comment = comment
         self.label = label
 
-    def render(self, lno, store, pfx=''):
+        self._init_options()
+
+    def render(self, out, store, pfx=''):
         line = '%s%-*s %-*s = %*d%s;' % (
             pfx,
             self.container.fld_type_len(), self.full_type,
@@ -279,7 +337,7 @@ class Field(Statement, InlineOptionContainer):
                 self.comment,
             )
 
-        return [line]
+        out.write(line)
 
     @property
     def full_type(self):
@@ -288,46 +346,45 @@ class Field(Statement, InlineOptionContainer):
         return self.type_
 
 
-class MapField(Field):
-    @classmethod
-    def match(cls, parser, lno, line, comment):
-        if parser.tok(line) == 'map':
-            desc, remainder = parser.split_eq(parser.strip_semi(
-                line[len('map'):], lno,
-            ))
+class MapField(KeywordStatement, Field):
+    __slots__ = ('value_type',)
 
-            # Extract field number from remainder
-            flen, field = parser.extract_digits(remainder, lno)
-            remainder = remainder[flen:].strip()
+    KEYWORD = 'map'
 
-            # Make sure it's valid syntax
-            type_end = desc.index('>')
-            if (not desc or desc[0] != '<' or type_end < 0 or
-                    desc.count(',') != 1):
-                raise PBException(
-                    'Invalid map field description "%s"' % desc,
-                    fname=parser.fname,
-                    lno=lno,
-                )
+    @classmethod
+    def build(cls, parser, lno, text, comment):
+        desc, remainder = parser.split_eq(parser.strip_semi(text, lno))
 
-            key_type, value_type = [
-                p.strip() for p in desc[1:type_end].split(',')
-            ]
-            name = desc[type_end + 1:].strip()
+        # Extract field number from remainder
+        flen, field = parser.extract_digits(remainder, lno)
+        remainder = remainder[flen:].strip()
 
-            fld = cls(
-                parser.fname, lno, parser.stack,
-                key_type, value_type, name, field,
-                comment=comment,
+        # Make sure it's valid syntax
+        type_end = desc.find('>')
+        if (not desc or desc[0] != '<' or type_end < 0 or
+                desc.count(',') != 1):
+            raise PBException(
+                'Invalid map field description "%s"' % desc,
+                fname=parser.fname,
+                lno=lno,
             )
 
-            # Add inline options
-            if remainder:
-                fld.opt_parse(parser, lno, remainder)
+        key_type, value_type = [
+            p.strip() for p in desc[1:type_end].split(',')
+        ]
+        name = desc[type_end + 1:].strip()
+
+        fld = cls(
+            parser.fname, lno, parser.stack,
+            key_type, value_type, name, field,
+            comment=comment,
+        )
 
-            return fld
+        # Add inline options
+        if remainder:
+            fld.opt_parse(parser, lno, remainder)
 
-        return None
+        return fld
 
     def __init__(self, fname, lno, container, key_type, value_type, name,
                  value, comment=None):
@@ -345,6 +402,16 @@ class MapField(Field):
 
 
 class FieldContainer(Container):
+    __slots__ = ()
+    SLOTS = (
+        'fields', '_fld_type_len', '_fld_name_len', '_fld_value_len',
+        '_fld_opts_len',
+    )
+
+    def _init_fields(self):
+        self.fields = []
+        self._reset_fields()
+
     def _reset_fields(self):
         self._fld_type_len = None
         self._fld_name_len = None
@@ -354,8 +421,8 @@ class FieldContainer(Container):
     def fld_add(self, fld):
         self._append('fields', fld, self._reset_fields)
 
-    def fld_render(self, lno, store, pfx=''):
-        return self._cont_render('fields', lno, store, pfx)
+    def fld_render(self, out, store, pfx=''):
+        self._cont_render('fields', out, store, pfx)
 
     def fld_type_len(self, reducer=''):
         return self._len(
@@ -373,6 +440,10 @@ class FieldContainer(Container):
 
 
 class Enum(Statement, InlineOptionContainer):
+    __slots__ = (
+        'container', 'name', 'value', 'comment',
+    ) + InlineOptionContainer.SLOTS
+
     @classmethod
     def match(cls, parser, lno, line, comment):
         name, remainder = parser.split_eq(parser.strip_semi(line, lno))
@@ -401,7 +472,9 @@ class Enum(Statement, InlineOptionContainer):
         self.value = value
         self.comment = comment
 
-    def render(self, lno, store, pfx=''):
+        self._init_options()
+
+    def render(self, out, store, pfx=''):
         line = '%s%-*s = %*d%s;' % (
             pfx,
             self.container.enum_name_len(), self.name,
@@ -415,10 +488,17 @@ class Enum(Statement, InlineOptionContainer):
                 self.comment,
             )
 
-        return [line]
+        out.write(line)
 
 
 class EnumContainer(Container):
+    __slots__ = ()
+    SLOTS = ('enum', '_enum_name_len', '_enum_value_len', '_enum_opts_len')
+
+    def _init_enum(self):
+        self.enum = []
+        self._reset_enum()
+
     def _reset_enum(self):
         self._enum_name_len = None
         self._enum_value_len = None
@@ -427,8 +507,8 @@ class EnumContainer(Container):
     def enum_add(self, enum):
         self._append('enum', enum, self._reset_enum)
 
-    def enum_render(self, lno, store, pfx=''):
-        return self._cont_render('enum', lno, store, pfx)
+    def enum_render(self, out, store, pfx=''):
+        self._cont_render('enum', out, store, pfx)
 
     def enum_name_len(self, reducer=''):
         return self._len('enum', 'name', '_enum_name_len', reducer, Enum)
@@ -441,74 +521,90 @@ class EnumContainer(Container):
 
 
 class Range(object):
+    __slots__ = ('low', 'high')
+
     def __init__(self, low, high=None):
         self.low = low
         self.high = high
 
     def render(self):
         if self.high is None:
-            return '%d to max'
-        return '%d to %d'
+            return '%d to max' % self.low
+        return '%d to %d' % (self.low, self.high)
+
 
+class Reserved(KeywordStatement):
+    __slots__ = ('container', 'ranges', 'comment', '_content')
+
+    KEYWORD = 'reserved'
 
-class Reserved(Statement):
     @classmethod
-    def match(cls, parser, lno, line, comment):
-        if parser.tok(line) == 'reserved':
-            ranges_txt = parser.strip_semi(line[len('reserved'):], lno)
-            ranges = []
-            if ranges_txt and ranges_txt[0] == '"':
-                while ranges_txt:
-                    ranges.append(parser.extract_strlit(ranges_txt, lno))
-                    ranges_txt = ranges_txt[len(tmp):].strip()
-                    if ranges_txt and ranges_txt[0] == ',':
-                        ranges_txt = ranges_txt[1:].strip()
-                        if not ranges_txt:
-                            raise PBException(
-                                'Too many commas',
-                                fname=parser.fname,
-                                lno=lno,
-                            )
-            else:
-                parts = [p.strip() for p in ranges_txt.split(',')]
-                for part in parts:
-                    if part.isdigit():
-                        ranges.append(int(part))
-                    elif not part:
+    def build(cls, parser, lno, text, comment):
+        ranges_txt = parser.strip_semi(text, lno)
+        ranges = []
+        if ranges_txt and ranges_txt[0] == '"':
+            while ranges_txt:
+                if ranges_txt[0] != '"':
+                    raise PBException(
+                        'Invalid reserved name "%s"' % ranges_txt,
+                        fname=parser.fname,
+                        lno=lno,
+                    )
+                name = parser.extract_strlit(ranges_txt, lno)
+                ranges.append(name)
+                ranges_txt = ranges_txt[len(name):].strip()
+                if ranges_txt and ranges_txt[0] == ',':
+                    ranges_txt = ranges_txt[1:].strip()
+                    if not ranges_txt:
                         raise PBException(
                             'Too many commas',
                             fname=parser.fname,
                             lno=lno,
                         )
+                elif ranges_txt:
+                    raise PBException(
+                        'Missing comma',
+                        fname=parser.fname,
+                        lno=lno,
+                    )
+        else:
+            parts = [p.strip() for p in ranges_txt.split(',')]
+            for part in parts:
+                if part.isdigit():
+                    ranges.append(int(part))
+                elif not part:
+                    raise PBException(
+                        'Too many commas',
+                        fname=parser.fname,
+                        lno=lno,
+                    )
+                else:
+                    ilen, low = parser.extract_digits(part, lno)
+                    high_txt = part[ilen:].strip()
+                    if parser.tok(high_txt) != 'to':
+                        raise PBException(
+                            'Invalid reserved range "%s"' % part,
+                            fname=parser.fname,
+                            lno=lno,
+                        )
+                    high_txt = high_txt[len('to'):].strip()
+                    if high_txt == 'max':
+                        high = None
                     else:
-                        ilen, low = parser.extract_digits(part, lno)
-                        high_txt = part[ilen:]
-                        if parser.tok(high_txt) != 'to':
+                        try:
+                            high = int(high_txt)
+                        except ValueError:
                             raise PBException(
                                 'Invalid reserved range "%s"' % part,
                                 fname=parser.fname,
                                 lno=lno,
                             )
-                        high_txt = high_text[len('to'):].strip()
-                        if parser.tok(high_text) == 'max':
-                            high = None
-                        else:
-                            try:
-                                high = int(high_txt)
-                            except ValueError:
-                                raise PBException(
-                                    'Invalid reserved range "%s"' % part,
-                                    fname=parser.fname,
-                                    lno=lno,
-                                )
-                        ranges.append(Range(low, high))
-            return cls(
-                parser.fname, lno, parser.stack,
-                ranges,
-                comment=comment,
-            )
-
-        return None
+                    ranges.append(Range(low, high))
+        return cls(
+            parser.fname, lno, parser.stack,
+            ranges,
+            comment=comment,
+        )
 
     def __init__(self, fname, lno, container, ranges, comment=None):
         super(Reserved, self).__init__(fname, lno)
@@ -519,7 +615,7 @@ class Reserved(Statement):
 
         self._content = None
 
-    def render(self, lno, store, pfx=''):
+    def render(self, out, store, pfx=''):
         line = '%sreserved %s;' % (pfx, self.content)
 
         if self.comment:
@@ -527,7 +623,7 @@ class Reserved(Statement):
                 self.container.resv_len(self.content), '', self.comment,
             )
 
-        return [line]
+        out.write(line)
 
     @property
     def content(self):
@@ -539,40 +635,49 @@ class Reserved(Statement):
                 for rng in self.ranges
             ]
             self._content = ', '.join(ranges)
+        return self._content
 
 
 class ReservedContainer(Container):
+    __slots__ = ()
+    SLOTS = ('reserved', '_resv_len')
+
+    def _init_reserved(self):
+        self.reserved = []
+        self._reset_reserved()
+
     def _reset_reserved(self):
         self._resv_len = None
 
     def resv_add(self, resv):
         self._append('reserved', resv, self._reset_reserved)
 
-    def resv_render(self, lno, store, pfx=''):
-        return self._cont_render('reserved', lno, store, pfx)
+    def resv_render(self, out, store, pfx=''):
+        self._cont_render('reserved', out, store, pfx)
 
     def resv_len(self, reducer=''):
         return self._len('reserved', 'content', '_resv_len', reducer, Reserved)
 
 
-class Import(Statement):
-    @classmethod
-    def match(cls, parser, lno, line, comment):
-        if parser.tok(line) == 'import':
-            line = parser.strip_semi(line[len('import'):], lno)
-            type_ = None
-            if line[0] != '"':
-                type_ = parser.tok(line)
-                line = line[len(type_):].strip()
+class Import(KeywordStatement):
+    __slots__ = ('container', 'iname', 'comment', 'type_', '_content')
 
-            return cls(
-                parser.fname, lno, parser.stack,
-                parser.extract_strlit(line, lno),
-                comment=comment,
-                type_=type_,
-            )
+    KEYWORD = 'import'
 
-        return None
+    @classmethod
+    def build(cls, parser, lno, text, comment):
+        text = parser.strip_semi(text, lno)
+        type_ = None
+        if not text.startswith('"'):
+            type_ = parser.tok(text)
+            text = text[len(type_):].strip()
+
+        return cls(
+            parser.fname, lno, parser.stack,
+            parser.extract_strlit(text, lno),
+            comment=comment,
+            type_=type_,
+        )
 
     def __init__(self, fname, lno, container, iname, comment=None, type_=None):
         super(Import, self).__init__(fname, lno)
@@ -584,7 +689,7 @@ class Import(Statement):
 
         self._content = None
 
-    def render(self, lno, store, pfx=''):
+    def render(self, out, store, pfx=''):
         line = '%simport %s;' % (pfx, self.content)
 
         if self.comment:
@@ -592,7 +697,7 @@ class Import(Statement):
                 self.container.import_len(self.content), '', self.comment,
             )
 
-        return [line]
+        out.write(line)
 
     @property
     def content(self):
@@ -605,37 +710,45 @@ class Import(Statement):
 
 
 class ImportContainer(Container):
+    __slots__ = ()
+    SLOTS = ('imports', '_import_len')
+
+    def _init_imports(self):
+        self.imports = []
+        self._reset_imports()
+
     def _reset_imports(self):
         self._import_len = None
 
     def import_add(self, imp):
         self._append('imports', imp, self._reset_imports)
 
-    def import_render(self, lno, store, pfx=''):
-        return self._cont_render('imports', lno, store, pfx)
+    def import_render(self, out, store, pfx=''):
+        self._cont_render('imports', out, store, pfx)
 
     def import_len(self, reducer=''):
         return self._len('imports', 'content', '_import_len', reducer, Import)
 
 
-class Syntax(Statement):
+class Syntax(KeywordStatement):
+    __slots__ = ('container', 'syntax', 'comment')
+
+    KEYWORD = 'syntax'
+
     @classmethod
-    def match(cls, parser, lno, line, comment):
-        if parser.tok(line) == 'syntax':
-            _stmt, syntax = parser.split_eq(parser.strip_semi(line, lno))
-            if not syntax or syntax[0] != '"' or syntax[-1] != '"':
-                raise PBException(
-                    'Invalid syntax statement',
-                    fname=parser.fname,
-                    lno=lno,
-                )
-            return cls(
-                parser.fname, lno, parser.stack,
-                syntax,
-                comment=comment,
+    def build(cls, parser, lno, text, comment):
+        _stmt, syntax = parser.split_eq(parser.strip_semi(text, lno))
+        if not syntax or syntax[0] != '"' or syntax[-1] != '"':
+            raise PBException(
+                'Invalid syntax statement',
+                fname=parser.fname,
+                lno=lno,
             )
-
-        return None
+        return cls(
+            parser.fname, lno, parser.stack,
+            syntax,
+            comment=comment,
+        )
 
     def __init__(self, fname, lno, container, syntax, comment=None):
         super(Syntax, self).__init__(fname, lno)
@@ -644,26 +757,27 @@ class Syntax(Statement):
         self.syntax = syntax
         self.comment = comment
 
-    def render(self, lno, store, pfx=''):
+    def render(self, out, store, pfx=''):
         line = '%ssyntax = %s;' % (pfx, self.syntax)
 
         if self.comment:
             line += ' // %s' % self.comment
 
-        return [line]
+        out.write(line)
 
 
-class Package(Statement):
-    @classmethod
-    def match(cls, parser, lno, line, comment):
-        if parser.tok(line) == 'package':
-            return cls(
-                parser.fname, lno, parser.stack,
-                parser.strip_semi(line[len('package'):], lno),
-                comment=comment,
-            )
+class Package(KeywordStatement):
+    __slots__ = ('container', 'name', 'comment')
 
-        return None
+    KEYWORD = 'package'
+
+    @classmethod
+    def build(cls, parser, lno, text, comment):
+        return cls(
+            parser.fname, lno, parser.stack,
+            parser.strip_semi(text, lno),
+            comment=comment,
+        )
 
     def __init__(self, fname, lno, container, name, comment=None):
         super(Package, self).__init__(fname, lno)
@@ -672,31 +786,42 @@ class Package(Statement):
         self.name = name
         self.comment = comment
 
-    def render(self, lno, store, pfx=''):
+    def render(self, out, store, pfx=''):
         line = '%spackage %s;' % (pfx, self.name)
 
         if self.comment:
             line += ' // %s' % self.comment
 
-        return [line]
+        out.write(line)
 
 
 class StatementContainer(Container):
+    __slots__ = ()
+    SLOTS = ('statements',)
+
+    def _init_statements(self):
+        self.statements = []
+
     def stmt_add(self, stmt):
         self._append('statements', stmt)
 
-    def stmt_render(self, lno, store, pfx=''):
-        lines = []
-        for stmt in self._list('statements'):
-            if lines:
-                lines.append('')
-            lines.extend(stmt.render(lno + len(lines), store, pfx))
-        return lines
+    def stmt_render(self, out, store, pfx=''):
+        for i, stmt in enumerate(self._list('statements')):
+            if i:
+                out.separate()
+            stmt.render(out, store, pfx)
 
 
 class Block(Statement):
+    __slots__ = ('container', 'prefix', 'comment', 'name', 'end_comment')
+
     INDENT = '    '
 
+    # Maps the keywords of the statements recognized within the block
+    # to a tuple of the statement class and the name of the method
+    # that adds the statement to the block; see dispatch()
+    STATEMENTS = {}
+
     def __init__(self, fname, lno, container, name, prefix=None, comment=None):
         super(Block, self).__init__(fname, lno)
 
@@ -707,49 +832,85 @@ class Block(Statement):
 
         self.end_comment = None
 
-    def _render_prefix(self, lno, store, pfx):
+    def _render_prefix(self, out, store, pfx):
         # Render the lead-in comment
-        lines = self.prefix.render(lno, store, pfx) if self.prefix else []
+        if self.prefix:
+            self.prefix.render(out, store, pfx)
 
         # Render the block start
         text = '%s%s %s {' % (pfx, self.TYPE, self.name)
         if self.comment:
             text += ' // %s' % self.comment
-        lines.append(text)
+        out.write(text)
 
-        return lines
-
-    def _render_block(self, lno, store, pfx, lines, renderers):
-        sep = False
+    def _render_block(self, out, store, pfx, renderers):
+        # Separate the output of each renderer from the last one that
+        # produced any output
+        wrote = False
         for renderer in renderers:
-            tmp = renderer(lno + len(lines), store, pfx + self.INDENT)
-            if tmp:
-                if sep:
-                    lines.append('')
-                lines.extend(tmp)
-                sep = True
-
-    def _render_suffix(self, lno, store, pfx, lines):
+            if wrote:
+                out.separate()
+            lno = out.lno
+            renderer(out, store, pfx + self.INDENT)
+            wrote = wrote or out.lno != lno
+
+        # Don't leave a blank line dangling at the end of the block
+        out.separate(False)
+
+    def _render_suffix(self, out, store, pfx):
         text = '%s}' % pfx
         if self.end_comment:
             text += ' // %s' % self.end_comment
-        lines.append(text)
-
-        return lines
+        out.write(text)
 
-    def _render(self, lno, store, pfx, *renderers):
+    def _render(self, out, store, pfx, *renderers):
         # Render the lead-in
-        lines = self._render_prefix(lno, store, pfx)
+        self._render_prefix(out, store, pfx)
 
         # Render the block
-        self._render_block(lno, store, pfx, lines, renderers)
+        self._render_block(out, store, pfx, renderers)
 
-        # Render the lead-out and return the lines
-        return self._render_suffix(lno, store, pfx, lines)
+        # Render the lead-out
+        self._render_suffix(out, store, pfx)
 
     def set_end_comment(self, comment):
         self.end_comment = comment
 
+    def dispatch(self, parser, lno, line, comment):
+        """
+        Parse a statement introduced by a keyword.  The leading
+        keyword of the line is looked up in ``STATEMENTS`` to find the
+        statement class and the name of the method that adds the
+        statement to this block.  Any pending block comment is
+        attached: a nested block takes it as its lead-in comment,
+        while any other statement is preceded by it.  Returns a
+        ``False`` value if the keyword is not recognized.
+        """
+
+        keyword = parser.keyword
+        if keyword not in self.STATEMENTS:
+            return False
+
+        cls, adder = self.STATEMENTS[keyword]
+        add = getattr(self, adder)
+        text = line[len(keyword):]
+
+        if issubclass(cls, Block):
+            block = cls.build(
+                parser, lno, text, comment, parser.data.block_comment,
+            )
+            add(block)
+            del parser.data.block_comment
+            parser.push(block)
+        else:
+            stmt = cls.build(parser, lno, text, comment)
+            if parser.data.block_comment:
+                add(parser.data.block_comment)
+                del parser.data.block_comment
+            add(stmt)
+
+        return True
+
     @abc.abstractmethod
     def parse(self, parser, lno, line, comment):
         pass
@@ -760,6 +921,8 @@ class Block(Statement):
 
 
 class NamedBlock(Block):
+    __slots__ = ('_full_name',)
+
     def __init__(self, fname, lno, container, name, prefix=None, comment=None):
         super(NamedBlock, self).__init__(
             fname, lno, container, name, prefix, comment,
@@ -767,7 +930,7 @@ class NamedBlock(Block):
 
         self._full_name = None
 
-    def _data(self, lno, store, error=True):
+    def _data(self, out, store, error=True):
         key = '%s:%s' % (self.TYPE, self.full_name)
         if error and key in store:
             raise PBException(
@@ -775,28 +938,24 @@ class NamedBlock(Block):
                 fname=self.fname,
                 lno=self.lno,
             )
-        return store.setdefault(key, {'start': lno + 1})
+        return store.setdefault(key, {'start': out.next_lno})
 
-    def _render_prefix(self, lno, store, pfx):
+    def _render_prefix(self, out, store, pfx):
         # Get the data; also sets the absolute start
-        data = self._data(lno, store)
+        data = self._data(out, store)
 
         # Render the prefix
-        lines = super(NamedBlock, self)._render_prefix(lno, store, pfx)
+        super(NamedBlock, self)._render_prefix(out, store, pfx)
 
         # Store the line number of the block start
-        data['block_start'] = lno + len(lines)
-
-        return lines
+        data['block_start'] = out.lno - 1
 
-    def _render_suffix(self, lno, store, pfx, lines):
+    def _render_suffix(self, out, store, pfx):
         # Render the suffix
-        super(NamedBlock, self)._render_suffix(lno, store, pfx, lines)
+        super(NamedBlock, self)._render_suffix(out, store, pfx)
 
-        # Save the data end
-        self._data(lno, store, False)['end'] = lno + len(lines) + 1
-
-        return lines
+        # Save the data end, which is just past the closing brace
+        self._data(out, store, False)['end'] = out.lno
 
     @property
     def full_name(self):
@@ -812,19 +971,25 @@ class NamedBlock(Block):
 
 
 class BlockContainer(Container):
+    __slots__ = ()
+    SLOTS = ('blocks',)
+
+    def _init_blocks(self):
+        self.blocks = []
+
     def block_add(self, block):
         self._append('blocks', block)
 
-    def block_render(self, lno, store, pfx=''):
-        lines = []
-        for block in self._list('blocks'):
-            if lines:
-                lines.append('')
-            lines.extend(block.render(lno + len(lines), store, pfx))
-        return lines
+    def block_render(self, out, store, pfx=''):
+        for i, block in enumerate(self._list('blocks')):
+            if i:
+                out.separate()
+            block.render(out, store, pfx)
 
 
 class BlockComment(Block):
+    __slots__ = ('text',)
+
     TYPE = '<comment>'
 
     @classmethod
@@ -845,11 +1010,9 @@ class BlockComment(Block):
     def add_text(self, text):
         self.text.append(text)
 
-    def render(self, lno, store, pfx=''):
-        return [
-            '%s// %s' % (pfx, text)
-            for text in self.text
-        ]
+    def render(self, out, store, pfx=''):
+        for text in self.text:
+            out.write('%s// %s' % (pfx, text))
 
     def parse(self, parser, lno, line, comment):
         if line:
@@ -860,26 +1023,37 @@ class BlockComment(Block):
         return False
 
 
-class MessageBlock(NamedBlock, OptionContainer, FieldContainer,
-                   ReservedContainer):
+class MessageBlock(KeywordStatement, NamedBlock, OptionContainer,
+                   FieldContainer, ReservedContainer):
+    __slots__ = (
+        OptionContainer.SLOTS + FieldContainer.SLOTS + ReservedContainer.SLOTS
+    )
+
+    KEYWORD = 'message'
     TYPE = 'message'
 
     @classmethod
-    def match(cls, parser, lno, line, comment, leadin=None):
-        if parser.tok(line) == 'message':
-            name = parser.strip_brace(line[len('message'):], lno)
-            return cls(
-                parser.fname, lno, parser.stack,
-                name,
-                prefix=leadin,
-                comment=comment,
-            )
+    def build(cls, parser, lno, text, comment, leadin=None):
+        name = parser.strip_brace(text, lno)
+        return cls(
+            parser.fname, lno, parser.stack,
+            name,
+            prefix=leadin,
+            comment=comment,
+        )
 
-        return None
+    def __init__(self, fname, lno, container, name, prefix=None, comment=None):
+        super(MessageBlock, self).__init__(
+            fname, lno, container, name, prefix, comment,
+        )
 
-    def render(self, lno, store, pfx=''):
-        return self._render(
-            lno, store, pfx,
+        self._init_options()
+        self._init_fields()
+        self._init_reserved()
+
+    def render(self, out, store, pfx=''):
+        self._render(
+            out, store, pfx,
             self.opt_render, self.resv_render, self.fld_render,
         )
 
@@ -898,57 +1072,7 @@ class MessageBlock(NamedBlock, OptionContainer, FieldContainer,
             parser.push(cmnt)
             return False
 
-        opt = Option.match(parser, lno, line, comment)
-        if opt is not None:
-            if parser.data.block_comment:
-                self.opt_add(parser.data.block_comment)
-                del parser.data.block_comment
-            self.opt_add(opt)
-            return False
-
-        resv = Reserved.match(parser, lno, line, comment)
-        if resv is not None:
-            if parser.data.block_comment:
-                self.resv_add(parser.data.block_comment)
-                del parser.data.block_comment
-            self.resv_add(resv)
-            return False
-
-        msg = MessageBlock.match(
-            parser, lno, line, comment, parser.data.block_comment,
-        )
-        if msg is not None:
-            self.fld_add(msg)
-            del parser.data.block_comment
-            parser.push(msg)
-            return False
-
-        enum = EnumBlock.match(
-            parser, lno, line, comment, parser.data.block_comment,
-        )
-        if enum is not None:
-            self.fld_add(enum)
-            del parser.data.block_comment
-            parser.push(enum)
-            return False
-
-        oneof = OneofBlock.match(
-            parser, lno, line, comment, parser.data.block_comment,
-        )
-        if oneof is not None:
-            self.fld_add(oneof)
-            del parser.data.block_comment
-            parser.push(oneof)
-            return False
-
-        map_ = MapField.match(
-            parser, lno, line, comment,
-        )
-        if map_ is not None:
-            if parser.data.block_comment:
-                self.fld_add(parser.data.block_comment)
-                del parser.data.block_comment
-            self.fld_add(map_)
+        if self.dispatch(parser, lno, line, comment):
             return False
 
         if parser.data.block_comment:
@@ -961,25 +1085,37 @@ class MessageBlock(NamedBlock, OptionContainer, FieldContainer,
         return False
 
 
-class EnumBlock(NamedBlock, OptionContainer, EnumContainer, ReservedContainer):
+class EnumBlock(KeywordStatement, NamedBlock, OptionContainer, EnumContainer,
+                ReservedContainer):
+    __slots__ = (
+        OptionContainer.SLOTS + EnumContainer.SLOTS + ReservedContainer.SLOTS
+    )
+
+    KEYWORD = 'enum'
     TYPE = 'enum'
 
     @classmethod
-    def match(cls, parser, lno, line, comment, leadin=None):
-        if parser.tok(line) == 'enum':
-            name = parser.strip_brace(line[len('enum'):], lno)
-            return cls(
-                parser.fname, lno, parser.stack,
-                name,
-                prefix=leadin,
-                comment=comment,
-            )
+    def build(cls, parser, lno, text, comment, leadin=None):
+        name = parser.strip_brace(text, lno)
+        return cls(
+            parser.fname, lno, parser.stack,
+            name,
+            prefix=leadin,
+            comment=comment,
+        )
 
-        return None
+    def __init__(self, fname, lno, container, name, prefix=None, comment=None):
+        super(EnumBlock, self).__init__(
+            fname, lno, container, name, prefix, comment,
+        )
+
+        self._init_options()
+        self._init_enum()
+        self._init_reserved()
 
-    def render(self, lno, store, pfx=''):
-        return self._render(
-            lno, store, pfx,
+    def render(self, out, store, pfx=''):
+        self._render(
+            out, store, pfx,
             self.opt_render, self.resv_render, self.enum_render,
         )
 
@@ -998,20 +1134,7 @@ class EnumBlock(NamedBlock, OptionContainer, EnumContainer, ReservedContainer):
             parser.push(cmnt)
             return False
 
-        opt = Option.match(parser, lno, line, comment)
-        if opt is not None:
-            if parser.data.block_comment:
-                self.opt_add(parser.data.block_comment)
-                del parser.data.block_comment
-            self.opt_add(opt)
-            return False
-
-        resv = Reserved.match(parser, lno, line, comment)
-        if resv is not None:
-            if parser.data.block_comment:
-                self.resv_add(parser.data.block_comment)
-                del parser.data.block_comment
-            self.resv_add(resv)
+        if self.dispatch(parser, lno, line, comment):
             return False
 
         if parser.data.block_comment:
@@ -1024,24 +1147,31 @@ class EnumBlock(NamedBlock, OptionContainer, EnumContainer, ReservedContainer):
         return False
 
 
-class OneofBlock(Block, FieldContainer):
+class OneofBlock(KeywordStatement, Block, FieldContainer):
+    __slots__ = FieldContainer.SLOTS
+
+    KEYWORD = 'oneof'
     TYPE = 'oneof'
 
     @classmethod
-    def match(cls, parser, lno, line, comment, leadin=None):
-        if parser.tok(line) == 'oneof':
-            name = parser.strip_brace(line[len('oneof'):], lno)
-            return cls(
-                parser.fname, lno, parser.stack,
-                name,
-                prefix=leadin,
-                comment=comment,
-            )
+    def build(cls, parser, lno, text, comment, leadin=None):
+        name = parser.strip_brace(text, lno)
+        return cls(
+            parser.fname, lno, parser.stack,
+            name,
+            prefix=leadin,
+            comment=comment,
+        )
 
-        return None
+    def __init__(self, fname, lno, container, name, prefix=None, comment=None):
+        super(OneofBlock, self).__init__(
+            fname, lno, container, name, prefix, comment,
+        )
 
-    def render(self, lno, store, pfx=''):
-        return self._render(lno, store, pfx, self.fld_render)
+        self._init_fields()
+
+    def render(self, out, store, pfx=''):
+        self._render(out, store, pfx, self.fld_render)
 
     def parse(self, parser, lno, line, comment):
         if line == '}':
@@ -1068,25 +1198,32 @@ class OneofBlock(Block, FieldContainer):
         return False
 
 
-class ExtendBlock(NamedBlock, FieldContainer):
+class ExtendBlock(KeywordStatement, NamedBlock, FieldContainer):
+    __slots__ = FieldContainer.SLOTS
+
+    KEYWORD = 'extend'
     TYPE = 'extend'
 
     @classmethod
-    def match(cls, parser, lno, line, comment, leadin=None):
-        if parser.tok(line) == 'extend':
-            name = parser.strip_brace(line[len('extend'):], lno)
-            return cls(
-                parser.fname, lno, parser.stack,
-                name,
-                prefix=leadin,
-                comment=comment,
-            )
+    def build(cls, parser, lno, text, comment, leadin=None):
+        name = parser.strip_brace(text, lno)
+        return cls(
+            parser.fname, lno, parser.stack,
+            name,
+            prefix=leadin,
+            comment=comment,
+        )
 
-        return None
+    def __init__(self, fname, lno, container, name, prefix=None, comment=None):
+        super(ExtendBlock, self).__init__(
+            fname, lno, container, name, prefix, comment,
+        )
 
-    def render(self, lno, store, pfx=''):
-        return self._render(
-            lno, store, pfx,
+        self._init_fields()
+
+    def render(self, out, store, pfx=''):
+        self._render(
+            out, store, pfx,
             self.fld_render,
         )
 
@@ -1117,6 +1254,11 @@ class ExtendBlock(NamedBlock, FieldContainer):
 
 class FileBlock(Block, StatementContainer, ImportContainer, OptionContainer,
                 BlockContainer):
+    __slots__ = (
+        StatementContainer.SLOTS + ImportContainer.SLOTS +
+        OptionContainer.SLOTS + BlockContainer.SLOTS
+    )
+
     TYPE = '<file>'
     INDENT = ''
 
@@ -1127,11 +1269,14 @@ class FileBlock(Block, StatementContainer, ImportContainer, OptionContainer,
     def __init__(self, fname):
         super(FileBlock, self).__init__(fname, 0, None, None)
 
-    def render(self, lno, store, pfx=''):
-        lines = []
+        self._init_statements()
+        self._init_imports()
+        self._init_options()
+        self._init_blocks()
 
+    def render(self, out, store, pfx=''):
         self._render_block(
-            lno, store, pfx, lines, [
+            out, store, pfx, [
                 self.stmt_render,
                 self.import_render,
                 self.opt_render,
@@ -1139,8 +1284,6 @@ class FileBlock(Block, StatementContainer, ImportContainer, OptionContainer,
             ]
         )
 
-        return lines
-
     def parse(self, parser, lno, line, comment):
         if line is None:
             if parser.data.block_comment:
@@ -1153,63 +1296,7 @@ class FileBlock(Block, StatementContainer, ImportContainer, OptionContainer,
             parser.push(cmnt)
             return False
 
-        syntax = Syntax.match(parser, lno, line, comment)
-        if syntax is not None:
-            if parser.data.block_comment:
-                self.stmt_add(parser.data.block_comment)
-                del parser.data.block_comment
-            self.stmt_add(syntax)
-            return False
-
-        package = Package.match(parser, lno, line, comment)
-        if package is not None:
-            if parser.data.block_comment:
-                self.stmt_add(parser.data.block_comment)
-                del parser.data.block_comment
-            self.stmt_add(package)
-            return False
-
-        import_ = Import.match(parser, lno, line, comment)
-        if import_ is not None:
-            if parser.data.block_comment:
-                self.import_add(parser.data.block_comment)
-                del parser.data.block_comment
-            self.import_add(import_)
-            return False
-
-        opt = Option.match(parser, lno, line, comment)
-        if opt is not None:
-            if parser.data.block_comment:
-                self.opt_add(parser.data.block_comment)
-                del parser.data.block_comment
-            self.opt_add(opt)
-            return False
-
-        msg = MessageBlock.match(
-            parser, lno, line, comment, parser.data.block_comment,
-        )
-        if msg is not None:
-            self.block_add(msg)
-            del parser.data.block_comment
-            parser.push(msg)
-            return False
-
-        extend = ExtendBlock.match(
-            parser, lno, line, comment, parser.data.block_comment,
-        )
-        if extend is not None:
-            self.block_add(extend)
-            del parser.data.block_comment
-            parser.push(extend)
-            return False
-
-        enum = EnumBlock.match(
-            parser, lno, line, comment, parser.data.block_comment,
-        )
-        if enum is not None:
-            self.block_add(enum)
-            del parser.data.block_comment
-            parser.push(enum)
+        if self.dispatch(parser, lno, line, comment):
             return False
 
         if parser.data.block_comment:
@@ -1219,6 +1306,32 @@ class FileBlock(Block, StatementContainer, ImportContainer, OptionContainer,
         return False
 
 
+# The statements recognized within each kind of block, keyed by the
+# keyword introducing the statement.  These are set here, rather than
+# in the class definitions, since the blocks refer to each other.
+MessageBlock.STATEMENTS = {
+    Option.KEYWORD: (Option, 'opt_add'),
+    Reserved.KEYWORD: (Reserved, 'resv_add'),
+    MessageBlock.KEYWORD: (MessageBlock, 'fld_add'),
+    EnumBlock.KEYWORD: (EnumBlock, 'fld_add'),
+    OneofBlock.KEYWORD: (OneofBlock, 'fld_add'),
+    MapField.KEYWORD: (MapField, 'fld_add'),
+}
+EnumBlock.STATEMENTS = {
+    Option.KEYWORD: (Option, 'opt_add'),
+    Reserved.KEYWORD: (Reserved, 'resv_add'),
+}
+FileBlock.STATEMENTS = {
+    Syntax.KEYWORD: (Syntax, 'stmt_add'),
+    Package.KEYWORD: (Package, 'stmt_add'),
+    Import.KEYWORD: (Import, 'import_add'),
+    Option.KEYWORD: (Option, 'opt_add'),
+    MessageBlock.KEYWORD: (MessageBlock, 'block_add'),
+    ExtendBlock.KEYWORD: (ExtendBlock, 'block_add'),
+    EnumBlock.KEYWORD: (EnumBlock, 'block_add'),
+}
+
+
 class ParserData(object):
     def __init__(self):
         self._data = {}
@@ -1239,20 +1352,94 @@ class ParserData(object):
             self._data.pop(name, None)
 
 
+class LineWriter(object):
+    """
+    Receives the lines of a rendered protobuf file, keeping track of
+    the line number of the next line.  Lines are either written to a
+    stream as they are rendered or collected into a list.
+    """
+
+    def __init__(self, stream=None, lno=1):
+        self.stream = stream
+        self.lno = lno
+        self.lines = [] if stream is None else None
+
+        self._sep = False
+
+    def write(self, line):
+        """
+        Write a line.  If a separator has been requested, a blank line
+        will be written first.
+        """
+
+        if self._sep:
+            self._sep = False
+            self.write('')
+
+        if self.stream is None:
+            self.lines.append(line)
+        else:
+            self.stream.write(line + '\n')
+        self.lno += 1
+
+    def separate(self, sep=True):
+        """
+        Request that a blank line precede the next line written.  The
+        blank line is only written once another line is, so separators
+        never pile up or dangle at the end of a block.
+        """
+
+        self._sep = sep
+
+    @property
+    def next_lno(self):
+        """
+        The line number that the next line written will have.
+        """
+
+        return self.lno + 1 if self._sep else self.lno
+
+
 class Protobuf(object):
     def __init__(self, pbfile):
         self.pbfile = pbfile
         self.locations = {}
 
-    def render(self):
-        return self.pbfile.render(1, self.locations)
+    def render(self, stream=None):
+        """
+        Render the protobuf file.  This also updates ``locations``,
+        which maps the type and full name of each message, enum, and
+        extension block to its ``start`` line (including any lead-in
+        comment), ``block_start`` line, and ``end`` line (just past
+        the closing brace).
+        """
+
+        self.locations = {}
+        out = LineWriter(stream)
+        self.pbfile.render(out, self.locations)
+        return out.lines
 
 
 class Parser(object):
     @classmethod
-    def parse(cls, fname):
-        parser = cls(fname)
-        return Protobuf(parser.parse_file())
+    def parse(cls, fname, cache=None):
+        """
+        Parse a protobuf file.
+        """
+
+        if cache is None:
+            return Protobuf(cls(fname).parse_file())
+
+        with open(fname, 'rb') as f:
+            data = f.read()
+
+        key = cache.key(fname, data)
+        pbfile = cache.load(key)
+        if pbfile is None:
+            pbfile = Protobuf(cls(fname).parse_text(six.ensure_str(data)))
+            cache.store(key, pbfile)
+
+        return pbfile
 
     def __init__(self, fname):
         self.fname = fname
@@ -1260,6 +1447,9 @@ class Parser(object):
         self._stack = []
         self._data = []
 
+        # The keyword beginning the line being parsed
+        self.keyword = ''
+
     def push(self, parser):
         assert parser is not None
         self._stack.append(parser)
@@ -1270,14 +1460,21 @@ class Parser(object):
         return self._stack.pop()
 
     def parse_file(self):
-        self.push(FileBlock(self.fname))
         with open(self.fname) as f:
-            for lno, line in enumerate(f, 1):
-                # Expanding the tabs guarantees comments still look
-                # the same
-                line, comment = self.split_comment(line.expandtabs())
-                while self.stack.parse(self, lno, line, comment):
-                    pass
+            return self.parse_text(f.read())
+
+    def parse_text(self, text):
+        self.push(FileBlock(self.fname))
+
+        # Expanding the tabs guarantees comments still look the same
+        lines = self.lex(text.expandtabs())
+
+        for lno, (line, comment, keyword) in enumerate(lines, 1):
+            # Statements are dispatched on the keyword found by the
+            # lexer, rather than re-tokenizing the line
+            self.keyword = keyword
+            while self.stack.parse(self, lno, line, comment):
+                pass
 
         if len(self._stack) > 1:
             raise PBException(
@@ -1291,25 +1488,77 @@ class Parser(object):
 
         return self.pop()
 
+    def parse_block(self, lines, lno=1, scope=None):
+        """
+        Parse a single message, enum, or extension block, along with
+        any lead-in comment.  Parsing stops at the closing brace of the
+        block, so only the lines of the block are examined.  Returns
+        the block and the number of lines it spans.
+        """
+
+        self.push(FileBlock(self.fname))
+        first = lno
+
+        for lno, text in enumerate(lines, first):
+            for line, comment, keyword in self.lex(text.expandtabs()):
+                self.keyword = keyword
+                while self.stack.parse(self, lno, line, comment):
+                    pass
+
+            if len(self._stack) == 1 and self.stack.blocks:
+                break
+        else:
+            if len(self._stack) > 1:
+                raise PBException(
+                    'Unclosed %s block' % self.stack.TYPE,
+                    fname=self.fname,
+                    lno=self.stack.lno,
+                )
+            raise PBException('No block found', fname=self.fname, lno=first)
+
+        pbfile = self.pop()
+        block = pbfile.blocks[0]
+        if (len(pbfile.blocks) > 1 or pbfile.statements or pbfile.imports or
+                pbfile.options or not isinstance(block, NamedBlock)):
+            raise PBException(
+                'Expected a message, enum, or extension block',
+                fname=self.fname,
+                lno=first,
+            )
+
+        if scope:
+            block._full_name = '%s.%s' % (scope, block.name)
+
+        return block, lno - first + 1
+
+    def lex(self, text):
+        """
+        Split text into lines, separating the statement on each line
+        from its comment.  Returns a tuple of the statement, the comment
+        (or ``None``), and the leading keyword for each line.
+        """
+
+        if not text.endswith('\n'):
+            text += '\n'
+
+        return [
+            (line.rstrip(), comment.rstrip() or None, keyword)
+            for line, keyword, comment in LINE_RE.findall(text)
+        ]
+
     def tok(self, line):
-        for i in range(len(line)):
-            if not (line[i].isalnum() or line[i] == '_'):
-                return line[:i]
-        return line
+        return TOKEN_RE.match(line).group()
 
     def split_comment(self, line):
-        line, _sep, comment = line.partition('//')
-        comment = comment.rstrip()
-        if comment and comment[0].isspace():
-            comment = comment[1:]
-        return (line.strip(), comment or None)
+        line, comment, _keyword = self.lex(line)[0]
+        return (line, comment)
 
     def split_eq(self, line):
         line, _sep, value = line.partition('=')
         return (line.strip(), value.strip())
 
     def strip_semi(self, line, lno):
-        if line[-1] != ';':
+        if not line.endswith(';'):
             raise PBException(
                 'Missing semicolon',
                 fname=self.fname,
@@ -1318,7 +1567,7 @@ class Parser(object):
         return line[:-1].strip()
 
     def strip_brace(self, line, lno):
-        if line[-1] != '{':
+        if not line.endswith('{'):
             raise PBException(
                 'Missing open brace',
                 fname=self.fname,
@@ -1327,40 +1576,71 @@ class Parser(object):
         return line[:-1].strip()
 
     def extract_strlit(self, line, lno):
-        assert line[0] == '"'
-        escape = False
-        for i in range(1, len(line)):
-            if escape:
-                escape = False
-                continue
-
-            if line[i] == '\\':
-                escape = True
-
-            if line[i] == '"':
-                return line[:i + 1]
+        match = STRLIT_RE.match(line)
+        if not match:
+            raise PBException(
+                'Unclosed string literal' if line.startswith('"') else
+                'Expected a string literal',
+                fname=self.fname,
+                lno=lno,
+            )
 
-        raise PBException(
-            'Unclosed string literal',
-            fname=self.fname,
-            lno=lno,
-        )
+        return match.group()
 
     def extract_digits(self, line, lno):
-        if not line or not line[0].isdigit():
+        match = DIGITS_RE.match(line)
+        if not match:
             raise PBException(
                 'Invalid number',
                 fname=self.fname,
                 lno=lno,
             )
 
-        for i in range(len(line)):
-            if not line[i].isdigit():
-                break
-        else:
-            return len(line), int(line)
+        return match.end(), int(match.group())
 
-        return i, int(line[:i])
+    def split_options(self, line, lno):
+        """
+        Split the text of a list of inline options into the options.
+        """
+
+        options = []
+        pos = 0
+        while True:
+            match = INLINE_OPTION_RE.match(line, pos)
+            if not match:
+                raise PBException(
+                    'Invalid inline option',
+                    fname=self.fname,
+                    lno=lno,
+                )
+
+            name, value, sep = match.groups()
+            name = name.strip()
+            value = value.strip()
+            if not name:
+                raise PBException(
+                    'Invalid option with empty name',
+                    fname=self.fname,
+                    lno=lno,
+                )
+            if not value:
+                raise PBException(
+                    'Invalid option with empty value',
+                    fname=self.fname,
+                    lno=lno,
+                )
+            options.append((name, value))
+
+            pos = match.end()
+            if not sep:
+                return options
+            if pos >= len(line):
+                # Trailing comma
+                raise PBException(
+                    'Invalid inline option',
+                    fname=self.fname,
+                    lno=lno,
+                )
 
     @property
     def stack(self):
@@ -1371,36 +1651,1133 @@ class Parser(object):
         return self._data[-1]
 
 
-@cli_tools.argument(
+def default_cache_dir():
+    """
+    Determine the default directory for caches.
+    """
+
+    return os.path.join(
+        os.environ.get('XDG_CACHE_HOME') or
+        os.path.join(os.path.expanduser('~'), '.cache'),
+        'humboldt-doc',
+    )
+
+
+class ASTCache(object):
+    """
+    A directory of pickled ``Protobuf`` objects, allowing
+    ``Parser.parse()`` to skip parsing files it has seen before.
+    Entries are keyed by the hash of the file name and content, and
+    live in a subdirectory specific to the formatter version and the
+    Python version, so that a change to either invalidates them.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = os.path.join(
+            directory or os.path.join(default_cache_dir(), 'ast'),
+            'v%d-py%d.%d' % ((VERSION,) + tuple(sys.version_info[:2])),
+        )
+
+    def key(self, fname, data):
+        """
+        Compute the key for a file.
+        """
+
+        digest = hashlib.sha256(
+            os.path.abspath(fname).encode('utf-8') + b'\0'
+        )
+        digest.update(data)
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.pickle')
+
+    def load(self, key):
+        """
+        Load a cached ``Protobuf`` object, or return ``None`` if there
+        is no usable entry.
+        """
+
+        try:
+            with open(self._path(key), 'rb') as f:
+                return six.moves.cPickle.load(f)
+        except Exception:
+            # A missing, damaged, or incompatible entry is just a miss
+            return None
+
+    def store(self, key, pbfile):
+        """
+        Store a ``Protobuf`` object in the cache.
+        """
+
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                # Created concurrently
+                if not os.path.isdir(self.directory):
+                    raise
+
+        # Write to a temporary file first, so concurrent readers never
+        # see a partial entry
+        path = self._path(key)
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp, 'wb') as f:
+            six.moves.cPickle.dump(
+                pbfile, f, six.moves.cPickle.HIGHEST_PROTOCOL,
+            )
+        os.rename(tmp, path)
+
+
+class FormatCache(object):
+    """
+    A persistent record of files already known to be formatted.  The
+    record maps the absolute path of each file to the SHA-256 hash of
+    the content last written to it; a file whose content still has
+    that hash does not need to be parsed or rewritten.  The entire
+    record is discarded if it was produced by a different formatter
+    version.
+    """
+
+    def __init__(self, fname):
+        self.fname = fname
+
+        self._hashes = {}
+        self._dirty = False
+
+        try:
+            with open(fname) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return
+
+        if isinstance(data, dict) and data.get('version') == VERSION:
+            self._hashes = data.get('files', {})
+
+    @staticmethod
+    def digest(fname):
+        """
+        Compute the hash of a file's content.
+        """
+
+        with open(fname, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+
+    def fresh(self, fname, digest):
+        """
+        Determine whether a file is known to be formatted.
+        """
+
+        return self._hashes.get(os.path.abspath(fname)) == digest
+
+    def update(self, fname, digest):
+        """
+        Record the hash of the content written to a file.
+        """
+
+        key = os.path.abspath(fname)
+        if self._hashes.get(key) != digest:
+            self._hashes[key] = digest
+            self._dirty = True
+
+    def save(self):
+        """
+        Save the cache, if it has changed.
+        """
+
+        if not self._dirty:
+            return
+
+        dirname = os.path.dirname(self.fname)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+
+        tmp = self.fname + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(
+                {'version': VERSION, 'files': self._hashes}, f,
+                indent=2, sort_keys=True,
+            )
+        os.rename(tmp, self.fname)
+
+        self._dirty = False
+
+
+# The location index formats, mapped to the extension of the index
+# file.  The YAML index is the original format; the JSON index is a
+# compact list of entries, ordered by line number, which loads far
+# faster.
+INDEX_FORMATS = {
+    'yaml': '.idx',
+    'json': '.idx.json',
+}
+
+
+def idx_name(fname, fmt='yaml'):
+    """
+    Compute the name of the location index file for a protobuf file.
+    """
+
+    return os.path.splitext(fname)[0] + INDEX_FORMATS[fmt]
+
+
+def index_data(locations, fmt='yaml'):
+    """
+    Serialize a location index.
+    """
+
+    if fmt == 'json':
+        entries = sorted(
+            ([key, data['start'], data['block_start'], data['end']]
+             for key, data in locations.items()),
+            key=lambda entry: entry[1],
+        )
+        return json.dumps(entries, separators=(',', ':')).encode('utf-8')
+
+    return six.ensure_binary(yaml_compat.dump(
+        locations,
+        default_flow_style=False,
+        explicit_start=True,
+    ))
+
+
+def read_index(fname, fmt='yaml'):
+    """
+    Read the location index for a protobuf file.
+    """
+
+    with open(idx_name(fname, fmt)) as f:
+        if fmt == 'json':
+            return dict(
+                (key, {'start': start, 'block_start': block_start,
+                       'end': end})
+                for key, start, block_start, end in json.load(f)
+            )
+
+        return yaml_compat.load(f)
+
+
+# A block in a location index.  The parent is the Location of the
+# enclosing block, or None for a block at the top level of the file.
+Location = collections.namedtuple(
+    'Location', ['key', 'start', 'block_start', 'end', 'parent'],
+)
+
+
+class LocationIndex(object):
+    """
+    A location index prepared for lookups.  Blocks may be looked up by
+    key, in the form ``TYPE:full_name``, in constant time, or by line
+    number, in logarithmic time.
+    """
+
+    @classmethod
+    def load(cls, fname, fmt=None):
+        """
+        Load the location index for a protobuf file.
+        """
+
+        if fmt is None:
+            fmt = 'json' if os.path.exists(idx_name(fname, 'json')) else 'yaml'
+
+        return cls(read_index(fname, fmt))
+
+    def __init__(self, locations):
+        self._locations = {}
+        self._starts = []
+        self._entries = []
+
+        # Blocks nest, so with the blocks in order, the parent of each
+        # is the innermost preceding block not yet closed
+        open_blocks = []
+        for start, key in sorted(
+                (data['start'], key) for key, data in locations.items()):
+            data = locations[key]
+            while open_blocks and open_blocks[-1].end <= start:
+                open_blocks.pop()
+
+            loc = Location(
+                key, start, data['block_start'], data['end'],
+                open_blocks[-1] if open_blocks else None,
+            )
+            self._locations[key] = loc
+            self._starts.append(start)
+            self._entries.append(loc)
+            open_blocks.append(loc)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __contains__(self, key):
+        return key in self._locations
+
+    def __getitem__(self, key):
+        return self._locations[key]
+
+    def get(self, key, default=None):
+        return self._locations.get(key, default)
+
+    def at_line(self, lno):
+        """
+        Find the innermost block containing a line.
+        """
+
+        # Any block containing the line either is the last block to
+        # start at or before it, or encloses that block
+        i = bisect.bisect_right(self._starts, lno)
+        loc = self._entries[i - 1] if i else None
+        while loc is not None and loc.end <= lno:
+            loc = loc.parent
+
+        return loc
+
+
+def format_file(fname, ast_cache=None, backup=False, check=False,
+                index_format='yaml'):
+    """
+    Reformat a protobuf file in place and write its location index.
+    This is self-contained, so that it may be run in a worker process.
+    Returns the file name, the hash of the formatted content, whether
+    either file changed, and an error message or ``None``.
+    """
+
+    try:
+        digest, changed = write_file(
+            fname, Parser.parse(fname, ast_cache), backup, check,
+            index_format,
+        )
+        return fname, digest, changed, None
+    except (PBException, EnvironmentError) as exc:
+        return fname, None, False, str(exc)
+
+
+def update_file(fname, data, backup=False, check=False):
+    """
+    Replace the content of a file, if it differs.  The new content is
+    written to a temporary file which is then renamed over the old
+    one, so readers never see a partial file, and a file that is
+    already up to date is not touched at all.  Returns a ``True``
+    value if the file changed (or would change).
+    """
+
+    try:
+        with open(fname, 'rb') as f:
+            if f.read() == data:
+                return False
+        exists = True
+    except (IOError, OSError):
+        exists = False
+
+    if check:
+        return True
+
+    fd, tmp = _temp_file(fname)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        _replace(fname, tmp, exists, backup)
+    except Exception:
+        os.unlink(tmp)
+        raise
+
+    return True
+
+
+def _temp_file(fname):
+    # Creates a temporary file beside a file, returning its descriptor
+    # and name
+    dirname, basename = os.path.split(fname)
+    return tempfile.mkstemp(
+        prefix='.%s.' % basename, suffix='.tmp', dir=dirname or '.',
+    )
+
+
+def _replace(fname, tmp, exists, backup):
+    # Renames a temporary file over a file, keeping its permissions
+    if exists:
+        shutil.copymode(fname, tmp)
+        if backup:
+            shutil.copy2(fname, fname + '~')
+    else:
+        # Give the new file the usual permissions, rather than the
+        # private ones of a temporary file
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp, 0o666 & ~umask)
+
+    os.rename(tmp, fname)
+
+
+class FileUpdater(object):
+    """
+    A stream that writes new content for a file to a temporary file,
+    hashing it and comparing it with the current content as it goes.
+    Closing it replaces the file only if the content differs; in check
+    mode, nothing is written at all.
+    """
+
+    def __init__(self, fname, backup=False, check=False):
+        self.fname = fname
+        self.backup = backup
+        self.hash = hashlib.sha256()
+
+        try:
+            self._old = open(fname, 'rb')
+            self.changed = False
+        except (IOError, OSError):
+            self._old = None
+            self.changed = True
+
+        self._tmp = None
+        self._out = None
+        if not check:
+            fd, self._tmp = _temp_file(fname)
+            self._out = os.fdopen(fd, 'wb')
+
+    def write(self, text):
+        data = six.ensure_binary(text, 'utf-8')
+        self.hash.update(data)
+        if not self.changed and self._old.read(len(data)) != data:
+            self.changed = True
+        if self._out:
+            self._out.write(data)
+
+    def close(self):
+        """
+        Finish writing, replacing the file if its content changed.
+        """
+
+        if self._old:
+            if not self.changed and self._old.read(1):
+                # The old content was longer
+                self.changed = True
+            self._old.close()
+
+        if self._out:
+            self._out.close()
+            try:
+                if self.changed:
+                    _replace(
+                        self.fname, self._tmp, self._old is not None,
+                        self.backup,
+                    )
+                else:
+                    os.unlink(self._tmp)
+            except Exception:
+                os.unlink(self._tmp)
+                raise
+
+        return self.changed
+
+    def abort(self):
+        # Discards the new content, leaving the file untouched
+        if self._old:
+            self._old.close()
+        if self._out:
+            self._out.close()
+            os.unlink(self._tmp)
+
+
+def write_file(fname, pbfile, backup=False, check=False,
+               index_format='yaml'):
+    """
+    Write a parsed protobuf file and its location index, if they have
+    changed.  Returns the hash of the formatted content and whether
+    either file changed.
+    """
+
+    # Stream the rendered lines, so the formatted file is never held
+    # in memory
+    out = FileUpdater(fname, backup, check)
+    try:
+        pbfile.render(out)
+    except Exception:
+        out.abort()
+        raise
+
+    changed = out.close()
+    idx = idx_name(fname, index_format)
+    changed = update_file(
+        idx, index_data(pbfile.locations, index_format), backup, check,
+    ) or changed
+    if not check:
+        freshen_index(fname, idx)
+
+    return out.hash.hexdigest(), changed
+
+
+def freshen_index(fname, idx):
+    """
+    Make an unchanged location index at least as new as its protobuf
+    file, so that readers comparing their modification times, such as
+    the Sphinx extension, know the index is current.
+    """
+
+    try:
+        mtime = os.path.getmtime(fname)
+        if os.path.getmtime(idx) < mtime:
+            now = max(time.time(), mtime)
+            os.utime(idx, (now, now))
+    except OSError:
+        pass
+
+
+def find_block(index, name=None, lines=None):
+    """
+    Find a message, enum, or extension block in a location index, by
+    its full name or as the innermost block containing a range of
+    lines.
+    """
+
+    if name is not None:
+        if name in index:
+            return index[name]
+
+        found = [loc for loc in index if loc.key.split(':', 1)[1] == name]
+        if len(found) > 1:
+            raise PBException('Ambiguous block name "%s"; use one of %s' % (
+                name, ', '.join(sorted(loc.key for loc in found)),
+            ))
+        elif not found:
+            raise PBException('No block named "%s"' % name)
+        return found[0]
+
+    first, last = lines
+    loc = index.at_line(first)
+    while loc is not None and loc.end <= last:
+        loc = loc.parent
+    if loc is None:
+        raise PBException('No block contains lines %d-%d' % (first, last))
+    return loc
+
+
+def format_block(fname, name=None, lines=None, backup=False, check=False,
+                 index_format='yaml'):
+    """
+    Reformat a single message, enum, or extension block of a protobuf
+    file, and patch its location index to match.  Only the block is
+    parsed and rendered; the index entries following it are shifted by
+    the change in its length, so the cost depends on the size of the
+    block rather than that of the file.  The rest of the file is
+    assumed to be unchanged since the index was written.
+    """
+
+    try:
+        locations = read_index(fname, index_format)
+    except (IOError, OSError):
+        raise PBException(
+            'No location index; the whole file must be formatted first',
+            fname=fname,
+        )
+
+    try:
+        loc = find_block(LocationIndex(locations), name, lines)
+    except PBException as exc:
+        raise PBException(str(exc), fname=fname)
+    start, end = loc.start, loc.end
+
+    # The enclosing blocks determine the indentation, and the
+    # innermost one provides the scope for the names of the blocks
+    # being reformatted
+    depth = 0
+    parent = loc.parent
+    while parent is not None:
+        depth += 1
+        parent = parent.parent
+    scope = loc.parent.key.split(':', 1)[1] if loc.parent else None
+
+    with open(fname) as f:
+        text = f.readlines()
+
+    block, count = Parser(fname).parse_block(
+        itertools.islice(text, start - 1, None), start, scope,
+    )
+    if '%s:%s' % (block.TYPE, block.full_name) != loc.key:
+        raise PBException(
+            'Expected %s; the location index is out of date' % loc.key,
+            fname=fname,
+            lno=start,
+        )
+
+    # Render the block in place
+    out = LineWriter(lno=start)
+    store = {}
+    block.render(out, store, Block.INDENT * depth)
+    text[start - 1:start - 1 + count] = [line + '\n' for line in out.lines]
+
+    # Replace the entries for the block and those nested within it, and
+    # move everything after it; this also extends the enclosing blocks
+    delta = len(out.lines) - (end - start)
+    for key, data in list(locations.items()):
+        if data['start'] >= start and data['end'] <= end:
+            del locations[key]
+        else:
+            for field, lno in data.items():
+                if lno >= end:
+                    data[field] = lno + delta
+    locations.update(store)
+
+    changed = update_file(fname, ''.join(text).encode('utf-8'), backup, check)
+    idx = idx_name(fname, index_format)
+    changed = update_file(
+        idx, index_data(locations, index_format), backup, check,
+    ) or changed
+    if not check:
+        freshen_index(fname, idx)
+
+    return changed
+
+
+def format_text(text, fname='<buffer>'):
+    """
+    Format the text of a protobuf file, returning the formatted text
+    and its locations.
+    """
+
+    pbfile = Protobuf(Parser(fname).parse_text(text))
+    lines = pbfile.render()
+    return ''.join(line + '\n' for line in lines), pbfile.locations
+
+
+class FormatHandler(socketserver.StreamRequestHandler):
+    """
+    Handles a single request to a ``FormatServer``.  The client sends
+    a JSON object containing the protobuf file ``text`` and, optionally,
+    its ``fname``, then shuts down its side of the connection.  The
+    response is a JSON object containing the formatted ``text`` and its
+    ``locations``, or an ``error`` message.
+    """
+
+    def handle(self):
+        try:
+            request = json.loads(six.ensure_str(self.rfile.read()))
+            text = request['text']
+            fname = request.get('fname', '<buffer>')
+        except (ValueError, TypeError, KeyError, AttributeError):
+            request = None
+            response = {'error': 'Invalid request'}
+
+        if request is not None:
+            # Always reply, so the client sees the error rather than a
+            # dropped connection
+            try:
+                text, locations = format_text(text, fname)
+                response = {'text': text, 'locations': locations}
+            except PBException as exc:
+                response = {'error': str(exc)}
+            except Exception as exc:
+                response = {'error': '%s: %s' % (fname, exc)}
+
+        self.wfile.write(json.dumps(response).encode('utf-8'))
+
+
+class FormatServer(socketserver.ThreadingMixIn,
+                   socketserver.UnixStreamServer):
+    """
+    A server listening on a Unix domain socket, which formats protobuf
+    files sent to it.  This allows editors and hooks to format buffers
+    without starting a new process for each one.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path):
+        if os.path.exists(path):
+            os.unlink(path)
+
+        socketserver.UnixStreamServer.__init__(self, path, FormatHandler)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        try:
+            os.unlink(self.server_address)
+        except OSError:
+            pass
+
+
+def format_remote(path, text, fname='<buffer>'):
+    """
+    Format the text of a protobuf file using a ``FormatServer``.
+    """
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        sock.sendall(json.dumps({'fname': fname, 'text': text})
+                     .encode('utf-8'))
+        sock.shutdown(socket.SHUT_WR)
+
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    finally:
+        sock.close()
+
+    response = json.loads(b''.join(chunks).decode('utf-8'))
+    if 'error' in response:
+        raise PBException(response['error'])
+    return response['text'], response['locations']
+
+
+class PollMonitor(object):
+    """
+    Detects changes to the files in a set of directories by polling
+    their modification times.
+    """
+
+    def __init__(self, dirs, interval=0.5):
+        self.dirs = dirs
+        self.interval = interval
+
+        self._stats = self._scan()
+
+    def _scan(self):
+        stats = {}
+        for dirname in self.dirs:
+            for name in os.listdir(dirname):
+                path = os.path.join(dirname, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                stats[path] = (st.st_mtime, st.st_size)
+        return stats
+
+    def wait(self):
+        """
+        Wait for files to change.
+        """
+
+        while True:
+            time.sleep(self.interval)
+
+            stats = self._scan()
+            changed = set(
+                path for path, stat in stats.items()
+                if self._stats.get(path) != stat
+            )
+            self._stats = stats
+
+            if changed:
+                return changed
+
+    def close(self):
+        pass
+
+
+class InotifyMonitor(object):
+    """
+    Detects changes to the files in a set of directories using the
+    Linux inotify interface.  Constructing this raises ``OSError`` or
+    ``AttributeError`` if inotify is not available.
+    """
+
+    # Event flags from <sys/inotify.h>; files are reported once they
+    # have been written and closed, or renamed into place, as editors
+    # often do on save
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+
+    # The fixed part of struct inotify_event
+    EVENT = struct.Struct('iIII')
+
+    def __init__(self, dirs):
+        # ctypes is only needed when watching, so it is imported here
+        import ctypes.util
+
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+
+        self._fd = libc.inotify_init()
+        if self._fd < 0:
+            self._error()
+
+        self._wds = {}
+        try:
+            for dirname in dirs:
+                wd = libc.inotify_add_watch(
+                    self._fd,
+                    dirname.encode(sys.getfilesystemencoding()),
+                    self.IN_CLOSE_WRITE | self.IN_MOVED_TO,
+                )
+                if wd < 0:
+                    self._error()
+                self._wds[wd] = dirname
+        except Exception:
+            self.close()
+            raise
+
+    @staticmethod
+    def _error():
+        import ctypes
+
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+
+    def wait(self):
+        """
+        Wait for files to change.
+        """
+
+        select.select([self._fd], [], [])
+
+        # Read all the queued events at once, so that several writes
+        # in quick succession are handled together
+        data = os.read(self._fd, 65536)
+
+        changed = set()
+        pos = 0
+        while pos < len(data):
+            wd, _mask, _cookie, length = self.EVENT.unpack_from(data, pos)
+            pos += self.EVENT.size
+            name = data[pos:pos + length].rstrip(b'\0')
+            pos += length
+
+            if wd in self._wds:
+                changed.add(os.path.join(
+                    self._wds[wd], name.decode(sys.getfilesystemencoding()),
+                ))
+
+        return changed
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class Watcher(object):
+    """
+    Watches protobuf files and reformats each one, along with its
+    location index, whenever it changes.  The hash of each file is
+    remembered, so files whose text is unchanged, including the
+    watcher's own writes, are not parsed again.
+    """
+
+    def __init__(self, paths, cache=None, ast_cache=None, interval=0.5,
+                 backup=False, index_format='yaml'):
+        self.cache = cache
+        self.ast_cache = ast_cache
+        self.interval = interval
+        self.backup = backup
+        self.index_format = index_format
+
+        # Maps each directory to the set of file names to watch in it,
+        # or to None if all protobuf files are to be watched
+        self._dirs = {}
+        for path in paths:
+            path = os.path.abspath(path)
+            if os.path.isdir(path):
+                self._dirs[path] = None
+            else:
+                dirname, name = os.path.split(path)
+                names = self._dirs.setdefault(dirname, set())
+                if names is not None:
+                    names.add(name)
+
+        self._digests = {}
+
+    def watched(self, fname):
+        """
+        Determine whether a file is being watched.
+        """
+
+        dirname, name = os.path.split(fname)
+        if dirname not in self._dirs or not name.endswith('.proto'):
+            return False
+
+        names = self._dirs[dirname]
+        return names is None or name in names
+
+    def files(self):
+        """
+        List the watched files that exist.
+        """
+
+        files = []
+        for dirname, names in self._dirs.items():
+            for name in os.listdir(dirname) if names is None else names:
+                fname = os.path.join(dirname, name)
+                if self.watched(fname) and os.path.isfile(fname):
+                    files.append(fname)
+        return sorted(files)
+
+    def update(self, fname):
+        """
+        Reformat a file if it has changed.
+        """
+
+        try:
+            digest = FormatCache.digest(fname)
+        except EnvironmentError:
+            # The file was removed
+            self._digests.pop(fname, None)
+            return
+
+        if self._digests.get(fname) == digest:
+            return
+        self._digests[fname] = digest
+
+        # Files already formatted need not be parsed at all
+        idx = idx_name(fname, self.index_format)
+        if (self.cache and os.path.exists(idx) and
+                self.cache.fresh(fname, digest)):
+            freshen_index(fname, idx)
+            return
+
+        print('Processing file %s' % fname)
+        try:
+            digest, _changed = write_file(
+                fname, Parser.parse(fname, self.ast_cache), self.backup,
+                index_format=self.index_format,
+            )
+        except (PBException, EnvironmentError) as exc:
+            print(exc, file=sys.stderr)
+            return
+
+        self._digests[fname] = digest
+        if self.cache:
+            self.cache.update(fname, digest)
+            self.cache.save()
+
+        sys.stdout.flush()
+
+    def run(self):
+        """
+        Format the watched files, then watch them for changes until
+        interrupted.
+        """
+
+        for fname in self.files():
+            self.update(fname)
+
+        try:
+            monitor = InotifyMonitor(list(self._dirs))
+        except (OSError, AttributeError):
+            monitor = PollMonitor(list(self._dirs), self.interval)
+
+        try:
+            while True:
+                for fname in sorted(monitor.wait()):
+                    if self.watched(fname):
+                        self.update(fname)
+        finally:
+            monitor.close()
+
+
+@fast_cli.argument(
     'files',
-    nargs='+',
-    help='The protobuf files to reformat.',
+    nargs='*',
+    help='The protobuf files to reformat.  With --watch, directories '
+    'of protobuf files may also be given.',
+)
+@fast_cli.argument(
+    '--cache', '-c',
+    help='A file in which to record the files already formatted.  '
+    'Files that have not changed since they were last formatted are '
+    'skipped entirely.',
+)
+@fast_cli.argument(
+    '--ast-cache', '-a',
+    help='A directory in which to cache parsed files.',
+)
+@fast_cli.argument(
+    '--jobs', '-j',
+    type=int,
+    default=1,
+    help='The number of files to format in parallel.  A value of 0 '
+    'uses one process per CPU.  Default: %(default)s',
+)
+@fast_cli.argument(
+    '--watch', '-w',
+    action='store_true',
+    help='Keep running, reformatting each file whenever it changes.',
+)
+@fast_cli.argument(
+    '--interval', '-i',
+    type=float,
+    default=0.5,
+    help='With --watch, the interval in seconds at which to poll for '
+    'changes if inotify is not available.  Default: %(default)s',
+)
+@fast_cli.argument(
+    '--backup', '-b',
+    action='store_true',
+    help='Keep a copy of each changed file with a "~" suffix.',
 )
-@cli_tools.argument(
+@fast_cli.argument(
+    '--check',
+    action='store_true',
+    help='Report the files that would be changed, without changing them.  '
+    'Exits with a nonzero status if any would be changed.',
+)
+@fast_cli.argument(
+    '--index-format', '-f',
+    choices=sorted(INDEX_FORMATS),
+    default='yaml',
+    help='The format of the location index files.  The JSON index is '
+    'written to a file with a ".idx.json" extension.  Default: %(default)s',
+)
+@fast_cli.argument(
+    '--yaml-impl', '-Y',
+    choices=yaml_compat.IMPLS,
+    default='auto',
+    help='The PyYAML implementation to use for the location index files: '
+    '"c" for libyaml, "python" for pure Python, or "auto" for libyaml if '
+    'available.  Default: %(default)s',
+)
+@fast_cli.argument(
+    '--block', '-B',
+    metavar='NAME',
+    help='Reformat only the message, enum, or extension block with the '
+    'full name NAME, updating the location index to match.  Requires a '
+    'single protobuf file with an up-to-date location index.',
+)
+@fast_cli.argument(
+    '--lines', '-l',
+    metavar='FIRST[-LAST]',
+    help='Reformat only the innermost message, enum, or extension block '
+    'containing the given lines, as with --block.',
+)
+@fast_cli.argument(
+    '--serve', '-s',
+    metavar='SOCKET',
+    help='Instead of reformatting files, listen on the Unix domain socket '
+    'SOCKET and format the protobuf files sent to it.',
+)
+@fast_cli.argument(
     '--debug', '-d',
     action='store_true',
     help='Enable debugging output.',
 )
-def main(files):
-    for fname in files:
-        print('Processing file %s' % fname)
+def main(files, cache=None, ast_cache=None, jobs=1, watch=False,
+         interval=0.5, backup=False, check=False, index_format='yaml',
+         yaml_impl='auto', block=None, lines=None, serve=None):
+    yaml_compat.select(yaml_impl)
 
-        pbfile = Parser.parse(fname)
+    if serve:
+        server = FormatServer(serve)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        return None
+    elif not files:
+        return 'No protobuf files specified'
+
+    if block or lines:
+        if len(files) != 1:
+            return 'Exactly one protobuf file must be given with --%s' % (
+                'block' if block else 'lines',
+            )
 
-        shutil.move(fname, fname + '~')
-        with open(fname, 'w') as f:
-            print('\n'.join(pbfile.render()), file=f)
+        if lines:
+            first, _sep, last = lines.partition('-')
+            try:
+                lines = (int(first), int(last or first))
+            except ValueError:
+                return 'Invalid line range "%s"' % lines
 
-        idx = os.path.splitext(fname)[0] + '.idx'
-        if os.path.exists(idx):
-            shutil.move(idx, idx + '~')
-        with open(idx, 'w') as f:
-            yaml.safe_dump(
-                pbfile.locations, f,
-                default_flow_style=False,
-                explicit_start=True,
+        try:
+            changed = format_block(
+                files[0], block, lines, backup, check, index_format,
             )
+        except (PBException, EnvironmentError) as exc:
+            return str(exc)
+
+        if check:
+            if changed:
+                print('Would reformat %s' % files[0])
+                return 1
+        else:
+            print('Processing file %s' % files[0])
+        return None
+
+    cache = FormatCache(cache) if cache else None
+    ast_cache = ASTCache(ast_cache) if ast_cache else None
+
+    if watch:
+        try:
+            Watcher(
+                files, cache, ast_cache, interval, backup, index_format,
+            ).run()
+        except KeyboardInterrupt:
+            pass
+        return None
+
+    fmt = functools.partial(
+        format_file, ast_cache=ast_cache, backup=backup, check=check,
+        index_format=index_format,
+    )
+
+    # Select the files that need formatting
+    todo = []
+    for fname in files:
+        idx = idx_name(fname, index_format)
+        if (cache and os.path.exists(idx) and
+                cache.fresh(fname, FormatCache.digest(fname))):
+            if not check:
+                freshen_index(fname, idx)
+            continue
+        todo.append(fname)
+
+    # multiprocessing is slow to import, so it is only imported when
+    # the files may be formatted in parallel
+    if jobs != 1:
+        import multiprocessing
+
+    if jobs <= 0:
+        jobs = multiprocessing.cpu_count()
+    jobs = min(jobs, len(todo))
+
+    pool = None
+    if jobs > 1:
+        # Files are independent, so fan them out; imap() still returns
+        # the results in the order the files were given
+        pool = multiprocessing.Pool(jobs)
+        results = pool.imap(fmt, todo, max(1, len(todo) // (jobs * 4)))
+    else:
+        results = (fmt(fname) for fname in todo)
+
+    errors = 0
+    changes = 0
+    try:
+        for fname, digest, changed, error in results:
+            if check:
+                if changed:
+                    print('Would reformat %s' % fname)
+            else:
+                print('Processing file %s' % fname)
+
+            if error:
+                print(error, file=sys.stderr)
+                errors += 1
+            elif changed:
+                changes += 1
+                if cache and not check:
+                    cache.update(fname, digest)
+            elif cache:
+                cache.update(fname, digest)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+        if cache:
+            cache.save()
+
+    return 1 if errors or (check and changes) else None
 
 
 if __name__ == '__main__':
-    sys.exit(main.console())
+    # Run the module as imported, rather than as __main__, so that the
+    # classes pickled by the AST cache are named for the module and can
+    # be loaded by the other tools
+    import protobuf_fmt
+    sys.exit(protobuf_fmt.main.console())
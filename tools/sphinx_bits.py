@@ -0,0 +1,135 @@
+"""
+A Sphinx extension providing the ``bits`` directive, which renders a
+YAML description of a protocol packet, as used by proto_bits.py, into
+a literal block:
+
+.. code-block:: rst
+
+    .. bits:: bits/carrier.bits
+
+The rendered text is cached in the build environment, keyed by the
+hash of the description, and the description is recorded as a
+dependency of the document, so that only the documents using a
+changed description are read again.
+"""
+
+import hashlib
+
+from docutils import nodes
+from docutils.parsers.rst import directives
+from sphinx.util.docutils import SphinxDirective
+
+import proto_bits
+
+
+# Bump this whenever the data kept in the build environment changes
+ENV_VERSION = 1
+
+
+def _init_env(env):
+    # Maps the hash of each rendered description to the rendered text
+    if not hasattr(env, 'bits_cache'):
+        env.bits_cache = {}
+
+    # Maps each document name to the set of hashes of the descriptions
+    # it renders
+    if not hasattr(env, 'bits_docs'):
+        env.bits_docs = {}
+
+
+def render(env, fname, indent=''):
+    """
+    Render a packet description, consulting the cache in the build
+    environment.
+    """
+
+    _init_env(env)
+
+    with open(fname, 'rb') as f:
+        digest = hashlib.sha256(
+            ('%d:%r:' % (proto_bits.VERSION, indent)).encode('utf-8') +
+            f.read()
+        ).hexdigest()
+
+    if digest not in env.bits_cache:
+        env.bits_cache[digest] = proto_bits.render_file(fname, indent, True)
+    env.bits_docs.setdefault(env.docname, set()).add(digest)
+
+    return env.bits_cache[digest]
+
+
+class BitsDirective(SphinxDirective):
+    """
+    Render a YAML description of a protocol packet into a literal
+    block.
+    """
+
+    has_content = False
+    required_arguments = 1
+    optional_arguments = 0
+    final_argument_whitespace = True
+    option_spec = {
+        'indent': directives.unchanged,
+    }
+
+    def run(self):
+        rel_fname, fname = self.env.relfn2path(self.arguments[0])
+        self.env.note_dependency(rel_fname)
+
+        try:
+            text = render(self.env, fname, self.options.get('indent', ''))
+        except Exception as exc:
+            return [self.state.document.reporter.warning(
+                'Unable to render "%s": %s' % (rel_fname, exc),
+                line=self.lineno,
+            )]
+
+        node = nodes.literal_block(text, text, source=fname)
+        node['language'] = 'none'
+        self.set_source_info(node)
+
+        return [node]
+
+
+def purge_doc(app, env, docname):
+    _init_env(env)
+    env.bits_docs.pop(docname, None)
+
+
+def merge_info(app, env, docnames, other):
+    # Merges the renders done by a parallel reader
+    _init_env(env)
+    _init_env(other)
+
+    env.bits_cache.update(other.bits_cache)
+    for docname in docnames:
+        if docname in other.bits_docs:
+            env.bits_docs[docname] = other.bits_docs[docname]
+
+
+def prune_cache(app, env):
+    # Discards renders no longer used by any document
+    _init_env(env)
+
+    used = set()
+    for digests in env.bits_docs.values():
+        used |= digests
+    for digest in list(env.bits_cache):
+        if digest not in used:
+            del env.bits_cache[digest]
+
+    return []
+
+
+def setup(app):
+    app.add_directive('bits', BitsDirective)
+    app.connect('env-purge-doc', purge_doc)
+    app.connect('env-merge-info', merge_info)
+    app.connect('env-updated', prune_cache)
+
+    return {
+        'version': '%d' % proto_bits.VERSION,
+        'env_version': ENV_VERSION,
+        'parallel_read_safe': True,
+        'parallel_write_safe': True,
+    }
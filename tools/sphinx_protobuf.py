@@ -0,0 +1,314 @@
+"""
+A Sphinx extension providing the ``proto-include`` directive, which
+includes the definitions of protobuf messages and enumerations by
+name, rather than by line numbers:
+
+.. code-block:: rst
+
+    .. proto-include:: net.kevnet.humboldt.ConnType
+                       net.kevnet.humboldt.NodeID
+       :caption: :download:`node_id.proto <protobuf/node_id.proto>`
+
+The named blocks, along with their lead-in comments, must be defined
+by the same file; the lines from the first through the last are
+included, with their line numbers.  The lines are found from the
+location index written by protobuf_fmt.py, or, if the index is missing
+or older than the file, by parsing and rendering the file, so the file
+is expected to be formatted.
+
+Documents do not depend on the protobuf files as a whole: a document
+is read again only when the text or position of a block it includes
+changes.  This holds even when a caption downloads the file, as in the
+example.
+"""
+
+import hashlib
+import os
+import re
+
+from docutils import nodes
+from docutils.parsers.rst import directives
+from sphinx.directives.code import container_wrapper
+from sphinx.util.docutils import SphinxDirective
+
+import protobuf_fmt
+
+
+# Bump this whenever the data kept in the build environment changes
+ENV_VERSION = 1
+
+# The block types that may be included
+BLOCK_TYPES = ('message', 'enum')
+
+PACKAGE_RE = re.compile(r'^\s*package\s+([\w.]+)\s*;')
+
+
+class ProtoFile(object):
+    """
+    The text and location index of a protobuf file.
+    """
+
+    def __init__(self, fname):
+        self.fname = fname
+
+        with open(fname) as f:
+            self.lines = f.read().splitlines(True)
+
+        self.package = None
+        for line in self.lines:
+            match = PACKAGE_RE.match(line)
+            if match:
+                self.package = match.group(1)
+                break
+
+        mtime = os.path.getmtime(fname)
+        for fmt in ('json', 'yaml'):
+            idx = protobuf_fmt.idx_name(fname, fmt)
+            if os.path.exists(idx) and os.path.getmtime(idx) >= mtime:
+                self.index = protobuf_fmt.LocationIndex.load(fname, fmt)
+                break
+        else:
+            pbfile = protobuf_fmt.Parser.parse(fname)
+            pbfile.render()
+            self.index = protobuf_fmt.LocationIndex(pbfile.locations)
+
+    def find(self, name):
+        """
+        Find the location of a message or enumeration, by its fully
+        qualified name, or ``None`` if the file does not define it.
+        """
+
+        name = name.lstrip('.')
+        if self.package:
+            if not name.startswith(self.package + '.'):
+                return None
+            name = name[len(self.package) + 1:]
+
+        for type_ in BLOCK_TYPES:
+            loc = self.index.get('%s:%s' % (type_, name))
+            if loc is not None:
+                return loc
+
+        return None
+
+
+# Maps the absolute name of each protobuf file to a tuple of its
+# modification time and size and its ProtoFile, or the PBException
+# raised loading it, so that each file is loaded once per build
+_files = {}
+
+
+def load(fname):
+    """
+    Load a protobuf file, consulting the cache.
+    """
+
+    stat = os.stat(fname)
+    key = (stat.st_mtime, stat.st_size)
+    cached = _files.get(fname)
+    if cached is None or cached[0] != key:
+        try:
+            cached = (key, ProtoFile(fname))
+        except protobuf_fmt.PBException as exc:
+            cached = (key, exc)
+        _files[fname] = cached
+
+    if isinstance(cached[1], protobuf_fmt.PBException):
+        raise cached[1]
+    return cached[1]
+
+
+def locate(env, names):
+    """
+    Locate the lines defining a list of blocks, all of which must be
+    defined by the same file, returning the name of the file, the first
+    and last line numbers, and the text of the lines.
+    """
+
+    fnames = []
+    for dirname in env.config.proto_include_dirs:
+        dirname = os.path.join(env.srcdir, dirname)
+        fnames.extend(
+            os.path.join(dirname, fname) for fname in sorted(os.listdir(dirname))
+            if fname.endswith('.proto')
+        )
+
+    pbfile = None
+    first = last = None
+    for name in names:
+        # A file that fails to load only matters if no other file
+        # defines the block
+        error = None
+        for fname in fnames:
+            try:
+                loc = load(fname).find(name)
+            except protobuf_fmt.PBException as exc:
+                error = error or exc
+                continue
+            if loc is not None:
+                break
+        else:
+            if error:
+                raise error
+            raise protobuf_fmt.PBException('"%s" is not defined' % name)
+
+        if pbfile is None:
+            pbfile = load(fname)
+        elif pbfile.fname != fname:
+            raise protobuf_fmt.PBException(
+                '"%s" is defined in %s, not %s' % (
+                    name, fname, pbfile.fname,
+                ),
+            )
+
+        first = loc.start if first is None else min(first, loc.start)
+        last = loc.end - 1 if last is None else max(last, loc.end - 1)
+
+    return (
+        pbfile.fname, first, last, ''.join(pbfile.lines[first - 1:last]),
+    )
+
+
+def _init_env(env):
+    # Maps each document name to a list of tuples of the names of the
+    # blocks included by each proto-include directive, the name of the
+    # file defining them, and the hash of their location and text
+    if not hasattr(env, 'proto_include_docs'):
+        env.proto_include_docs = {}
+
+
+def _digest(fname, first, last, text):
+    return hashlib.sha256(
+        ('%s:%d:%d:' % (fname, first, last)).encode('utf-8') +
+        text.encode('utf-8')
+    ).hexdigest()
+
+
+class ProtoIncludeDirective(SphinxDirective):
+    """
+    Include the definitions of protobuf messages and enumerations,
+    identified by their fully qualified names.
+    """
+
+    has_content = False
+    required_arguments = 1
+    optional_arguments = 0
+    final_argument_whitespace = True
+    option_spec = {
+        'caption': directives.unchanged_required,
+        'class': directives.class_option,
+        'name': directives.unchanged,
+    }
+
+    def run(self):
+        names = self.arguments[0].split()
+
+        _init_env(self.env)
+        includes = self.env.proto_include_docs.setdefault(
+            self.env.docname, [],
+        )
+
+        try:
+            fname, first, last, text = locate(self.env, names)
+        except (protobuf_fmt.PBException, EnvironmentError) as exc:
+            # Record the failure, so the document is read again once
+            # the blocks can be found
+            includes.append((tuple(names), None, None))
+            return [self.state.document.reporter.warning(
+                'Unable to include "%s": %s' % (' '.join(names), exc),
+                line=self.lineno,
+            )]
+
+        includes.append(
+            (tuple(names), fname, _digest(fname, first, last, text)),
+        )
+
+        node = nodes.literal_block(text, text, source=fname)
+        node['language'] = 'proto'
+        node['linenos'] = True
+        node['highlight_args'] = {'linenostart': first}
+        node['classes'] += self.options.get('class', [])
+        self.set_source_info(node)
+
+        if 'caption' in self.options:
+            node = container_wrapper(self, node, self.options['caption'])
+        self.add_name(node)
+
+        return [node]
+
+
+def get_outdated(app, env, added, changed, removed):
+    # Finds the documents including blocks that have changed or moved
+    _init_env(env)
+
+    outdated = []
+    for docname, includes in env.proto_include_docs.items():
+        if docname in changed or docname in removed:
+            continue
+
+        for names, _fname, digest in includes:
+            # A failed include is recorded with no digest, so it is
+            # outdated once it succeeds, and not while it still fails
+            try:
+                current = _digest(*locate(env, names))
+            except (protobuf_fmt.PBException, EnvironmentError):
+                current = None
+
+            if current != digest:
+                outdated.append(docname)
+                break
+
+    return outdated
+
+
+def drop_dependencies(app, doctree):
+    # Downloading a file makes the document depend on the whole file;
+    # for the files it includes blocks from, the blocks are tracked
+    # instead
+    env = app.env
+    _init_env(env)
+
+    fnames = set(
+        fname for _names, fname, _digest in
+        env.proto_include_docs.get(env.docname, []) if fname
+    )
+    deps = env.dependencies.get(env.docname)
+    if not fnames or not deps:
+        return
+
+    for dep in list(deps):
+        if os.path.normpath(os.path.join(app.srcdir, str(dep))) in fnames:
+            deps.discard(dep)
+
+
+def purge_doc(app, env, docname):
+    _init_env(env)
+    env.proto_include_docs.pop(docname, None)
+
+
+def merge_info(app, env, docnames, other):
+    # Merges the includes recorded by a parallel reader
+    _init_env(env)
+    _init_env(other)
+
+    for docname in docnames:
+        if docname in other.proto_include_docs:
+            env.proto_include_docs[docname] = other.proto_include_docs[docname]
+
+
+def setup(app):
+    app.add_config_value('proto_include_dirs', ['protobuf'], 'env')
+    app.add_directive('proto-include', ProtoIncludeDirective)
+    app.connect('env-get-outdated', get_outdated)
+
+    # Run after the dependencies of downloads are noted
+    app.connect('doctree-read', drop_dependencies, priority=900)
+    app.connect('env-purge-doc', purge_doc)
+    app.connect('env-merge-info', merge_info)
+
+    return {
+        'version': '%d' % protobuf_fmt.VERSION,
+        'env_version': ENV_VERSION,
+        'parallel_read_safe': True,
+        'parallel_write_safe': True,
+    }
@@ -0,0 +1,87 @@
+"""
+Selects the PyYAML implementation used by the tools.  When PyYAML was
+built with the libyaml bindings, ``CSafeLoader`` and ``CSafeDumper``
+are used, which load and dump several times faster than the pure
+Python ``SafeLoader`` and ``SafeDumper``; otherwise the pure Python
+classes are used.  Either may be forced with ``select``, which the
+tools expose as their ``--yaml-impl`` option.
+
+PyYAML is only imported when a document is actually loaded or dumped.
+"""
+
+
+# The implementations that may be selected: "auto" uses libyaml if
+# PyYAML was built with it, "c" requires libyaml, and "python" always
+# uses the pure Python implementation
+IMPLS = ('auto', 'c', 'python')
+
+# The selected implementation
+_impl = 'auto'
+
+
+def select(impl):
+    """
+    Select the PyYAML implementation to use.  Raises ``ValueError``
+    if "c" is selected and PyYAML was built without libyaml.
+    """
+
+    global _impl
+
+    if impl not in IMPLS:
+        raise ValueError('Unknown YAML implementation "%s"' % impl)
+    _impl = impl
+
+    if impl == 'c':
+        # Fail now, rather than at the first document
+        classes()
+
+
+def classes():
+    """
+    Retrieve the loader and dumper classes of the selected
+    implementation.
+    """
+
+    import yaml
+
+    if _impl != 'python':
+        try:
+            return yaml.CSafeLoader, yaml.CSafeDumper
+        except AttributeError:
+            if _impl == 'c':
+                raise ValueError('PyYAML was built without libyaml')
+
+    return yaml.SafeLoader, yaml.SafeDumper
+
+
+def load(stream):
+    """
+    Load a single YAML document.  This is equivalent to
+    ``yaml.safe_load``.
+    """
+
+    import yaml
+
+    return yaml.load(stream, Loader=classes()[0])
+
+
+def load_all(stream):
+    """
+    Load every YAML document in a stream.  This is equivalent to
+    ``yaml.safe_load_all``.
+    """
+
+    import yaml
+
+    return yaml.load_all(stream, Loader=classes()[0])
+
+
+def dump(data, stream=None, **kwargs):
+    """
+    Dump data as a YAML document.  This is equivalent to
+    ``yaml.safe_dump``.
+    """
+
+    import yaml
+
+    return yaml.dump(data, stream, Dumper=classes()[1], **kwargs)